@@ -8,61 +8,116 @@
 #######################################################################################################################
 
 
-import contextlib
-import dateutil.parser
-import json
-from urllib.request import urlopen, Request
-from urllib.error import URLError
-from github import Github
-from subprocess import run, SubprocessError
+from subprocess import run, SubprocessError, TimeoutExpired
 
 import cfg
 import setup
+import changelog
+import ghsink
+import executor
+import triggers
+import metrics
+import shards
+import cpupool
+import events
+from events import format_timestamp, of_type
+
+
+def render_line(event, log_detail, line_prefix):
+    """Строка changelog для одного события
+
+    :param event: Event
+    :param log_detail: small, medium или full
+    :param line_prefix: префикс каждой строки
+    :return: str
+    """
+    if event[2] == 'COMMIT':
+        if log_detail == 'small':
+            return f'{line_prefix}- {event[4]}\n'
+        if log_detail == 'medium':
+            return f'{line_prefix}{format_timestamp(event.ts)}: [{event[0]}, {event[2]}] {event[4]}\n'
+        return (f'{line_prefix}{format_timestamp(event.ts)} [{event[0]}] (type - {event[2]}, author - {event[3]}): '
+                f'{event[4]}\n')
+    release_prefix = '\n' + line_prefix
+    release_log = release_prefix + release_prefix.join(event[5].splitlines())
+    if log_detail == 'small':
+        return f'{line_prefix}Version: {event[4]}:\n{release_log}\n'
+    if log_detail == 'medium':
+        return f'{line_prefix}{format_timestamp(event.ts)}: [{event[0]}, {event[2]}] {event[4]}:\n{release_log}\n'
+    return (f'{line_prefix}{format_timestamp(event.ts)} [{event[0]}] (type - {event[2]}, author - {event[3]}): '
+            f'{event[4]}:\n{release_log}\n')
+
+
+def render_logs(rows, event_type, log_detail, line_prefix):
+    """Текст changelog из событий одного типа
+
+    Строка каждого события запоминается в самом событии (Event.line) и при том же формате
+    повторно не формируется.
+
+    :param rows: список Event
+    :param event_type: 'COMMIT' или 'RELEASE'
+    :param log_detail: small, medium или full
+    :param line_prefix: префикс каждой строки
+    :return: str
+    """
+    line_format = (log_detail, line_prefix)
+    lines = []
+    for event in of_type(rows, event_type):
+        if event.line is None or event.line[0] != line_format:
+            event.line = (line_format, render_line(event, log_detail, line_prefix))
+        lines.append(event.line[1])
+    return ''.join(lines)
+
+
+def render_packed(packed, event_type, log_detail, line_prefix):
+    """render_logs для событий в виде events.pack (выполняется в пуле процессов, см. cpupool.py)"""
+    return render_logs(events.unpack(packed), event_type, log_detail, line_prefix)
 
 
-def get_logs(commands, repos, data, options=cfg.OPTIONS):
+def get_logs(commands, repos, data, options=cfg.OPTIONS, ctx=None):
     """Создание многострочного лога (блока текста) из данных, хранящихся в data
 
+    Текст формируется один раз за цикл для каждого сочетания событий, log_detail и line_prefix
+    и используется всеми действиями раздела (см. context.CycleData.get_logs).
+    Большие changelog форматируются в пуле процессов, если он включен (process_pool).
+
     :param commands:
     :param repos:
     :param data:
     :param options:
+    :param ctx: данные цикла (context.CycleData)
     :return:
     """
     cfg.LOGGER.info(f'Combining several events from {repos} into one changelog')
     log_detail = options[repos]['log_detail'].lower()
     line_prefix = options[repos]['line_prefix']
-    release_prefix = '\n' + line_prefix
     log = ''
     try:
         if 'commits' in commands or 'old_commits' in commands:
-            for i in data[repos]:
-                if f'{i[2]}' == 'COMMIT':
-                    log += line_prefix
-                    if log_detail == 'small':
-                        log += f'- {i[4]}\n'
-                    elif log_detail == 'medium':
-                        log += f'{dateutil.parser.parse(i[1]).strftime("%Y-%m-%d %H:%M:%S")}: [{i[0]}, {i[2]}] {i[4]}\n'
-                    else:
-                        log += f'{dateutil.parser.parse(i[1]).strftime("%Y-%m-%d %H:%M:%S")} [{i[0]}] (type - {i[2]}, author - {i[3]}): {i[4]}\n'
+            event_type = 'COMMIT'
         elif 'releases' in commands or 'old_releases' in commands:
-            for i in data[repos]:
-                if f'{i[2]}' == 'RELEASE':
-                    log += line_prefix
-                    release_log = release_prefix + release_prefix.join(i[5].splitlines())
-                    if log_detail == 'small':
-                        log += f'Version: {i[4]}:\n{release_log}\n'
-                    elif log_detail == 'medium':
-                        log += f'{dateutil.parser.parse(i[1]).strftime("%Y-%m-%d %H:%M:%S")}: [{i[0]}, {i[2]}] {i[4]}:\n{release_log}\n'
-                    else:
-                        log += f'{dateutil.parser.parse(i[1]).strftime("%Y-%m-%d %H:%M:%S")} [{i[0]}] (type - {i[2]}, author - {i[3]}): {i[4]}:\n{release_log}\n'
+            event_type = 'RELEASE'
+        else:
+            return log
+        rows = data[repos]
+
+        def render():
+            events_list = events.to_events(rows)
+            if len(events_list) >= cpupool.MIN_WEIGHT and cpupool.get_pool() is not None:
+                return cpupool.run(render_packed, events.pack(events_list), event_type, log_detail, line_prefix,
+                                   weight=len(events_list))
+            return render_logs(events_list, event_type, log_detail, line_prefix)
+
+        if ctx is None:
+            return render()
+        log = ctx.get_logs(rows, (event_type, log_detail, line_prefix), render)
     except IndexError as e:
         cfg.LOGGER.error(f'Error in logs from {data[repos]}. Reason: IndexError {e.args}')
         log = ''
     return log
 
 
-def get_data_for_actions(commands, repos, data, options=cfg.OPTIONS):
+def get_data_for_actions(commands, repos, data, options=cfg.OPTIONS, ctx=None):
     """Подготовка данных для выполнения над ними действий, описанных в конфигурационном файле
 
     Данные представляют собой:
@@ -74,17 +129,18 @@ def get_data_for_actions(commands, repos, data, options=cfg.OPTIONS):
     :param repos:
     :param data:
     :param options:
+    :param ctx: данные цикла (context.CycleData). Из него берутся данные, сохраненные в предыдущем цикле
     :return:
     """
     cfg.LOGGER.info(f'Preparing {repos} changelogs for processing by {commands}')
     try:
         data_for_actions = commands[3].lower()
         if data_for_actions == 'commits' or data_for_actions == 'releases':
-            data_for_actions = get_logs(commands, repos, data, options)
+            data_for_actions = get_logs(commands, repos, data, options, ctx)
         elif data_for_actions == 'old_commits' or data_for_actions == 'old_releases':
-            old_data = setup.load_data()
+            old_data = ctx.old_data if ctx else setup.load_data()
             if old_data:
-                data_for_actions = get_logs(commands, repos, old_data, options)
+                data_for_actions = get_logs(commands, repos, old_data, options, ctx)
         else:
             data_for_actions = options[repos][data_for_actions] + '\n'
         return data_for_actions
@@ -94,7 +150,8 @@ def get_data_for_actions(commands, repos, data, options=cfg.OPTIONS):
     return data_for_actions
 
 
-def action_console(commands, args, repos, data, options=cfg.OPTIONS):
+@metrics.timed
+def action_console(commands, args, repos, data, options=cfg.OPTIONS, ctx=None):
     """Вывод данных, полученных из функции get_data_for_actions, на консоль
 
     :param commands:
@@ -102,12 +159,13 @@ def action_console(commands, args, repos, data, options=cfg.OPTIONS):
     :param repos:
     :param data:
     :param options:
+    :param ctx: данные цикла (context.CycleData)
     :return:
     """
     cfg.LOGGER.info(f'Printing {repos} changelogs to console')
     try:
         if commands[0].lower() == 'local' and commands[1].lower() == 'console' and commands[2].lower() == 'print':
-            data_for_actions = get_data_for_actions(commands, repos, data, options)
+            data_for_actions = get_data_for_actions(commands, repos, data, options, ctx)
             if data_for_actions:
                 print(data_for_actions.rstrip())
                 return True
@@ -116,63 +174,42 @@ def action_console(commands, args, repos, data, options=cfg.OPTIONS):
     return False
 
 
-def action_file(commands, args, repos, data, options=cfg.OPTIONS):
+@metrics.timed
+def action_file(commands, args, repos, data, options=cfg.OPTIONS, ctx=None):
     """Вывод данных, полученных из функции get_data_for_actions, в файл.
 
+    Файл не перечитывается целиком при каждом действии (см. changelog.py).
+    Процесс, запущенный координатором (gitmon.py --workers N), передает изменения файла ему (см. shards.py).
+
     :param commands:
     :param args: имя файла
     :param repos:
     :param data:
     :param options:
+    :param ctx: данные цикла (context.CycleData)
     :return:
     """
     try:
         if commands[0].lower() == 'local' and commands[1].lower() == 'file':
-            data_for_actions = get_data_for_actions(commands, repos, data, options)
+            data_for_actions = get_data_for_actions(commands, repos, data, options, ctx)
             file = args
             if data_for_actions and file:
-                with open(file, 'a+', newline='\n', buffering=True, encoding='utf-8') as logfile:
-                    logfile.seek(0, 0)
-                    content = logfile.read()
                 max_len = options[repos]['file_max_size']
-                if commands[2].lower() == 'write':
+                if cfg.SPOOL_PATH and commands[2].lower() in ('write', 'insert', 'append', 'delete'):
+                    cfg.LOGGER.info(f'Passing {commands[2].lower()} of {repos} changelogs to file {args} to the coordinator')
+                    shards.spool_edit(file, commands[2].lower(), data_for_actions, max_len, repos)
+                elif commands[2].lower() == 'write':
                     cfg.LOGGER.info(f'Writing {repos} changelogs to file {args}')
-                    content = data_for_actions.splitlines()
-                    data_len = len(content)
-                    if data_len > max_len:
-                        cfg.LOGGER.info(f'File {file} reached {max_len} strings. Truncating...')
-                        content = content[0:max_len]
-                    content = '\n'.join(i for i in content) + '\n'
-                    with open(file, 'w+', newline='\n', buffering=True, encoding='utf-8') as logfile:
-                        logfile.write(content)
+                    changelog.write(file, data_for_actions, max_len)
                 elif commands[2].lower() == 'insert':
                     cfg.LOGGER.info(f'Inserting {repos} changelogs to top of the file {args}')
-                    content = (data_for_actions + content).splitlines()
-                    data_len = len(content)
-                    if data_len > max_len:
-                        cfg.LOGGER.info(f'File {file} reached {max_len} strings. Truncating...')
-                        content = content[0:max_len]
-                    content = '\n'.join(i for i in content) + '\n'
-                    with open(file, 'w+', newline='\n', buffering=True, encoding='utf-8') as logfile:
-                        logfile.write(content)
+                    changelog.insert(file, data_for_actions, max_len)
                 elif commands[2].lower() == 'append':
                     cfg.LOGGER.info(f'Appending {repos} changelogs to end of the file {args}')
-                    if not content.endswith('\n') and content.strip():
-                        content += '\n'
-                    content = (content + data_for_actions).splitlines()
-                    data_len = len(content)
-                    if data_len > max_len:
-                        cfg.LOGGER.info(f'File {file} reached {max_len} strings. Truncating...')
-                        content = content[data_len - max_len - 1:data_len]
-                    content = '\n'.join(i for i in content) + '\n'
-                    with open(file, 'w+', newline='\n', buffering=True, encoding='utf-8') as logfile:
-                        logfile.write(content)
+                    changelog.append(file, data_for_actions, max_len)
                 elif commands[2].lower() == 'delete':
                     cfg.LOGGER.info(f'Deleting old {repos} changelogs from file {args}')
-                    for old_line in data_for_actions.splitlines():
-                        content = content.replace(old_line, '').lstrip()
-                    with open(file, 'w+', newline='\n', buffering=True, encoding='utf-8') as logfile:
-                        logfile.write(content)
+                    changelog.delete(file, data_for_actions)
                 else:
                     cfg.LOGGER.error(f'Error in {repos} local file actions configuration. Reason: unknown command {commands[2]}.')
                     return False
@@ -184,6 +221,7 @@ def action_file(commands, args, repos, data, options=cfg.OPTIONS):
     return False
 
 
+@metrics.timed
 def action_shell(commands, args):
     """Выполнение произвольной команды или скрипта
 
@@ -194,16 +232,20 @@ def action_shell(commands, args):
     cfg.LOGGER.info(f'Executing shell command "{args}"')
     if args:
         try:
-            run(args=args, shell=True, check=True)
+            run(args=args, shell=True, check=True, timeout=cfg.SHELL_TIMEOUT or None)
+        except TimeoutExpired:
+            cfg.LOGGER.error(f'Error {args} execution. Timeout {cfg.SHELL_TIMEOUT} s expired.')
         except SubprocessError as e:
             cfg.LOGGER.error(f'Error {args} execution. Exit status: {e.returncode}.')
         else:
             return True
-    cfg.LOGGER.error(f'No shell command is given')
+    else:
+        cfg.LOGGER.error(f'No shell command is given')
     return False
 
 
-def action_dockerhub(commands, args, timeout=10):
+@metrics.timed
+def action_dockerhub(commands, args, repos=''):
     """Запуск компиляции вашего образа на hub.docker.com
 
     Необходимо заранее настроить automated build и прописать путь к его триггеру
@@ -212,9 +254,12 @@ def action_dockerhub(commands, args, timeout=10):
 
     Как настроить automated build: https://docs.docker.com/docker-hub/builds/
 
+    Сборка не запускается сразу: запросы на один и тот же Trigger URL и tag, пришедшие в течение
+    dockerhub_debounce секунд, объединяются в один запуск (см. triggers.py).
+
     :param commands:
     :param args:
-    :param timeout:
+    :param repos:
     :return:
     """
     cfg.LOGGER.info(f'Executing {commands} on hub.docker.com')
@@ -226,103 +271,59 @@ def action_dockerhub(commands, args, timeout=10):
                 tag = commands[2]
             except IndexError:
                 pass
-            params = json.dumps({"docker_tag": f"{tag}"}).encode('utf8')
-            trigger_request = Request(url, data=params, headers={'content-type': 'application/json'})
-            with contextlib.closing(urlopen(trigger_request, timeout=timeout)) as res:
-                cfg.LOGGER.info(f'The result of the {commands} command: {res.msg}')
-                if res.status == 200:
-                    return True
-    except URLError as e:
-        if hasattr(e, 'reason'):
-            cfg.LOGGER.error(f'We failed to reach a url: {url}. Reason: {e.reason}')
-        elif hasattr(e, 'code'):
-            cfg.LOGGER.error(f'The server couldn\'t fulfill the request. Error code: {e.code}')
+            if url:
+                triggers.add(url, tag, repos)
+                return True
+            cfg.LOGGER.error(f'No Trigger URL is given for {commands}')
     except IndexError as e:
         cfg.LOGGER.error(f'Error in dockerhub action configuration. Reason: IndexError {e.args}.')
     return False
 
 
-def action_github(commands, args, repos, data, options=cfg.OPTIONS):
+@metrics.timed
+def action_github(commands, args, repos, data, options=cfg.OPTIONS, ctx=None):
     """Вывод данных, полученных из функции get_data_for_actions, в файл вашего репозитария на github.com
 
     Необходимо заранее сгенерить personal access token (https://github.com/settings/tokens) и прописать его
     в конфигурационный файл:
     github_token: <ваш token>
 
+    Изменения не записываются сразу, а накапливаются и в конце цикла записываются одним коммитом
+    на каждый репозитарий (см. ghsink.py).
+
     :param commands:
     :param args:
     :param repos:
     :param data:
     :param options:
+    :param ctx: данные цикла (context.CycleData)
     :return:
     """
     cfg.LOGGER.info(f'Performing {commands} for repo {repos} on github')
     try:
         if commands[0].lower() == 'github':
-            gh = Github(login_or_token=options[repos]['github_token'])
-            user = gh.get_user()
-            if user:
-                cfg.LOGGER.info(f'Connected to {user.name} github')
-                repo = user.get_repo(commands[1])
-                cfg.LOGGER.info(f'Accessing repo {repo.full_name}')
-                # file = '/' + args
-                file = args
-                try:
-                    repo.create_file(file, f'GitMon create file', '')
-                except:
-                    pass
-                cfg.LOGGER.info(f'Reading {file}')
-                gh_content = repo.get_file_contents(file)
-                content = gh_content.decoded_content.decode('utf-8')
-                data_for_actions = get_data_for_actions(commands, repos, data, options)
-                max_len = options[repos]['file_max_size']
-                if data_for_actions:
-                    cfg.LOGGER.info(f'Processing file {file}')
-                    if commands[2].lower() == 'write':
-                        cfg.LOGGER.info(f'Writing {repos} changelogs to file {file}')
-                        content = data_for_actions.splitlines()
-                        data_len = len(content)
-                        if data_len > max_len:
-                            cfg.LOGGER.info(f'File {file} reached {max_len} strings. Truncating...')
-                            content = content[0:max_len]
-                        content = '\n'.join(i for i in content) + '\n'
-                    elif commands[2].lower() == 'insert':
-                        cfg.LOGGER.info(f'Inserting {repos} changelogs to top of the file {file}')
-                        content = (data_for_actions + content).splitlines()
-                        data_len = len(content)
-                        if data_len > max_len:
-                            cfg.LOGGER.info(f'File {file} reached {max_len} strings. Truncating...')
-                            content = content[0:max_len]
-                        content = '\n'.join(i for i in content) + '\n'
-                    elif commands[2].lower() == 'append':
-                        cfg.LOGGER.info(f'Appending {repos} changelogs to end of the file {file}')
-                        if not content.endswith('\n') and content.strip():
-                            content += '\n'
-                        content = (content + data_for_actions).splitlines()
-                        data_len = len(content)
-                        if data_len > max_len:
-                            cfg.LOGGER.info(f'File {file} reached {max_len} strings. Truncating...')
-                            content = content[data_len - max_len - 1:data_len]
-                        content = '\n'.join(i for i in content) + '\n'
-                    elif commands[2].lower() == 'delete':
-                        cfg.LOGGER.info(f'Deleting old {repos} changelogs from file {file}')
-                        for old_line in data_for_actions.splitlines():
-                            content = content.replace(old_line, '')
-                    if repo.update_file(file, f'GitMon update file {file} with {repos} changelog', content.lstrip(), gh_content.sha):
-                        return True
-            else:
-                cfg.LOGGER.info(f'Unable to connect to user {user.name} github. Check the token.')
+            if commands[2].lower() not in ('write', 'insert', 'append', 'delete'):
+                cfg.LOGGER.error(f'Error in {repos} github actions configuration. Reason: unknown command {commands[2]}.')
+                return False
+            data_for_actions = get_data_for_actions(commands, repos, data, options, ctx)
+            if data_for_actions and args:
+                ghsink.add_edit(options[repos]['github_token'], commands[1], args, commands[2], data_for_actions,
+                                options[repos]['file_max_size'], repos)
+                return True
     except IndexError as e:
         cfg.LOGGER.error(f'Error in {repos} actions configuration: {commands}. Reason: IndexError {e.args}.')
     return False
 
 
-def process_actions(repos, data, options=cfg.OPTIONS):
+def process_actions(repos, data, options=cfg.OPTIONS, ctx=None):
     """Функция-селектор действий над данными
 
+    Действия ставятся в очереди соответствующих sinks и выполняются асинхронно (см. executor.py).
+
     :param repos:
     :param data:
     :param options:
+    :param ctx: данные цикла (context.CycleData)
     :return:
     """
     try:
@@ -338,15 +339,15 @@ def process_actions(repos, data, options=cfg.OPTIONS):
                 try:
                     if commands[0].lower() == 'local':
                         if commands[1].lower() == 'console':
-                            action_console(commands, args, repos, data)
+                            executor.submit('console', action_console, commands, args, repos, data, ctx=ctx, section=repos)
                         elif commands[1].lower() == 'file':
-                            action_file(commands, args, repos, data)
+                            executor.submit('file', action_file, commands, args, repos, data, ctx=ctx, section=repos)
                         elif commands[1].lower() == 'shell':
-                            action_shell(commands, args)
+                            executor.submit('shell', action_shell, commands, args, section=repos)
                     elif commands[0] == 'dockerhub':
-                        action_dockerhub(commands, args)
+                        executor.submit('dockerhub', action_dockerhub, commands, args, repos, section=repos)
                     elif commands[0] == 'github':
-                        action_github(commands, args, repos, data)
+                        executor.submit('github', action_github, commands, args, repos, data, ctx=ctx, section=repos)
                     else:
                         cfg.LOGGER.error(f'Unknown command in {repos} actions configuration: {action}')
                         return False
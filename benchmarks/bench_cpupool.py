@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Requires python 3.6+
+
+#######################################################################################################################
+# Benchmark: parsing and formatting of large changelogs inline vs. in a pool of 1..N processes (process_pool)
+#
+# Every section gets one github API response with the given number of commits. The responses are parsed from
+# several threads at once (as in gitmon.fetch_all), then a medium changelog of every section is rendered
+# (as in actions.get_logs). Every section also has releases with bodies in the store (bodies.py), their changelog is
+# rendered too. The results of every pool size are checked against the inline run. The workers are started with the
+# given multiprocessing start method (spawn checks that they do not depend on settings inherited through fork).
+#
+# Usage: python benchmarks/bench_cpupool.py [sections] [events per section] [max processes] [start method]
+#######################################################################################################################
+
+
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import cfg  # noqa: E402
+import bodies  # noqa: E402
+import cpupool  # noqa: E402
+import events  # noqa: E402
+import actions  # noqa: E402
+import gitmon  # noqa: E402
+
+
+def make_response(section, count):
+    """Ответ github API со списком commits"""
+    return json.dumps([{'sha': f'{section}-{i}',
+                        'commit': {'committer': {'date': time.strftime('%Y-%m-%dT%H:%M:%SZ',
+                                                                       time.gmtime(1600000000 - i * 60))},
+                                   'author': {'name': 'bench'},
+                                   'message': f'section {section}: commit {i}\n\nbody of the commit'}}
+                       for i in range(count)]).encode()
+
+
+def make_releases(section, count):
+    """Releases раздела с текстами в хранилище"""
+    rows = [events.Event([f'o/r{section}', time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(1600000000 - i * 3600)),
+                          'RELEASE', 'bench', f'v{i}', '\n'.join(f'- change {j} of release {i}' for j in range(20))])
+            for i in range(count)]
+    bodies.detach(rows)
+    return rows
+
+
+def run(responses, releases, count, processes):
+    cfg.PROCESS_POOL = processes
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=8) as threads:
+        parsed = list(threads.map(lambda item: cpupool.run(gitmon.parse_changelog, f'o/r{item[0]}', 'commits', count,
+                                                           item[1], weight=len(item[1]) // 1024),
+                                  enumerate(responses)))
+        data = {f's{i}': events.unpack(packed) + releases[i] for i, (ids, packed) in enumerate(parsed)}
+        options = {section: {'log_detail': 'medium', 'line_prefix': ''} for section in data}
+        logs = list(threads.map(lambda section: actions.get_logs(['local', 'file', 'insert', 'commits'], section, data,
+                                                                 options), data))
+        logs += list(threads.map(lambda section: actions.get_logs(['local', 'file', 'insert', 'releases'], section,
+                                                                  data, options), data))
+    elapsed = time.perf_counter() - started
+    cpupool.shutdown()
+    return elapsed, logs
+
+
+def main(sections, count, max_processes, start_method):
+    cfg.LOGGER = logging.getLogger('bench')
+    cfg.APP_LOGS_TYPE = 'none'
+    cpupool.START_METHOD = start_method
+    folder = tempfile.mkdtemp(prefix='bench_cpupool')
+    cfg.DATA_PATH = os.path.join(folder, 'data.json')
+    responses = [make_response(section, count) for section in range(sections)]
+    releases = [make_releases(section, cpupool.MIN_WEIGHT) for section in range(sections)]
+    print(f'{sections} sections x {count} events, {os.cpu_count()} CPUs, start method {start_method or "default"}')
+    inline, expected = run(responses, releases, count, 0)
+    print(f'{"inline":<20} {inline:8.3f} s')
+    os.chdir('/')  # workers must not depend on the working directory either
+    for processes in range(1, max_processes + 1):
+        elapsed, logs = run(responses, releases, count, processes)
+        assert logs == expected, f'output of {processes} processes differs from the inline run'
+        print(f'{f"{processes} processes":<20} {elapsed:8.3f} s   x{inline / elapsed:.2f}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 32,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 5000,
+         int(sys.argv[3]) if len(sys.argv) > 3 else os.cpu_count() or 1,
+         sys.argv[4] if len(sys.argv) > 4 else None)
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Requires python 3.6+
+
+#######################################################################################################################
+# Benchmark of full gitmon.py cycles against the fake github API server (benchmarks/fake_github.py)
+#
+# For every number of repositories a configuration file with sections of 10 repositories is generated and gitmon.py
+# is run once per cycle (update_interval = 0) with github_base_url pointing to the fake server. The first cycle is cold
+# (empty data file and HTTP cache), before each following cycle a share of the repositories (--change-rate) gets new
+# commits. For every cycle the wall time, requests and requests/sec, peak memory (max RSS) and I/O of the gitmon.py
+# process are reported. Results are printed as JSON, so runs of different versions can be compared.
+#
+# Usage: python benchmarks/bench_cycles.py [--sizes 10,100,1000,5000] [--cycles 3] [--output results.json]
+#######################################################################################################################
+
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.request import urlopen, Request
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_github  # noqa: E402
+
+
+# Runs gitmon.py and reports max RSS and I/O of the process to stderr at exit
+RUNNER = '''
+import atexit, json, os, resource, runpy, sys
+def report():
+    io = {}
+    try:
+        with open('/proc/self/io') as stats:
+            io = {name: int(value) for name, value in (line.split(':') for line in stats)}
+    except OSError:
+        pass
+    sys.stderr.write('BENCH ' + json.dumps({'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                                            'read_bytes': io.get('rchar'), 'write_bytes': io.get('wchar')}) + '\\n')
+atexit.register(report)
+path = sys.argv.pop(1)
+sys.argv[0] = path
+sys.path.insert(0, os.path.dirname(path))
+runpy.run_path(path, run_name='__main__')
+'''
+
+
+def write_config(path, base_url, repos, args):
+    """Конфигурационный файл: разделы по 10 репозитариев с записью новых commits в файл"""
+    lines = ['[DEFAULT]',
+             f'github_base_url: {base_url}/repos',
+             'update_interval: 0',
+             f'max_concurrency: {args.concurrency}',
+             f'storage_backend: {args.storage}',
+             'app_logs_level: warning',
+             '']
+    for first in range(0, repos, 10):
+        names = ', '.join(f'bench{first // 10}/repo{i}' for i in range(first, min(first + 10, repos)))
+        lines += [f'[{names}]',
+                  f'commits: {args.commits}',
+                  f'releases: {args.releases}',
+                  'only_new: true',
+                  f'actions: local.file.append.commits = {os.path.dirname(path)}/changelog{first // 10}.txt',
+                  '']
+    with open(path, 'w') as conf:
+        conf.write('\n'.join(lines))
+
+
+def post(url):
+    return json.loads(urlopen(Request(url, data=b'', method='POST')).read())
+
+
+def run_cycle(config, data, base_url):
+    """Один запуск gitmon.py
+
+    :return: словарь с результатами цикла
+    """
+    post(f'{base_url}/stats')  # reset counters of the fake server
+    started = time.perf_counter()
+    proc = subprocess.run([sys.executable, '-c', RUNNER, os.path.join(ROOT, 'gitmon.py'),
+                           '--config', config, '--data', data],
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    wall = time.perf_counter() - started
+    server = json.loads(urlopen(f'{base_url}/stats').read())
+    report = {}
+    for line in proc.stderr.splitlines():
+        if line.startswith('BENCH '):
+            report = json.loads(line[len('BENCH '):])
+    data_files = [os.path.join(os.path.dirname(data), name) for name in os.listdir(os.path.dirname(data))
+                  if name.startswith(os.path.basename(os.path.splitext(data)[0]))]
+    return dict(report,
+                exit_code=proc.returncode,
+                wall_s=round(wall, 3),
+                requests=server['requests'],
+                not_modified=server['not_modified'],
+                requests_per_s=round(server['requests'] / wall, 1) if wall else 0,
+                received_bytes=server['sent_bytes'],
+                data_files_bytes=sum(os.path.getsize(name) for name in data_files))
+
+
+def run_size(repos, args):
+    """Все циклы для одного количества репозитариев"""
+    server, github = fake_github.start(latency=args.latency, history=args.history, change_rate=args.change_rate)
+    base_url = f'http://127.0.0.1:{server.server_port}'
+    cycles = []
+    with tempfile.TemporaryDirectory(prefix='gitmon-bench-') as tmp:
+        config, data = os.path.join(tmp, 'gitmon.conf'), os.path.join(tmp, 'data.json')
+        write_config(config, base_url, repos, args)
+        for cycle in range(args.cycles):
+            if cycle:
+                post(f'{base_url}/tick')
+            result = run_cycle(config, data, base_url)
+            result['cycle'] = 'cold' if cycle == 0 else f'warm {cycle}'
+            cycles.append(result)
+            print(f'{repos:>6} repos, {result["cycle"]:<7}: {result["wall_s"]:8.2f} s, '
+                  f'{result["requests"]:>6} requests ({result["requests_per_s"]:.0f}/s), '
+                  f'max RSS {result.get("max_rss_kb", 0) / 1024:.0f} MiB', file=sys.stderr)
+    server.shutdown()
+    server.server_close()
+    return {'repos': repos, 'cycles': cycles}
+
+
+def get_version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=ROOT, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, universal_newlines=True).stdout.strip()
+    except OSError:
+        return ''
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of gitmon.py cycles against a fake github API')
+    parser.add_argument('--sizes', default='10,100,1000,5000', help='numbers of repositories, comma separated')
+    parser.add_argument('--cycles', type=int, default=3, help='cycles for every size (the first one is cold)')
+    parser.add_argument('--latency', type=float, default=0.02, help='delay of every API response in seconds')
+    parser.add_argument('--history', type=int, default=30, help='commits of every repository at start')
+    parser.add_argument('--change-rate', type=float, default=0.1, help='share of repositories changed per cycle')
+    parser.add_argument('--commits', type=int, default=10, help='"commits" option of every section')
+    parser.add_argument('--releases', type=int, default=0, help='"releases" option of every section')
+    parser.add_argument('--concurrency', type=int, default=8, help='max_concurrency option')
+    parser.add_argument('--storage', default='json', help='storage_backend option')
+    parser.add_argument('--output', default='', help='write JSON results to the file instead of stdout')
+    args = parser.parse_args()
+
+    results = {'version': get_version(), 'python': platform.python_version(), 'started': time.time(),
+               'settings': {name: value for name, value in vars(args).items() if name != 'output'},
+               'results': [run_size(int(size), args) for size in args.sizes.split(',')]}
+    if args.output:
+        with open(args.output, 'w') as js:
+            json.dump(results, js, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
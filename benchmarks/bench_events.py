@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Requires python 3.6+
+
+#######################################################################################################################
+# Micro-benchmark: plain rows with dateutil parsing vs. events with precomputed timestamps
+#
+# Usage: python benchmarks/bench_events.py [number of events]
+#######################################################################################################################
+
+
+import os
+import random
+import sys
+import time
+import dateutil.parser
+from operator import attrgetter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from events import Event, format_timestamp  # noqa: E402
+
+
+def make_rows(count):
+    """Случайные строки changelog в формате github API"""
+    rows = []
+    for i in range(count):
+        ts = time.gmtime(random.randint(1262304000, 1893456000))
+        rows.append([f'owner/repo{i % 400}', time.strftime('%Y-%m-%dT%H:%M:%SZ', ts), 'COMMIT', 'author', f'commit {i}'])
+    return rows
+
+
+def measure(name, func):
+    started = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - started
+    print(f'{name:<40} {elapsed:8.3f} s')
+    return result, elapsed
+
+
+def main(count):
+    rows = make_rows(count)
+    print(f'{count} events')
+
+    def rows_sort():
+        return sorted(rows, key=lambda x: dateutil.parser.parse(x[1]), reverse=True)
+
+    def rows_filter(sorted_rows):
+        last = sorted_rows[len(sorted_rows) // 2]
+        return [row for row in sorted_rows if dateutil.parser.parse(row[1]) > dateutil.parser.parse(last[1])]
+
+    def rows_format(sorted_rows):
+        return ''.join(f'{dateutil.parser.parse(row[1]).strftime("%Y-%m-%d %H:%M:%S")}: [{row[0]}] {row[4]}\n'
+                       for row in sorted_rows)
+
+    def events_sort(events):
+        return sorted(events, key=attrgetter('ts'), reverse=True)
+
+    def events_filter(sorted_events):
+        last = sorted_events[len(sorted_events) // 2]
+        return [event for event in sorted_events if event.ts > last.ts]
+
+    def events_format(sorted_events):
+        return ''.join(f'{format_timestamp(event.ts)}: [{event[0]}] {event[4]}\n' for event in sorted_events)
+
+    sorted_rows, t1 = measure('rows: sort (dateutil)', rows_sort)
+    _, t2 = measure('rows: filter (dateutil)', lambda: rows_filter(sorted_rows))
+    rows_log, t3 = measure('rows: format (dateutil)', lambda: rows_format(sorted_rows))
+    events, t4 = measure('events: parse once', lambda: [Event(row) for row in rows])
+    sorted_events, t5 = measure('events: sort (ts)', lambda: events_sort(events))
+    _, t6 = measure('events: filter (ts)', lambda: events_filter(sorted_events))
+    events_log, t7 = measure('events: format (ts)', lambda: events_format(sorted_events))
+    assert rows_log == events_log
+    print(f'{"speedup (parse + sort + filter + format)":<40} {(t1 + t2 + t3) / (t4 + t5 + t6 + t7):8.1f} x')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
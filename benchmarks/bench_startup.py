@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Requires python 3.6+
+
+#######################################################################################################################
+# Benchmark of one-shot runs (update_interval = 0, as from cron or CI) against the fake github API server
+#
+# Measures the time of "import gitmon" and the wall time of gitmon.py runs: the cold run (no data), a run without new
+# commits with fast_start: no (full cycle: data, cache and all requests), the same run with fast_start: yes
+# (warm state snapshot check only) and a fast_start run after new commits (the check fails and the full cycle follows).
+# Every run is repeated and the median is reported. Results are printed as JSON.
+#
+# Usage: python benchmarks/bench_startup.py [--repos 100] [--repeat 5] [--output results.json]
+#######################################################################################################################
+
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_github  # noqa: E402
+from bench_cycles import post, get_version  # noqa: E402
+
+
+def write_config(path, base_url, args, fast_start):
+    """Конфигурационный файл: разделы по 10 репозитариев с записью новых commits в файл"""
+    lines = ['[DEFAULT]',
+             f'github_base_url: {base_url}/repos',
+             'update_interval: 0',
+             f'fast_start: {"yes" if fast_start else "no"}',
+             'app_logs_level: warning',
+             '']
+    for first in range(0, args.repos, 10):
+        names = ', '.join(f'bench{first // 10}/repo{i}' for i in range(first, min(first + 10, args.repos)))
+        lines += [f'[{names}]',
+                  f'commits: {args.commits}',
+                  'only_new: true',
+                  f'actions: local.file.append.commits = {os.path.dirname(path)}/changelog{first // 10}.txt',
+                  '']
+    with open(path, 'w') as conf:
+        conf.write('\n'.join(lines))
+
+
+def measure(command, repeat):
+    """Медиана времени выполнения команды
+
+    :return: секунды
+    """
+    times = []
+    for i in range(repeat):
+        started = time.perf_counter()
+        subprocess.run(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - started)
+    return statistics.median(times)
+
+
+def main(args):
+    server, github = fake_github.start(latency=args.latency, change_rate=args.change_rate)
+    base_url = f'http://127.0.0.1:{server.server_port}'
+    results = {'python': [sys.executable, '-c', 'pass'], 'import': [sys.executable, '-c', 'import gitmon']}
+    results = {name: round(measure(command, args.repeat), 4) for name, command in results.items()}
+    with tempfile.TemporaryDirectory(prefix='gitmon-startup-') as tmp:
+        config, data = os.path.join(tmp, 'gitmon.conf'), os.path.join(tmp, 'data.json')
+        run = [sys.executable, os.path.join(ROOT, 'gitmon.py'), '--config', config, '--data', data]
+        write_config(config, base_url, args, fast_start=False)
+        results['cold run'] = round(measure(run, 1), 4)
+        github.reset_stats()
+        results['no changes, full cycle'] = round(measure(run, args.repeat), 4)
+        results['requests of full cycle'] = github.get_stats()['requests'] // args.repeat
+        write_config(config, base_url, args, fast_start=True)
+        measure(run, 1)  # the configuration file has changed - full cycle and a new snapshot
+        github.reset_stats()
+        results['no changes, fast start'] = round(measure(run, args.repeat), 4)
+        results['requests of fast start'] = github.get_stats()['requests'] // args.repeat
+        times = []
+        for i in range(args.repeat):
+            post(f'{base_url}/tick')
+            times.append(measure(run, 1))
+        results['changes, fast start'] = round(statistics.median(times), 4)
+    server.shutdown()
+    server.server_close()
+    for name, value in results.items():
+        print(f'{name:<28} {value}' + ('' if name.startswith('requests') else ' s'), file=sys.stderr)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of one-shot gitmon.py runs against a fake github API')
+    parser.add_argument('--repos', type=int, default=100, help='number of repositories')
+    parser.add_argument('--repeat', type=int, default=5, help='runs of every measurement')
+    parser.add_argument('--latency', type=float, default=0.02, help='delay of every API response in seconds')
+    parser.add_argument('--change-rate', type=float, default=0.1, help='share of repositories changed per tick')
+    parser.add_argument('--commits', type=int, default=10, help='"commits" option of every section')
+    parser.add_argument('--output', default='', help='write JSON results to the file instead of stdout')
+    args = parser.parse_args()
+
+    results = {'version': get_version(), 'python': platform.python_version(), 'started': time.time(),
+               'settings': {name: value for name, value in vars(args).items() if name != 'output'},
+               'results': main(args)}
+    if args.output:
+        with open(args.output, 'w') as js:
+            json.dump(results, js, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
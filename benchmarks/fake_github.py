@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Requires python 3.6+
+
+#######################################################################################################################
+# Fake github API server for offline benchmarks
+#
+# Serves synthetic commits and releases of any repository (GET /repos/<owner>/<repo>/commits|releases) with
+# per_page/page/since, ETag/304 and gzip, like api.github.com does. Every POST /tick is a new "moment": a share of the
+# repositories (change_rate) gets a new commit. GET /stats returns the request counters, POST /stats resets them.
+# Other POSTs (hub.docker.com triggers) are recorded in FakeGitHub.posts and answered with post_status after
+# post_latency, so the tests can count the builds that were started.
+# POST /graphql answers the aliased repository queries of ghgraphql.py from the same history. Repositories listed in
+# FakeGitHub.missing get a null node with a NOT_FOUND error; graphql_error (e.g. 'RATE_LIMITED') makes every query
+# fail with a top-level error and data: null, like the throttled github GraphQL API does.
+#
+# Usage: python benchmarks/fake_github.py [--port 8765] [--latency 0.02] [--change-rate 0.1]
+#######################################################################################################################
+
+
+import argparse
+import gzip
+import hashlib
+import json
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+
+BASE_TIME = 1577836800  # 2020-01-01T00:00:00Z - the time of the first synthetic commit
+GRAPHQL_REPOSITORY = re.compile(r'(\w+): repository\(owner: ("[^"]*"), name: ("[^"]*")\) \{\s*'
+                                r'(defaultBranchRef|releases)\D*(\d+)')  # alias, owner, name, connection, first
+
+
+def iso(timestamp):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(timestamp))
+
+
+class FakeGitHub:
+    """Состояние фейкового github: история commits/releases и счетчики запросов"""
+
+    def __init__(self, latency=0.02, history=30, releases=5, max_page_size=100, change_rate=0.1):
+        self.latency = latency
+        self.post_latency = 0.0
+        self.post_status = 200
+        self.posts = []  # (path, body) of the POSTs to other urls
+        self.missing = set()  # repositories that GraphQL does not find
+        self.graphql_error = ''  # type of the top-level error of every GraphQL answer (e.g. RATE_LIMITED)
+        self.history = history
+        self.releases = releases
+        self.max_page_size = max_page_size
+        self.change_rate = change_rate
+        self.tick = 0
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats = {'requests': 0, 'not_modified': 0, 'sent_bytes': 0, 'started': time.time()}
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats, elapsed=time.time() - self.stats['started'], tick=self.tick)
+
+    def count(self, status, size):
+        with self.lock:
+            self.stats['requests'] += 1
+            self.stats['not_modified'] += status == 304
+            self.stats['sent_bytes'] += size
+
+    def advance(self):
+        with self.lock:
+            self.tick += 1
+            return self.tick
+
+    def changed(self, repo, tick):
+        """Появился ли в репозитарии новый commit в момент tick (детерминированно)"""
+        return zlib.crc32(f'{repo}:{tick}'.encode()) % 10000 < self.change_rate * 10000
+
+    def commits(self, repo):
+        """Все commits репозитария, новые сверху"""
+        items = []
+        for tick in range(self.tick, 0, -1):
+            if self.changed(repo, tick):
+                items.append(self.commit(repo, f'tick {tick}', BASE_TIME + 86400 * 365 + tick * 60))
+        for i in range(self.history, 0, -1):
+            items.append(self.commit(repo, f'commit {i}', BASE_TIME + i * 3600))
+        return items
+
+    @staticmethod
+    def commit(repo, title, timestamp):
+        return {'sha': hashlib.sha1(f'{repo}:{title}'.encode()).hexdigest(),
+                'commit': {'author': {'name': 'bench', 'date': iso(timestamp)},
+                           'committer': {'name': 'bench', 'date': iso(timestamp)},
+                           'message': f'{repo}: {title}\n\nSynthetic commit of the benchmark.'}}
+
+    def get_releases(self, repo):
+        """Все releases репозитария, новые сверху"""
+        return [{'id': zlib.crc32(f'{repo}:{i}'.encode()), 'tag_name': f'v{i}.0', 'name': f'{repo} v{i}.0',
+                 'published_at': iso(BASE_TIME + i * 86400), 'author': {'login': 'bench'},
+                 'body': f'Release v{i}.0\n' + '\n'.join(f'- change {j} of release {i}' for j in range(40))}
+                for i in range(self.releases, 0, -1)]
+
+
+    def graphql(self, query):
+        """Ответ на запрос GraphQL из ghgraphql.build_query
+
+        :param query: текст запроса
+        :return: словарь ответа
+        """
+        if self.graphql_error:
+            return {'data': None, 'errors': [{'type': self.graphql_error, 'message': f'{self.graphql_error} (fake)'}]}
+        data, errors = {}, []
+        for alias, owner, name, connection, first in GRAPHQL_REPOSITORY.findall(query):
+            repo = f'{json.loads(owner)}/{json.loads(name)}'
+            if repo in self.missing:
+                data[alias] = None
+                errors.append({'type': 'NOT_FOUND', 'path': [alias],
+                               'message': f"Could not resolve to a Repository with the name '{repo}'."})
+            elif connection == 'defaultBranchRef':
+                nodes = [{'oid': item['sha'], 'message': item['commit']['message'],
+                          'author': {'name': item['commit']['author']['name']},
+                          'committer': {'date': item['commit']['committer']['date']}}
+                         for item in self.commits(repo)[:int(first)]]
+                data[alias] = {'defaultBranchRef': {'target': {'history': {'nodes': nodes}}}}
+            else:
+                nodes = [{'databaseId': item['id'], 'name': item['name'], 'description': item['body'],
+                          'publishedAt': item['published_at'], 'author': item['author']}
+                         for item in self.get_releases(repo)[:int(first)]]
+                data[alias] = {'releases': {'nodes': nodes}}
+        return dict({'data': data}, **({'errors': errors} if errors else {}))
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    github = None  # FakeGitHub
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, body=b'', headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        if parts.path == '/stats':
+            self.reply(200, json.dumps(self.github.get_stats()).encode(), {'Content-Type': 'application/json'})
+            return
+        path = parts.path.strip('/').split('/')
+        if len(path) != 4 or path[0] != 'repos' or path[3] not in ('commits', 'releases'):
+            self.reply(404)
+            return
+        time.sleep(self.github.latency)
+        repo, kind = f'{path[1]}/{path[2]}', path[3]
+        query = parse_qs(parts.query)
+        items = self.github.commits(repo) if kind == 'commits' else self.github.get_releases(repo)
+        if 'since' in query and kind == 'commits':
+            items = [item for item in items if item['commit']['committer']['date'] >= query['since'][0]]
+        per_page = min(int(query.get('per_page', ['30'])[0]), self.github.max_page_size)
+        page = int(query.get('page', ['1'])[0])
+        body = json.dumps(items[(page - 1) * per_page:page * per_page]).encode()
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+        headers = {'ETag': etag, 'X-RateLimit-Limit': '1000000', 'X-RateLimit-Remaining': '999999',
+                   'X-RateLimit-Reset': str(int(time.time()) + 3600)}
+        if self.headers.get('If-None-Match') == etag:
+            self.github.count(304, 0)
+            self.reply(304, headers=headers)
+            return
+        if 'gzip' in (self.headers.get('Accept-Encoding') or ''):
+            body = gzip.compress(body, 1)
+            headers['Content-Encoding'] = 'gzip'
+        headers['Content-Type'] = 'application/json'
+        self.github.count(200, len(body))
+        self.reply(200, body, headers)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path == '/tick':
+            self.reply(200, json.dumps({'tick': self.github.advance()}).encode())
+        elif self.path == '/stats':
+            self.github.reset_stats()
+            self.reply(200, b'{}')
+        elif self.path == '/graphql':
+            time.sleep(self.github.latency)
+            answer = json.dumps(self.github.graphql(json.loads(body)['query'])).encode()
+            self.github.count(200, len(answer))
+            self.reply(200, answer, {'Content-Type': 'application/json', 'X-RateLimit-Limit': '5000',
+                                     'X-RateLimit-Remaining': '4999',
+                                     'X-RateLimit-Reset': str(int(time.time()) + 3600)})
+        else:  # hub.docker.com triggers and other actions
+            time.sleep(self.github.post_latency)
+            with self.github.lock:
+                self.github.posts.append((self.path, body))
+            self.reply(self.github.post_status, b'{}')
+
+
+def start(port=0, **kwargs):
+    """Запуск сервера в отдельном потоке
+
+    :param port: 0 - любой свободный порт
+    :return: (server, FakeGitHub). Адрес: http://127.0.0.1:server.server_port
+    """
+    github = FakeGitHub(**kwargs)
+    handler = type('BoundHandler', (Handler,), {'github': github})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, github
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fake github API server')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.02, help='delay of every API response in seconds')
+    parser.add_argument('--history', type=int, default=30, help='commits of every repository at start')
+    parser.add_argument('--releases', type=int, default=5, help='releases of every repository')
+    parser.add_argument('--max-page-size', type=int, default=100)
+    parser.add_argument('--change-rate', type=float, default=0.1, help='share of repositories changed by every tick')
+    args = parser.parse_args()
+    server, github = start(args.port, latency=args.latency, history=args.history, releases=args.releases,
+                           max_page_size=args.max_page_size, change_rate=args.change_rate)
+    print(f'Fake github API on http://127.0.0.1:{server.server_port}/repos (POST /tick - new commits)')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Requires python 3.6+
+
+#######################################################################################################################
+# Content-addressed store of release bodies
+#
+# Release notes are the only big part of changelog rows, and the same body is repeated in the data file, the cursors
+# and the HTTP cache. After a cycle is saved, every body is written once into the store (data.json -> data.bodies/,
+# one file per sha256 of the body) and the row keeps only a reference to it (Body). Files refer to a body by the
+# string PREFIX + sha256. The text is read from the store only when a RELEASE line is rendered (actions.render_line),
+# so between cycles the bodies are not kept in memory. Workers of a sharded setup share one store.
+#######################################################################################################################
+
+
+import hashlib
+import os
+from pathlib import Path
+
+import cfg
+
+
+PREFIX = '@body:'  # reference to the store in data files: '@body:<sha256 of the body>'
+MIN_SIZE = 128  # shorter bodies are kept in the rows as is
+
+
+class Body:
+    """Ссылка на текст release в хранилище. Равна тексту, на который ссылается, и имеет тот же hash"""
+
+    __slots__ = ('digest',)
+
+    def __init__(self, digest):
+        self.digest = digest
+
+    def __str__(self):
+        return read(self.digest)
+
+    def splitlines(self, keepends=False):
+        return str(self).splitlines(keepends)
+
+    def __eq__(self, other):
+        if isinstance(other, Body):
+            return self.digest == other.digest
+        if isinstance(other, str):
+            return get_digest(other) == self.digest
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(str(self))  # equal to the text, so it must hash like the text (reads the store)
+
+    def __repr__(self):
+        return f'Body({self.digest[:12]})'
+
+    def __reduce__(self):
+        return Body, (self.digest,)
+
+
+def get_bodies_path():
+    """Каталог хранилища. По-умолчанию - рядом с файлом данных (data.json -> data.bodies)"""
+    if cfg.BODIES_PATH:
+        return cfg.BODIES_PATH
+    return str(Path(cfg.DATA_PATH).with_suffix('.bodies'))
+
+
+def get_digest(text):
+    return hashlib.sha256(text.encode('utf8')).hexdigest()
+
+
+def get_file(digest):
+    return os.path.join(get_bodies_path(), digest[:2], digest)
+
+
+def read(digest):
+    """Текст release из хранилища ('' если файл потерян)"""
+    try:
+        with open(get_file(digest), 'r', encoding='utf8') as body:
+            return body.read()
+    except OSError as e:
+        cfg.LOGGER.error(f'Release body {digest} is missing in {get_bodies_path()}. Reason: {e}')
+        return ''
+
+
+def write(text):
+    """Запись текста в хранилище (если его там еще нет)
+
+    :param text: текст release
+    :return: sha256 текста
+    """
+    digest = get_digest(text)
+    path = get_file(digest)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp = f'{path}.{os.getpid()}.tmp'
+        with open(temp, 'w', encoding='utf8') as body:
+            body.write(text)
+        os.replace(temp, path)  # workers may write the same body at the same time
+    return digest
+
+
+def detach(rows):
+    """Перенос текстов release из строк changelog в хранилище (строки изменяются на месте)
+
+    :param rows: строки changelog (Event)
+    :return: количество перенесенных текстов
+    """
+    moved = 0
+    for row in rows:
+        if len(row) > 5 and row[2] == 'RELEASE' and type(row[5]) is str and len(row[5]) >= MIN_SIZE:
+            row[5] = Body(write(row[5]))
+            if hasattr(row, 'line'):
+                row.line = None  # the rendered line contains the whole body
+            moved += 1
+    return moved
+
+
+def attach(row):
+    """Замена ссылки на хранилище (после загрузки из файла) объектом Body
+
+    :param row: строка changelog
+    :return: та же строка
+    """
+    if len(row) > 5 and type(row[5]) is str and row[5].startswith(PREFIX):
+        row[5] = Body(row[5][len(PREFIX):])
+    return row
+
+
+def encode(value):
+    """Параметр default для json.dump: Body записывается в файлы ссылкой"""
+    if isinstance(value, Body):
+        return PREFIX + value.digest
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def collect(digests):
+    """Удаление из хранилища текстов, на которые больше нет ссылок
+
+    :param digests: множество sha256 текстов, на которые есть ссылки
+    :return: количество удаленных файлов
+    """
+    removed = 0
+    root = get_bodies_path()
+    try:
+        folders = os.listdir(root)
+    except OSError:
+        return 0
+    for folder in folders:
+        for name in os.listdir(os.path.join(root, folder)):
+            if name not in digests:
+                os.remove(os.path.join(root, folder, name))
+                removed += 1
+    return removed
@@ -10,9 +10,50 @@
 
 CONFIG_PATH = 'gitmon.conf'  # main configuration file
 DATA_PATH = 'data.json'  # where to save data
+STORAGE_BACKEND = 'json'  # how to save data: json (DATA_PATH) or sqlite (STORAGE_PATH)
+STORAGE_PATH = ''  # sqlite database file. '' == next to DATA_PATH
 UPDATE_INTERVAL = 0  # data check interval in minutes. '0' == one time only
+MIN_UPDATE_INTERVAL = 1  # shortest adaptive check interval in minutes
+MAX_UPDATE_INTERVAL = 0  # longest adaptive check interval in minutes for quiet repositories (0 - update_interval)
 GITHUB_BASE_URL = 'https://api.github.com/repos'  # github base url
+FETCH_BACKEND = 'rest'  # how to get commits and releases: rest or graphql
+GITHUB_GRAPHQL_URL = 'https://api.github.com/graphql'  # github GraphQL API url
+GRAPHQL_BATCH_SIZE = 40  # repositories per GraphQL request
+GITHUB_TOKEN = ''  # token for github API requests (raises the rate limit)
+GITHUB_TOKENS = []  # tokens of the workers in sharded mode (worker I uses GITHUB_TOKENS[I % len])
+WORKERS = 0  # number of worker processes started by the coordinator. '0' == no sharding
+SHARD = None  # (I, N) - this process is worker I of N and polls only its sections
+SPOOL = False  # worker started by the coordinator: local file edits are passed to the coordinator
+SPOOL_PATH = ''  # where the worker writes local file edits for the coordinator
+BODIES_PATH = ''  # content-addressed store of release bodies. '' == next to DATA_PATH
+HTTP_CACHE_PATH = ''  # where to save HTTP validators cache. '' == next to DATA_PATH
+MAX_CONCURRENCY = 8  # max number of simultaneous requests to github API
+HTTP_POOL_SIZE = 8  # max number of idle keep-alive connections per host
+HTTP_TIMEOUT = 30  # timeout of outbound HTTP requests in seconds
+FETCH_RETRIES = 2  # retries of github requests failed with network or server errors
+FETCH_RETRY_DELAY = 1  # max delay before the first retry in seconds (doubled on every retry, jittered)
+FETCH_DEADLINE = 120  # seconds a wave of github requests may take. '0' == no deadline
+BREAKER_THRESHOLD = 3  # failures in a row after which a repository is not requested for breaker_cooldown
+BREAKER_COOLDOWN = 300  # seconds a failing repository is not requested (doubled after every failed trial)
 APP_LOGS_TYPE = 'console'  # app logs type: none, file, console
 APP_LOGS_FILE = 'gitmon.log'  # app logs file
+APP_LOGS_LEVEL = 'info'  # app logs level: debug, info, warning, error
 LOGGER = None  # logger object. See setup.setup_log()
+ACTION_CONCURRENCY = {}  # sink -> number of threads executing its actions (1 by default)
+ACTION_QUEUE_SIZE = 1000  # max number of queued actions per sink
+ACTION_RETRIES = 3  # retries of failed dockerhub and github actions
+ACTION_RETRY_DELAY = 5  # delay before the first retry in seconds (doubled on every retry)
+DOCKERHUB_DEBOUNCE = 0  # seconds during which hub.docker.com triggers with the same url and tag are merged
+SHELL_TIMEOUT = 600  # timeout of local.shell actions in seconds. '0' == no timeout
+PROCESS_POOL = 0  # processes for parsing and formatting of large changelogs. '0' == no process pool
+WEBHOOK_PORT = 8000  # port of the github webhook receiver (gitmon.py --serve)
+WEBHOOK_HOST = '127.0.0.1'  # address of the webhook receiver
+WEBHOOK_SECRET = ''  # secret of the github webhooks. '' == the receiver is not started (see WEBHOOK_INSECURE)
+WEBHOOK_INSECURE = False  # accept unsigned webhooks when there is no webhook_secret
+SERVE = False  # receive github webhooks for the sections with mode: webhook
+METRICS_PORT = 0  # port of the Prometheus metrics endpoint. '0' == disabled
+METRICS_HOST = '127.0.0.1'  # address of the metrics endpoint
+FAST_START = True  # one-shot runs check the warm state snapshot first and exit early if nothing changed
+CONFIG_RELOAD = 10  # how often (in seconds) to check the configuration file for changes. '0' == never
 OPTIONS = {}  # options, loaded from configuration file
+CURSORS_KEY = '__cursors__'  # key of the fetch cursors in the data file
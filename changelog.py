@@ -0,0 +1,341 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Requires python 3.6+
+
+#######################################################################################################################
+# Changelog files (local.file.<write|insert|append|delete> actions)
+#
+# Every changelog file has a sidecar index (.<file>.idx) with the offset and the crc32 of each line, so the file
+# never has to be loaded as a whole:
+#   - append writes only the new lines to the end of the file;
+#   - insert writes the new lines and copies only the part of the old file that still fits into file_max_size. A file
+#     cannot grow at its start, and the changelog must stay one plain file with the newest lines on top for whoever
+#     reads or serves it, so the old lines are copied, but by the kernel (os.copy_file_range) without reading them
+#     into python, and the cut point is taken from the sidecar index;
+#   - truncation to file_max_size copies the file starting from the offset of the first kept line;
+#   - delete finds the lines to remove by their crc32 and copies the byte ranges between them.
+# Everything except a plain append is written to a temporary file which then replaces the original one. New files get
+# the usual permissions (0666 minus umask), replaced files keep theirs.
+#######################################################################################################################
+
+
+import os
+import shutil
+import struct
+import threading
+import zlib
+from array import array
+
+import cfg
+
+
+HEADER = struct.Struct('<4sQqI')  # magic, file size, file mtime_ns, number of lines
+MAGIC = b'GMI1'
+COPY_BUFFER = 1024 * 1024
+_indexes = {}  # path -> LineIndex (indexes that are known to be valid are not re-read)
+_lock = threading.Lock()
+
+
+class LineIndex:
+    """Смещения и контрольные суммы строк файла"""
+
+    def __init__(self, size=0, mtime_ns=0, offsets=None, hashes=None):
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.offsets = offsets if offsets is not None else array('Q')  # start of every line
+        self.hashes = hashes if hashes is not None else array('I')  # crc32 of every line without '\n'
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def add(self, lines, start):
+        """Добавление строк, записанных в файл начиная со смещения start
+
+        :param lines: строки в виде bytes без '\\n'
+        :param start: смещение первой строки
+        :return: смещение конца последней строки
+        """
+        for line in lines:
+            self.offsets.append(start)
+            self.hashes.append(zlib.crc32(line))
+            start += len(line) + 1
+        return start
+
+    def end_of(self, count):
+        """Смещение конца первых count строк"""
+        return self.offsets[count] if count < len(self) else self.size
+
+
+def get_index_path(path):
+    directory, name = os.path.split(os.path.abspath(path))
+    return os.path.join(directory, f'.{name}.idx')
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return 0, 0
+    return st.st_size, st.st_mtime_ns
+
+
+def _scan(path):
+    """Построение индекса чтением файла (если индекса нет или файл изменялся извне)"""
+    index = LineIndex()
+    try:
+        with open(path, 'rb') as file:
+            start = 0
+            for line in file:
+                index.offsets.append(start)
+                index.hashes.append(zlib.crc32(line.rstrip(b'\n')))
+                start += len(line)
+    except FileNotFoundError:
+        pass
+    return index
+
+
+def get_index(path):
+    """Индекс файла: из памяти, из файла индекса или построенный заново
+
+    :param path: путь к файлу
+    :return: LineIndex
+    """
+    size, mtime_ns = _stat(path)
+    index = _indexes.get(path)
+    if index is None or (index.size, index.mtime_ns) != (size, mtime_ns):
+        index = None
+        try:
+            with open(get_index_path(path), 'rb') as idx:
+                magic, idx_size, idx_mtime_ns, count = HEADER.unpack(idx.read(HEADER.size))
+                if magic == MAGIC and (idx_size, idx_mtime_ns) == (size, mtime_ns):
+                    offsets, hashes = array('Q'), array('I')
+                    offsets.fromfile(idx, count)
+                    hashes.fromfile(idx, count)
+                    index = LineIndex(size, mtime_ns, offsets, hashes)
+        except (OSError, EOFError, struct.error):
+            pass
+        if index is None:
+            cfg.LOGGER.info(f'Indexing lines of file {path}...')
+            index = _scan(path)
+    index.size, index.mtime_ns = size, mtime_ns
+    _indexes[path] = index
+    return index
+
+
+def _save_index(path, index):
+    """Сохранение индекса после изменения файла"""
+    index.size, index.mtime_ns = _stat(path)
+    _indexes[path] = index
+    with open(get_index_path(path), 'wb') as idx:
+        idx.write(HEADER.pack(MAGIC, index.size, index.mtime_ns, len(index)))
+        index.offsets.tofile(idx)
+        index.hashes.tofile(idx)
+
+
+def _replace(path, write):
+    """Атомарная запись файла: write(file) пишет во временный файл, который затем заменяет path"""
+    directory = os.path.dirname(os.path.abspath(path))
+    temp_path = os.path.join(directory, f'.{os.path.basename(path)}.{os.getpid()}.{threading.get_ident()}.tmp')
+    if os.path.exists(temp_path):
+        os.unlink(temp_path)  # left by a crash
+    # unlike tempfile.mkstemp (0600), the mode of a new file is 0666 minus umask, as with open(path, 'w')
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), 0o666)
+    try:
+        with os.fdopen(fd, 'wb') as temp:
+            write(temp)
+        if os.path.exists(path):
+            shutil.copymode(path, temp_path)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def _copy_range(source, target, start, end):
+    """Копирование части файла source [start, end) в target (средствами ядра, если это возможно)"""
+    left = end - start
+    if hasattr(os, 'copy_file_range') and left > 0:
+        target.flush()
+        try:
+            while left > 0:
+                copied = os.copy_file_range(source.fileno(), target.fileno(), left, start)
+                if not copied:
+                    break
+                start += copied
+                left -= copied
+            target.seek(0, os.SEEK_END)
+            return
+        except OSError:
+            target.seek(0, os.SEEK_END)  # e.g. the file system does not support it - copy what is left by hand
+    source.seek(start)
+    while left > 0:
+        chunk = source.read(min(COPY_BUFFER, left))
+        if not chunk:
+            break
+        target.write(chunk)
+        left -= len(chunk)
+
+
+def _ends_with_newline(path, index):
+    if not index.size:
+        return True
+    with open(path, 'rb') as file:
+        file.seek(index.size - 1)
+        return file.read(1) == b'\n'
+
+
+def _encode(text):
+    return [line.encode('utf-8') for line in text.splitlines()]
+
+
+def _drop_head(path, index, count):
+    """Удаление первых count строк файла"""
+    start = index.offsets[count]
+    with open(path, 'rb') as source:
+        _replace(path, lambda temp: _copy_range(source, temp, start, index.size))
+    index = LineIndex(offsets=array('Q', (offset - start for offset in index.offsets[count:])),
+                      hashes=index.hashes[count:])
+    return index
+
+
+def write(path, text, max_len):
+    """Перезапись файла
+
+    :param path: путь к файлу
+    :param text: новое содержимое
+    :param max_len: максимальное количество строк в файле
+    :return:
+    """
+    with _lock:
+        lines = _encode(text)[:max_len]
+        _replace(path, lambda temp: temp.write(b''.join(line + b'\n' for line in lines)))
+        index = LineIndex()
+        index.add(lines, 0)
+        _save_index(path, index)
+
+
+def insert(path, text, max_len):
+    """Вставка строк в начало файла. Из старого содержимого копируется только то, что помещается в max_len строк
+
+    :param path: путь к файлу
+    :param text: вставляемые строки
+    :param max_len: максимальное количество строк в файле
+    :return:
+    """
+    with _lock:
+        lines = _encode(text)[:max_len]
+        old = get_index(path)
+        keep = min(len(old), max_len - len(lines))
+        if keep < len(old):
+            cfg.LOGGER.info(f'File {path} reached {max_len} strings. Truncating...')
+        end = old.end_of(keep)
+        add_newline = keep and end == old.size and not _ends_with_newline(path, old)
+
+        def write_file(temp):
+            temp.write(b''.join(line + b'\n' for line in lines))
+            if keep:
+                with open(path, 'rb') as source:
+                    _copy_range(source, temp, 0, end)
+                if add_newline:
+                    temp.write(b'\n')
+
+        _replace(path, write_file)
+        index = LineIndex()
+        shift = index.add(lines, 0)
+        index.offsets.extend(offset + shift for offset in old.offsets[:keep])
+        index.hashes.extend(old.hashes[:keep])
+        _save_index(path, index)
+
+
+def append(path, text, max_len):
+    """Добавление строк в конец файла (без перезаписи файла). При превышении max_len удаляются старые строки
+
+    :param path: путь к файлу
+    :param text: добавляемые строки
+    :param max_len: максимальное количество строк в файле
+    :return:
+    """
+    with _lock:
+        lines = _encode(text)
+        index = get_index(path)
+        prefix = b'' if _ends_with_newline(path, index) else b'\n'
+        with open(path, 'ab') as file:
+            file.write(prefix + b''.join(line + b'\n' for line in lines))
+        index.add(lines, index.size + len(prefix))
+        if len(index) > max_len:
+            cfg.LOGGER.info(f'File {path} reached {max_len} strings. Truncating...')
+            index.size, index.mtime_ns = _stat(path)
+            index = _drop_head(path, index, len(index) - max_len)
+        _save_index(path, index)
+
+
+def delete(path, text):
+    """Удаление из файла строк, совпадающих со строками text
+
+    Строки-кандидаты находятся по crc32 из индекса и сверяются с содержимым файла, после чего
+    копируются только промежутки между удаляемыми строками.
+
+    :param path: путь к файлу
+    :param text: удаляемые строки
+    :return: количество удаленных строк
+    """
+    with _lock:
+        targets = {line for line in _encode(text) if line.strip()}
+        hashes = {zlib.crc32(line) for line in targets}
+        index = get_index(path)
+        removed = []
+        with open(path, 'rb') as source:
+            for number, line_hash in enumerate(index.hashes):
+                if line_hash in hashes:
+                    source.seek(index.offsets[number])
+                    if source.readline().rstrip(b'\n') in targets:
+                        removed.append(number)
+            if not removed:
+                return 0
+
+            def write_file(temp):
+                start = 0
+                for number in removed:
+                    _copy_range(source, temp, start, index.offsets[number])
+                    start = index.end_of(number + 1)
+                _copy_range(source, temp, start, index.size)
+
+            _replace(path, write_file)
+        new_index = LineIndex()
+        shift = 0
+        removed_set = set(removed)
+        for number in range(len(index)):
+            length = index.end_of(number + 1) - index.offsets[number]
+            if number in removed_set:
+                shift += length
+            else:
+                new_index.offsets.append(index.offsets[number] - shift)
+                new_index.hashes.append(index.hashes[number])
+        _save_index(path, new_index)
+        return len(removed)
+
+
+def apply_edit(content, mode, text, max_len):
+    """То же самое, что write/insert/append/delete, но для содержимого файла в памяти (файлы на github)
+
+    :param content: текущее содержимое файла
+    :param mode: 'write', 'insert', 'append' или 'delete'
+    :param text: строки changelog
+    :param max_len: максимальное количество строк в файле
+    :return: новое содержимое файла
+    """
+    lines = text.splitlines()
+    if mode == 'write':
+        result = lines[:max_len]
+    elif mode == 'insert':
+        result = (lines + content.splitlines())[:max_len]
+    elif mode == 'append':
+        result = content.splitlines() + lines
+        result = result[max(0, len(result) - max_len):]
+    elif mode == 'delete':
+        targets = {line for line in lines if line.strip()}
+        result = [line for line in content.splitlines() if line not in targets]
+    else:
+        raise ValueError(f'unknown command {mode}')
+    return ''.join(line + '\n' for line in result)
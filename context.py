@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Requires python 3.6+
+
+#######################################################################################################################
+# Data of one polling cycle
+#
+# The current data and the data saved by the previous cycle are kept in memory and shared by filter_new_logs,
+# process_actions and the actions, so the data file is read once per cycle instead of once per action.
+# Changelog texts are rendered once per cycle and shared by all actions that need the same text.
+#######################################################################################################################
+
+
+import os
+import threading
+
+import cfg
+import setup
+import storage
+
+
+class CycleData:
+    """Текущие и сохраненные в предыдущем цикле данные"""
+
+    def __init__(self, data):
+        self.data = data
+        self.reads = 0  # how many times the data file was read in this cycle
+        self._old_data = None
+        self._mtime = None
+        self._saving = False  # the data of this cycle is being saved: the snapshot of old data is final
+        self._old_lock = threading.Lock()
+        self.logs = {}  # (id of the events list, type, log_detail, line_prefix) -> (events list, rendered text)
+        self._logs_lock = threading.Lock()
+
+    @staticmethod
+    def data_path():
+        """Файл, в котором хранятся данные (зависит от storage_backend)"""
+        if cfg.STORAGE_BACKEND == 'sqlite':
+            return storage.get_storage_path()
+        return cfg.DATA_PATH
+
+    @staticmethod
+    def get_mtime(path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    @property
+    def old_data(self):
+        """Данные, сохраненные в предыдущем цикле. Файл перечитывается, только если он изменился после чтения.
+        После начала сохранения данных цикла (save) файл больше не читается: действия, которые еще в очереди,
+        получают снимок, сделанный до сохранения
+
+        :return: структура типа dict (см. setup.load_data)
+        """
+        with self._old_lock:
+            if self._saving:
+                return self._old_data
+            path = self.data_path()
+            mtime = self.get_mtime(path)
+            if self._old_data is None or mtime != self._mtime:
+                self._old_data = setup.load_data()
+                self._mtime = mtime
+                self.reads += 1
+                cfg.LOGGER.debug(f'{path} read {self.reads} time(s) in this cycle')
+            return self._old_data
+
+    def get_logs(self, rows, key, render):
+        """Текст changelog, общий для всех действий цикла: формируется один раз для каждого сочетания
+        списка событий, их типа, log_detail и line_prefix
+
+        :param rows: список событий
+        :param key: (тип событий, log_detail, line_prefix)
+        :param render: функция без аргументов, формирующая текст
+        :return: str
+        """
+        key = (id(rows),) + tuple(key)
+        with self._logs_lock:
+            cached = self.logs.get(key)
+        if cached is not None and cached[0] is rows:
+            return cached[1]
+        text = render()
+        with self._logs_lock:
+            self.logs[key] = (rows, text)  # the list is kept, so its id is not reused during the cycle
+        return text
+
+    def save(self, data):
+        """Сохранение данных цикла
+
+        :param data: структура типа dict
+        :return:
+        """
+        self.old_data  # the snapshot must be taken before the file is written
+        with self._old_lock:
+            self._saving = True  # actions that are still queued must not see the data we are saving
+        setup.save_data(data)
+        cfg.LOGGER.debug(f'{self.data_path()} read {self.reads} time(s) in this cycle')
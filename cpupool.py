@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Requires python 3.6+
+
+#######################################################################################################################
+# Process pool for CPU-bound work on large histories
+#
+# JSON decoding of github responses with parsing of their dates (gitmon.parse_changelog) and rendering of changelog
+# blocks (actions.render_logs) hold the GIL, so with thousands of events per section the fetch and action threads
+# end up on one core. With process_pool: N such jobs are executed by N processes. Events travel between processes
+# in the compact form of events.pack(). The same functions run inline when the pool is disabled or the job is too
+# small to pay for the transfer, so the result does not depend on where the job was executed.
+# Workers do not rely on inheriting the settings through fork (python 3.14 starts them with forkserver on Linux):
+# the settings they use - paths of the data and of the store of release bodies, logging - are passed to every worker
+# by _init_worker.
+#######################################################################################################################
+
+
+import os
+import threading
+
+import cfg
+
+
+MIN_WEIGHT = 200  # smaller jobs (events or KiB of response) are executed inline
+START_METHOD = None  # multiprocessing start method of the workers: fork, spawn, forkserver. None == platform default
+STATS = {'pool': 0, 'inline': 0}
+_pool = None
+_lock = threading.Lock()
+
+
+def get_pool():
+    """Пул процессов (создается при первом обращении), или None, если process_pool: 0
+
+    :return: ProcessPoolExecutor или None
+    """
+    global _pool
+    if cfg.PROCESS_POOL <= 0:
+        return None
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    import bodies
+    with _lock:
+        if _pool is None:
+            cfg.LOGGER.info(f'Starting pool of {cfg.PROCESS_POOL} processes for parsing and formatting')
+            settings = {'DATA_PATH': os.path.abspath(cfg.DATA_PATH),
+                        'BODIES_PATH': os.path.abspath(bodies.get_bodies_path()),
+                        'SHARD': cfg.SHARD,
+                        'APP_LOGS_TYPE': cfg.APP_LOGS_TYPE,
+                        'APP_LOGS_FILE': os.path.abspath(cfg.APP_LOGS_FILE),
+                        'APP_LOGS_LEVEL': cfg.APP_LOGS_LEVEL}
+            _pool = ProcessPoolExecutor(max_workers=cfg.PROCESS_POOL,
+                                        mp_context=multiprocessing.get_context(START_METHOD),
+                                        initializer=_init_worker, initargs=(settings,))
+        return _pool
+
+
+def _init_worker(settings):
+    """Настройки процесса пула (процесс может быть запущен через spawn или forkserver и не наследует cfg)
+
+    :param settings: {имя переменной cfg: значение}
+    :return:
+    """
+    for name, value in settings.items():
+        setattr(cfg, name, value)
+    if cfg.LOGGER is None:
+        import setup
+        cfg.LOGGER = setup.setup_log()
+
+
+def run(func, *args, weight=0):
+    """Выполнение функции в пуле процессов (или в текущем процессе для небольших заданий)
+
+    Функция и ее аргументы должны сериализоваться pickle (функции уровня модуля, события - в виде events.pack).
+
+    :param func: функция
+    :param weight: объем задания (например, количество событий). Задания меньше MIN_WEIGHT выполняются сразу
+    :return: результат функции
+    """
+    pool = get_pool() if weight >= MIN_WEIGHT else None
+    if pool is not None:
+        from concurrent.futures.process import BrokenProcessPool
+        try:
+            result = pool.submit(func, *args).result()
+        except BrokenProcessPool as e:
+            cfg.LOGGER.error(f'Process pool is broken ({e}). Executing {func.__name__} inline.')
+            shutdown()
+        else:
+            with _lock:
+                STATS['pool'] += 1
+            return result
+    with _lock:
+        STATS['inline'] += 1
+    return func(*args)
+
+
+def shutdown():
+    """Остановка пула процессов
+
+    :return:
+    """
+    global _pool
+    with _lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown()
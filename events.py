@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Requires python 3.6+
+
+#######################################################################################################################
+# Changelog events
+#
+# An event is a changelog row ([repo, date, 'COMMIT', author, message] or [repo, date, 'RELEASE', author, name, body])
+# with the date parsed once into epoch seconds (attribute ts) and the last rendered log line (attribute line).
+# Event is a list, so it is saved to data.json exactly like a plain row, while sorting, filtering and formatting use
+# the precomputed ts. Repository names, types and authors of events are interned, so thousands of rows share one
+# string object for each of them; release bodies may be references to the store (see bodies.py).
+#######################################################################################################################
+
+
+import calendar
+import heapq
+import sys
+import time
+from itertools import islice, takewhile
+from operator import attrgetter
+
+import cfg
+import bodies
+
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+_ts = attrgetter('ts')
+
+
+def parse_timestamp(value):
+    """Преобразование времени в формате ISO 8601 в секунды с начала эпохи
+
+    Время в формате github API ('2020-01-31T12:00:00Z') разбирается без dateutil.
+
+    :param value: строка с датой и временем
+    :return: int
+    """
+    if not value:
+        return 0
+    if len(value) == 20 and value[19] == 'Z' and value[10] == 'T':
+        return calendar.timegm((int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                                int(value[11:13]), int(value[14:16]), int(value[17:19])))
+    import dateutil.parser  # only for dates not in the github API format
+    parsed = dateutil.parser.parse(value)
+    if parsed.tzinfo is None:
+        return calendar.timegm(parsed.timetuple())
+    return int(parsed.timestamp())
+
+
+def intern(row):
+    """Замена повторяющихся строк события (репозитарий, тип, автор) общими объектами
+
+    :param row: строка changelog
+    :return: та же строка
+    """
+    for i in range(0, min(len(row), 4)):
+        if i != 1 and type(row[i]) is str:
+            row[i] = sys.intern(row[i])
+    return row
+
+
+def format_timestamp(ts):
+    """Время события в виде строки для логов
+
+    :param ts: секунды с начала эпохи
+    :return: строка вида '2020-01-31 12:00:00' (UTC)
+    """
+    return time.strftime(TIME_FORMAT, time.gmtime(ts))
+
+
+class Event(list):
+    """Строка changelog с заранее разобранным временем"""
+
+    __slots__ = ('ts', 'line')
+
+    def __init__(self, row=()):
+        super().__init__(row)
+        self.ts = parse_timestamp(self[1]) if len(self) > 1 else 0
+        self.line = None  # (format, text) - the last rendered line of the event (see actions.render_logs)
+        bodies.attach(intern(self))
+
+    @classmethod
+    def with_ts(cls, row, ts):
+        """Событие с уже известным временем (без разбора даты)"""
+        event = cls.__new__(cls)
+        list.__init__(event, row)
+        event.ts = ts
+        event.line = None
+        intern(event)
+        return event
+
+
+def pack(events):
+    """Компактное представление событий для передачи между процессами (см. cpupool.py)
+
+    :param events: последовательность Event
+    :return: (строки в виде обычных списков, время событий)
+    """
+    events = list(events)
+    return [list(event) for event in events], [event.ts for event in events]
+
+
+def unpack(packed):
+    """Восстановление событий из компактного представления без повторного разбора дат
+
+    :param packed: результат pack()
+    :return: список Event
+    """
+    rows, timestamps = packed
+    return [Event.with_ts(row, ts) for row, ts in zip(rows, timestamps)]
+
+
+def to_events(rows):
+    """Преобразование строк changelog (например, загруженных из файла) в события
+
+    :param rows: список строк changelog
+    :return: список Event
+    """
+    return [row if isinstance(row, Event) else Event(row) for row in rows]
+
+
+def from_data(data):
+    """Преобразование всех строк в структуре данных (см. setup.load_data) в события
+
+    :param data: структура типа dict
+    :return: та же структура
+    """
+    for section, rows in data.items():
+        if section == cfg.CURSORS_KEY:
+            for cursor in rows.values():
+                cursor['rows'] = to_events(cursor['rows'])
+        elif isinstance(rows, list):
+            data[section] = to_events(rows)
+    return data
+
+
+def ensure_sorted(events):
+    """Проверка, что события идут от новых к старым (github почти всегда так и возвращает)
+
+    :param events: список Event
+    :return: тот же список или его отсортированная копия
+    """
+    if all(events[i].ts >= events[i + 1].ts for i in range(len(events) - 1)):
+        return events
+    return sorted(events, key=_ts, reverse=True)
+
+
+def merge(streams, limit=None):
+    """Ленивое слияние нескольких потоков событий, отсортированных от новых к старым
+
+    Потоки сливаются через heap, поэтому не требуется полная пересортировка. При одинаковом времени события
+    идут в порядке потоков - так же, как при стабильной сортировке их объединения.
+
+    :param streams: последовательности Event (от новых к старым)
+    :param limit: если задан - только limit самых новых событий (остальные не вычисляются)
+    :return: итератор Event
+    """
+    merged = heapq.merge(*streams, key=_ts, reverse=True)
+    if limit is not None:
+        return islice(merged, limit)
+    return merged
+
+
+def newer_than(stream, last_event):
+    """События из потока (от новых к старым), которые новее last_event. Поток читается до первого старого события
+
+    :param stream: последовательность Event
+    :param last_event: Event
+    :return: итератор Event
+    """
+    return takewhile(lambda event: event.ts > last_event.ts, stream)
+
+
+def of_type(stream, event_type):
+    """События указанного типа ('COMMIT' или 'RELEASE')
+
+    :param stream: последовательность Event
+    :param event_type:
+    :return: итератор Event
+    """
+    return (event for event in stream if event[2] == event_type)
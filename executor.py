@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Requires python 3.6+
+
+#######################################################################################################################
+# Asynchronous execution of actions
+#
+# Actions are put into a bounded queue of their sink (console, file, shell, dockerhub, github) and executed by the
+# worker threads of that sink, so a slow shell script or an unreachable hub.docker.com does not stall polling.
+# Every sink has its own concurrency limit (action_concurrency). Actions of HTTP sinks that fail are retried with
+# exponential backoff. A full queue blocks the producer (backpressure). shutdown() drains the queues.
+#######################################################################################################################
+
+
+import queue
+import threading
+import time
+
+import cfg
+
+
+SINKS = ('console', 'file', 'shell', 'dockerhub', 'github')
+HTTP_SINKS = ('dockerhub', 'github')
+ORDERED_SINKS = ('console', 'file', 'github')  # one worker: actions must run in the order they were submitted
+_STOP = object()
+
+_queues = {}  # sink -> queue.Queue
+_workers = []
+_lock = threading.Lock()
+STATS = {}  # sink -> {'done': ..., 'failed': ..., 'retries': ..., 'wait': ..., 'run': ..., 'max_depth': ...}
+
+
+class Job:
+    """Действие, ожидающее выполнения"""
+
+    __slots__ = ('sink', 'func', 'args', 'kwargs', 'section', 'created', 'attempt')
+
+    def __init__(self, sink, func, args, kwargs, section):
+        self.sink = sink
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.section = section
+        self.created = time.monotonic()
+        self.attempt = 0
+
+
+def get_concurrency(sink):
+    """Количество потоков для sink (для console, file и github всегда 1)"""
+    if sink in ORDERED_SINKS:
+        return 1
+    return max(1, cfg.ACTION_CONCURRENCY.get(sink, 1))
+
+
+def is_running():
+    return bool(_workers)
+
+
+def start():
+    """Запуск потоков, выполняющих действия
+
+    :return:
+    """
+    with _lock:
+        if _workers:
+            return
+        for sink in SINKS:
+            _queues[sink] = queue.Queue(maxsize=max(1, cfg.ACTION_QUEUE_SIZE))
+            STATS[sink] = {'done': 0, 'failed': 0, 'retries': 0, 'wait': 0.0, 'run': 0.0, 'max_depth': 0}
+            for i in range(get_concurrency(sink)):
+                worker = threading.Thread(target=_work, args=(sink,), name=f'GitMon-{sink}-{i}', daemon=True)
+                worker.start()
+                _workers.append(worker)
+
+
+def submit(sink, func, *args, section='', **kwargs):
+    """Постановка действия в очередь sink. Если очередь заполнена - ожидание свободного места
+
+    Если потоки не запущены (start() не вызывался), действие выполняется сразу.
+
+    :param sink: console, file, shell, dockerhub или github
+    :param func: функция действия
+    :param section: раздел конфигурационного файла
+    :return: результат действия, если оно выполнено сразу, иначе True
+    """
+    if not _workers:
+        return func(*args, **kwargs)
+    jobs = _queues[sink]
+    if jobs.full():
+        cfg.LOGGER.warning(f'Queue of {sink} actions is full ({jobs.maxsize}). Waiting...')
+    jobs.put(Job(sink, func, args, kwargs, section))
+    with _lock:
+        STATS[sink]['max_depth'] = max(STATS[sink]['max_depth'], jobs.qsize())
+    return True
+
+
+def _run(job):
+    """Выполнение действия с повторами для HTTP sinks"""
+    while True:
+        try:
+            result = job.func(*job.args, **job.kwargs)
+        except Exception as e:
+            cfg.LOGGER.error(f'Error in {job.sink} action of {job.section}. Reason: {type(e).__name__} {e}')
+            result = False
+        if result is not False or job.sink not in HTTP_SINKS or job.attempt >= cfg.ACTION_RETRIES:
+            return result
+        job.attempt += 1
+        delay = cfg.ACTION_RETRY_DELAY * 2 ** (job.attempt - 1)
+        cfg.LOGGER.warning(f'Retrying {job.sink} action of {job.section} in {delay} s '
+                           f'(attempt {job.attempt} of {cfg.ACTION_RETRIES})')
+        with _lock:
+            STATS[job.sink]['retries'] += 1
+        time.sleep(delay)
+
+
+def _work(sink):
+    """Цикл потока, выполняющего действия одного sink"""
+    jobs = _queues[sink]
+    while True:
+        job = jobs.get()
+        try:
+            if job is _STOP:
+                return
+            started = time.monotonic()
+            result = _run(job)
+            finished = time.monotonic()
+            with _lock:
+                stats = STATS[sink]
+                stats['done' if result is not False else 'failed'] += 1
+                stats['wait'] += started - job.created
+                stats['run'] += finished - started
+        finally:
+            jobs.task_done()
+
+
+def drain():
+    """Ожидание выполнения всех действий, поставленных в очередь
+
+    :return:
+    """
+    for jobs in list(_queues.values()):
+        jobs.join()
+
+
+def get_stats():
+    """Метрики очередей: глубина, количество выполненных действий, среднее ожидание и время выполнения
+
+    :return: словарь {sink: {...}}
+    """
+    with _lock:
+        stats = {}
+        for sink, values in STATS.items():
+            count = values['done'] + values['failed']
+            stats[sink] = dict(values, depth=_queues[sink].qsize(),
+                               avg_wait=values['wait'] / count if count else 0.0,
+                               avg_run=values['run'] / count if count else 0.0)
+        return stats
+
+
+def log_stats():
+    """Вывод метрик очередей в лог
+
+    :return:
+    """
+    for sink, stats in get_stats().items():
+        if stats['done'] or stats['failed'] or stats['depth']:
+            cfg.LOGGER.info(f'Actions {sink}: queue depth {stats["depth"]} (max {stats["max_depth"]}), '
+                            f'done {stats["done"]}, failed {stats["failed"]}, retries {stats["retries"]}, '
+                            f'avg wait {stats["avg_wait"]:.2f} s, avg run {stats["avg_run"]:.2f} s')
+
+
+def shutdown():
+    """Остановка потоков после выполнения всех действий из очередей
+
+    :return:
+    """
+    if not _workers:
+        return
+    cfg.LOGGER.info(f'Waiting for {sum(jobs.unfinished_tasks for jobs in _queues.values())} queued actions...')
+    drain()
+    with _lock:
+        for sink, jobs in _queues.items():
+            for i in range(get_concurrency(sink)):
+                jobs.put(_STOP)
+        workers = list(_workers)
+        _workers.clear()
+    for worker in workers:
+        worker.join()
+    log_stats()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Requires python 3.6+
+
+#######################################################################################################################
+# Bulk fetching of commits and releases through the github GraphQL API (fetch_backend: graphql)
+#
+# Dozens of repositories are packed into one query using aliases, so about two REST requests per repository are
+# replaced by one GraphQL request per batch. The results are returned in the same shape as the REST API returns them,
+# so they are turned into changelog rows by the same code.
+# A response without data (github answers 200 with only top-level errors when the query is throttled, times out or
+# costs too much) fails the whole batch, not its repositories: the requests of the batch are made through the REST API
+# (see gitmon.fetch_all) and no circuit breaker is touched. A repository is not_found only if its own node is null
+# with a NOT_FOUND error; other null nodes are requested through the REST API as well.
+#######################################################################################################################
+
+
+import json
+from urllib.error import URLError
+
+import cfg
+import net
+import resilience
+import scheduler
+
+
+MAX_COUNT = 100  # GraphQL connections return at most 100 nodes per request
+
+COMMITS_FIELDS = '''defaultBranchRef { target { ... on Commit { history(first: %d) { nodes {
+      oid message author { name } committer { date } } } } } }'''
+RELEASES_FIELDS = '''releases(first: %d, orderBy: {field: CREATED_AT, direction: DESC}) { nodes {
+      databaseId name description publishedAt author { login } } }'''
+
+
+def build_query(batch):
+    """Построение запроса для нескольких репозитариев
+
+    :param batch: список (alias, repo, updates_from, count)
+    :return: текст запроса GraphQL
+    """
+    parts = []
+    for alias, repo, updates_from, count in batch:
+        owner, name = repo.split('/', 1)
+        fields = (COMMITS_FIELDS if updates_from == 'commits' else RELEASES_FIELDS) % count
+        parts.append(f'{alias}: repository(owner: {json.dumps(owner)}, name: {json.dumps(name)}) {{ {fields} }}')
+    return 'query {\n' + '\n'.join(parts) + '\n}'
+
+
+def to_rest(updates_from, node):
+    """Преобразование записи из ответа GraphQL в формат ответа REST API"""
+    if updates_from == 'commits':
+        return {'sha': node['oid'],
+                'commit': {'committer': {'date': (node.get('committer') or {}).get('date')},
+                           'author': {'name': (node.get('author') or {}).get('name')},
+                           'message': node.get('message') or ''}}
+    return {'id': node['databaseId'],
+            'published_at': node.get('publishedAt'),
+            'author': {'login': (node.get('author') or {}).get('login')},
+            'name': node.get('name'),
+            'body': node.get('description') or ''}
+
+
+def get_nodes(updates_from, repository):
+    """Список записей commits или releases из ответа по одному репозитарию"""
+    if updates_from == 'commits':
+        target = ((repository.get('defaultBranchRef') or {}).get('target') or {})
+        return (target.get('history') or {}).get('nodes') or []
+    return (repository.get('releases') or {}).get('nodes') or []
+
+
+def post_query(body, headers):
+    """Одна попытка запроса GraphQL (см. fetch_batch)
+
+    :param body: тело запроса
+    :param headers: заголовки запроса
+    :return: разобранный ответ
+    """
+    try:
+        res = net.request(cfg.GITHUB_GRAPHQL_URL, data=body, headers=headers, timeout=resilience.get_timeout())
+    except URLError as e:
+        scheduler.update_rate_limit(getattr(e, 'headers', None))
+        raise
+    scheduler.update_rate_limit(res.headers)
+    response = json.loads(res.read().decode())
+    if type(response) is not dict:
+        raise ValueError(f'object expected, got {type(response).__name__}')
+    return response
+
+
+def fetch_batch(batch):
+    """Один запрос GraphQL для нескольких репозитариев
+
+    :param batch: список запросов (repo, updates_from, count)
+    :return: словарь {(repo, updates_from, count): список записей в формате REST API, False (ошибка)
+             или None (запрос нужно выполнить через REST API)}
+    :raises FetchError: если github не вернул данных ни по одному репозитарию (rate_limit или bad_response)
+    """
+    aliased = [(f'r{i}', repo, updates_from, count) for i, (repo, updates_from, count) in enumerate(batch)]
+    body = json.dumps({'query': build_query(aliased)}).encode('utf-8')
+    headers = {'Authorization': f'bearer {cfg.GITHUB_TOKEN}', 'Content-Type': 'application/json'}
+    cfg.LOGGER.info(f'Getting {len(batch)} changelogs from {cfg.GITHUB_GRAPHQL_URL}...')
+    try:
+        response = resilience.retry(lambda: post_query(body, headers), name=cfg.GITHUB_GRAPHQL_URL)
+    except resilience.FetchError as e:
+        cfg.LOGGER.error(f'Error getting {len(batch)} changelogs from {cfg.GITHUB_GRAPHQL_URL}. {e}')
+        for repo in {repo for repo, updates_from, count in batch}:
+            resilience.failure(repo, e)
+        return {request: False for request in batch}
+
+    errors = response.get('errors') or []
+    for error in errors:
+        cfg.LOGGER.error(f'GraphQL error: {error.get("type", "")} {error.get("message")}')
+    data = response.get('data')
+    if not isinstance(data, dict):
+        error = get_batch_error(errors)
+        resilience.count(error.kind)
+        raise error
+    not_found = {(error.get('path') or [None])[0] for error in errors if error.get('type') == 'NOT_FOUND'}
+    results = {}
+    for alias, repo, updates_from, count in aliased:
+        repository = data.get(alias)
+        if repository is None:
+            if alias in not_found:
+                resilience.failure(repo, resilience.FetchError('not_found', f'{repo} is not found'))
+                results[(repo, updates_from, count)] = False
+            else:
+                results[(repo, updates_from, count)] = None  # partial answer - ask the REST API
+            continue
+        resilience.success(repo)
+        results[(repo, updates_from, count)] = [to_rest(updates_from, node)
+                                                for node in get_nodes(updates_from, repository)][:count]
+    return results
+
+
+def get_batch_error(errors):
+    """Ошибка пакета по ошибкам верхнего уровня ответа без данных
+
+    :param errors: список ошибок GraphQL
+    :return: FetchError
+    """
+    messages = '; '.join(f'{error.get("type", "")} {error.get("message", "")}'.strip() for error in errors)
+    if any(error.get('type') == 'RATE_LIMITED' for error in errors):
+        return resilience.FetchError('rate_limit', f'GraphQL rate limit exceeded: {messages}')
+    return resilience.FetchError('bad_response', f'GraphQL response without data: {messages or "no errors"}')
+
+
+def get_batches(requests):
+    """Разбиение запросов на пакеты по graphql_batch_size репозитариев
+
+    :param requests: список (repo, updates_from, count)
+    :return: список пакетов
+    """
+    size = max(1, cfg.GRAPHQL_BATCH_SIZE)
+    return [requests[i:i + size] for i in range(0, len(requests), size)]
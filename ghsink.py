@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Requires python 3.6+
+
+#######################################################################################################################
+# Batched updates of files in your github repositories (github.<project>.<command>.<data> actions)
+#
+# The actions of a cycle only collect the edits. flush() then applies all edits for the same target repository and
+# writes them as one tree and one commit through the Git Data API. Clients and repository handles are cached per
+# token, and the content of a file is downloaded again only when its blob sha has changed.
+#######################################################################################################################
+
+
+import base64
+import hashlib
+import threading
+
+import cfg
+import changelog
+
+
+PENDING = {}  # (token, project) -> list of (file, command, text, max_len, section)
+_clients = {}  # token -> Github
+_repos = {}  # (token, project) -> Repository
+_blobs = {}  # (repository full name, file) -> (blob sha, content)
+_lock = threading.Lock()
+COMMIT_ATTEMPTS = 3  # times the edits are applied again when the branch moves while the commit is being made
+
+
+class BranchMoved(Exception):
+    """Ветка изменялась во время каждой попытки записать коммит"""
+
+
+def get_client(token):
+    """Клиент github API для token. Клиенты создаются один раз и переиспользуются вместе с их соединениями
+
+    :param token: personal access token
+    :return: Github
+    """
+    from github import Github  # PyGithub is imported only when a github.* action is used
+    with _lock:
+        if token not in _clients:
+            _clients[token] = Github(login_or_token=token, timeout=cfg.HTTP_TIMEOUT, pool_size=cfg.HTTP_POOL_SIZE)
+        return _clients[token]
+
+
+def get_repo(token, project):
+    """Репозитарий project пользователя, которому принадлежит token
+
+    :param token: personal access token
+    :param project: название репозитария
+    :return: Repository
+    """
+    key = (token, project)
+    if key not in _repos:
+        user = get_client(token).get_user()
+        _repos[key] = user.get_repo(project)
+        cfg.LOGGER.info(f'Accessing repo {_repos[key].full_name}')
+    return _repos[key]
+
+
+def add_edit(token, project, file, command, text, max_len, section):
+    """Добавление изменения файла в очередь. Изменения записываются на github при вызове flush()
+
+    :param token: personal access token
+    :param project: название вашего репозитария на github
+    :param file: путь к файлу в репозитарии
+    :param command: 'write', 'insert', 'append' или 'delete'
+    :param text: строки changelog
+    :param max_len: максимальное количество строк в файле
+    :param section: раздел конфигурационного файла (для сообщения коммита)
+    :return:
+    """
+    with _lock:
+        PENDING.setdefault((token, project), []).append((file, command.lower(), text, max_len, section))
+
+
+def blob_sha(content):
+    """sha, который github присвоит файлу с таким содержимым (git hash-object)"""
+    data = content.encode('utf-8')
+    return hashlib.sha1(b'blob %d\0' % len(data) + data).hexdigest()
+
+
+def get_content(repo, file, sha):
+    """Содержимое файла. Файл скачивается, только если его sha отличается от сохраненного
+
+    :param repo: Repository
+    :param file: путь к файлу
+    :param sha: sha файла в текущем дереве или None, если файла нет
+    :return: содержимое файла
+    """
+    if sha is None:
+        return ''
+    cached = _blobs.get((repo.full_name, file))
+    if cached and cached[0] == sha:
+        return cached[1]
+    cfg.LOGGER.info(f'Reading {file} from {repo.full_name}')
+    content = base64.b64decode(repo.get_git_blob(sha).content).decode('utf-8')
+    _blobs[(repo.full_name, file)] = (sha, content)
+    return content
+
+
+def commit_edits(token, project, edits):
+    """Применение всех изменений одного репозитария и запись их одним коммитом
+
+    Если ветка изменилась, пока коммит создавался (github отвечает 422 на обновление ref), изменения применяются
+    заново к новому состоянию ветки (до COMMIT_ATTEMPTS раз).
+
+    :param token: personal access token
+    :param project: название репозитария
+    :param edits: список (file, command, text, max_len, section)
+    :return: True, если коммит создан
+    :raises BranchMoved: если ветка менялась при каждой попытке
+    """
+    from github import GithubException
+    repo = get_repo(token, project)
+    for attempt in range(1, COMMIT_ATTEMPTS + 1):
+        ref = repo.get_git_ref(f'heads/{repo.default_branch}')
+        commit = build_commit(repo, ref, edits)
+        if commit is None:
+            return False
+        try:
+            ref.edit(commit.sha)
+        except GithubException as e:
+            if e.status != 422:
+                raise
+            if attempt == COMMIT_ATTEMPTS:
+                raise BranchMoved(f'{repo.default_branch} has moved during {COMMIT_ATTEMPTS} attempts to commit')
+            cfg.LOGGER.warning(f'Branch {repo.default_branch} of {repo.full_name} has moved. '
+                               f'Applying the edits again (attempt {attempt + 1} of {COMMIT_ATTEMPTS}).')
+            continue
+        cfg.LOGGER.info(f'Committed changes to {repo.full_name}: {commit.sha}')
+        return True
+
+
+def get_file_sha(repo, commit_sha, file):
+    """sha файла в коммите, если его нет в дереве (github обрезает рекурсивное дерево большого репозитария)
+
+    :param repo: Repository
+    :param commit_sha: sha коммита
+    :param file: путь к файлу
+    :return: sha файла или None, если файла нет
+    """
+    from github import GithubException
+    try:
+        content = repo.get_contents(file, ref=commit_sha)
+    except GithubException as e:
+        if e.status == 404:
+            return None
+        raise
+    if isinstance(content, list) or content.type != 'file':
+        raise ValueError(f'{file} is not a file')
+    return content.sha
+
+
+def build_commit(repo, ref, edits):
+    """Коммит с изменениями файлов поверх текущего состояния ветки (ref еще не обновлен)
+
+    :param repo: Repository
+    :param ref: GitRef ветки
+    :param edits: список (file, command, text, max_len, section)
+    :return: GitCommit или None, если файлы не изменились
+    """
+    from github import InputGitTreeElement
+    head = repo.get_git_commit(ref.object.sha)
+    tree = repo.get_git_tree(head.tree.sha, recursive=True)
+    shas = {element.path: element.sha for element in tree.tree if element.type == 'blob'}
+
+    contents = {}
+    for file, command, text, max_len, section in edits:
+        if file not in contents:
+            if file not in shas and tree.raw_data.get('truncated'):
+                shas[file] = get_file_sha(repo, head.sha, file)  # the file may be missing from a truncated tree
+            contents[file] = get_content(repo, file, shas.get(file))
+        cfg.LOGGER.info(f'Applying {command} of {section} changelogs to file {file}')
+        contents[file] = changelog.apply_edit(contents[file], command, text, max_len)
+
+    elements = []
+    for file, content in contents.items():
+        sha = blob_sha(content)
+        if sha != shas.get(file):
+            elements.append(InputGitTreeElement(file, '100644', 'blob', content=content))
+        _blobs[(repo.full_name, file)] = (sha, content)
+    if not elements:
+        cfg.LOGGER.info(f'No changes in {repo.full_name} files')
+        return None
+
+    sections = sorted({edit[4] for edit in edits})
+    tree = repo.create_git_tree(elements, base_tree=head.tree)
+    cfg.LOGGER.info(f'Writing {len(elements)} file(s) to {repo.full_name}')
+    return repo.create_git_commit(f'GitMon update {", ".join(contents)} with {", ".join(sections)} changelog',
+                                  tree, [head])
+
+
+def flush():
+    """Запись всех накопленных изменений: один коммит на каждый репозитарий
+
+    Изменения, которые не удалось записать из-за временной ошибки (сеть, ошибка сервера github, ветка
+    менялась при каждой попытке), возвращаются в очередь и будут записаны при следующем вызове flush().
+
+    :return: False, если были временные ошибки, иначе True
+    """
+    with _lock:
+        pending = dict(PENDING)
+        PENDING.clear()
+    if not pending:
+        return True
+    from github import GithubException
+    commits, ok = 0, True
+    for (token, project), edits in pending.items():
+        try:
+            commits += commit_edits(token, project, edits)
+        except GithubException as e:
+            cfg.LOGGER.error(f'Error updating files in github repo {project}. Reason: {e.status} {e.data}')
+            _repos.pop((token, project), None)
+            if e.status is None or e.status >= 500:
+                requeue(token, project, edits)
+                ok = False
+        except (OSError, IOError, BranchMoved) as e:
+            cfg.LOGGER.error(f'Error updating files in github repo {project}. Reason: {e}')
+            requeue(token, project, edits)
+            ok = False
+        except ValueError as e:
+            cfg.LOGGER.error(f'Error in github actions configuration for repo {project}. Reason: {e}')
+    if pending:
+        cfg.LOGGER.info(f'{sum(len(edits) for edits in pending.values())} github file edits written '
+                        f'with {commits} commit(s).')
+    return ok
+
+
+def requeue(token, project, edits):
+    """Возврат изменений в начало очереди"""
+    with _lock:
+        PENDING[(token, project)] = edits + PENDING.get((token, project), [])
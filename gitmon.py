@@ -20,115 +20,624 @@
 
 
 import time
-import dateutil.parser
 import json
-from urllib.request import urlopen
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from urllib.error import URLError
+from urllib.parse import urlencode
 
 import cfg
 import setup
 import actions
+import context
+import cpupool
+import events
+import executor
+import ghsink
+import ghgraphql
+import resilience
+import retention
+from events import Event
+import httpcache
+import metrics
+import net
+import scheduler
+import shards
+import triggers
+import warmstate
+import webhook
 
 
-def get_last_updates(repo, updates_from, count):
+PAGE_SIZE = 100  # max page size of github API
+RELEASES_PAGE_SIZE = 10  # page size for releases when the newest known release is stored in the cursor
+CURSORS = {}  # 'updates_from:count:repo' -> {'id': newest sha or id, 'date': newest date, 'rows': last rows}
+_SORTED = {}  # repos -> (changelogs the rows were merged from, rows by descending timestamps)
+_WINDOWS = {}  # (repo, updates_from, count) -> (changelog of the planned request, its first count rows)
+TRIGGER_RECHECK = 1  # shortest sleep in seconds while a due dockerhub trigger is being started
+_cycle_lock = threading.Lock()  # polling cycles and webhook cycles are processed one at a time
+
+
+@metrics.timed
+def get_last_updates(repo, updates_from, count, since='', page=1):
     """Получение changelog репозитария github.com
 
+    Запрос выполняется условно (If-None-Match / If-Modified-Since). Если github отвечает
+    "304 Not Modified", то changelog берется из кэша без повторного разбора (см. httpcache.py).
+    Сетевые ошибки и ошибки сервера повторяются с паузами (см. resilience.retry).
+
     :param repo: название репозитария в виде Имя_Владельца/Проект
     :param updates_from: 'commits' или 'releases'
-    :param count: количество строк changelog
-    :return: updates - результат запроса в виде списка
+    :param count: количество строк changelog (размер страницы)
+    :param since: только commits после указанного времени (ISO 8601)
+    :param page: номер страницы
+    :return: changelog - список пар [id, строка changelog] (id - sha коммита или id релиза, см. make_row)
+    :raises resilience.FetchError: если запрос не удался (после повторов, см. resilience.py)
     """
-    url = f'{cfg.GITHUB_BASE_URL}/{repo}/{updates_from}?per_page={count}'
+    url = get_url(repo, updates_from, count, since=since, page=page)
     cfg.LOGGER.info(f'Getting {updates_from} for {repo} from {url}...')
     try:
-        response = urlopen(url).read()
-    except URLError as e:
-        if hasattr(e, 'reason'):
-            cfg.LOGGER.error(f'We failed to reach a url: {url}. Reason: {e.reason}')
-        elif hasattr(e, 'code'):
-            cfg.LOGGER.error(f'The server couldn\'t fulfill the request. Error code: {e.code}')
-        return False
-    updates = json.loads(response.decode())
-    if type(updates) is list:
-        updates = updates[:count]
+        return resilience.retry(lambda: request_changelog(url, repo, updates_from, count), name=url)
+    except resilience.FetchError as e:
+        cfg.LOGGER.error(f'Error getting {updates_from} for {repo} from {url}. {e}')
+        raise
+
+
+def request_changelog(url, repo, updates_from, count):
+    """Одна попытка запроса changelog (см. get_last_updates)
+
+    :param url: адрес запроса
+    :param repo: название репозитария в виде Имя_Владельца/Проект
+    :param updates_from: 'commits' или 'releases'
+    :param count: количество строк changelog (размер страницы)
+    :return: changelog - список пар [id, строка changelog]
+    """
+    probed = warmstate.take_response(url)  # the answer to the warm state check of this run, if there was one
+    if probed is not None and probed[0] == 304 and url not in httpcache.CACHE:
+        probed = None  # nothing to take the data from - ask again
+    if probed is not None:
+        status, headers, response = probed
+        scheduler.update_rate_limit(headers)
+        if status == 304:
+            cfg.LOGGER.info(f'No changes in {updates_from} for {repo}. Using cached data.')
+            return httpcache.get_payload(url)
     else:
-        updates = [updates, ]
-    return updates
+        headers = httpcache.get_validators(url)
+        if cfg.GITHUB_TOKEN:
+            headers['Authorization'] = f'token {cfg.GITHUB_TOKEN}'
+        try:
+            res = net.request(url, headers=headers, timeout=resilience.get_timeout())
+            response = res.read()
+            headers = res.headers
+            scheduler.update_rate_limit(headers)
+        except URLError as e:
+            scheduler.update_rate_limit(getattr(e, 'headers', None))
+            if getattr(e, 'code', None) == 304:
+                payload = httpcache.get_payload(url)
+                if payload is False:
+                    raise ValueError(f'304 Not Modified for {url}, but its data is not in the HTTP cache')
+                cfg.LOGGER.info(f'No changes in {updates_from} for {repo}. Using cached data.')
+                return payload
+            raise
+    started = time.perf_counter()
+    ids, packed = cpupool.run(parse_changelog, repo, updates_from, count, response, weight=len(response) // 1024)
+    changelog = [[update_id, row] for update_id, row in zip(ids, events.unpack(packed))]
+    metrics.observe('gitmon_function_seconds', time.perf_counter() - started, function='parse_changelog')
+    httpcache.store(url, headers, changelog)
+    return changelog
+
+
+def get_url(repo, updates_from, count, since='', page=1):
+    """Адрес запроса changelog в github API
+
+    :param repo: название репозитария в виде Имя_Владельца/Проект
+    :param updates_from: 'commits' или 'releases'
+    :param count: размер страницы
+    :param since: только commits после указанного времени (ISO 8601)
+    :param page: номер страницы
+    :return: url
+    """
+    params = {'per_page': count, 'page': page}
+    if since:
+        params['since'] = since
+    return f'{cfg.GITHUB_BASE_URL}/{repo}/{updates_from}?{urlencode(params)}'
+
+
+def get_page_params(updates_from, count, cursor):
+    """Размер страницы и параметр since запроса с учетом курсора
+
+    :param updates_from: 'commits' или 'releases'
+    :param count: количество строк changelog
+    :param cursor: курсор запроса или None
+    :return: (per_page, since)
+    """
+    per_page = min(count, PAGE_SIZE)
+    since = ''
+    if cursor and updates_from == 'commits':
+        since = cursor['date'] or ''
+    elif cursor:
+        per_page = min(count, RELEASES_PAGE_SIZE)
+    return per_page, since
+
+
+def parse_changelog(repo, updates_from, count, response):
+    """Разбор ответа github API (может выполняться в пуле процессов, см. cpupool.py)
+
+    :param repo: название репозитария в виде Имя_Владельца/Проект
+    :param updates_from: 'commits' или 'releases'
+    :param count: количество строк changelog
+    :param response: тело ответа (JSON)
+    :return: (список id записей, строки changelog в виде events.pack)
+    """
+    updates = json.loads(response.decode())
+    if type(updates) is not list:
+        raise ValueError(f'list of {updates_from} expected, got {type(updates).__name__} {str(updates)[:200]}')
+    updates = updates[:count]
+    rows = [make_row(repo, updates_from, update) for update in updates]
+    return [update.get('sha') or update.get('id') for update in updates], events.pack(rows)
+
+
+def fetch_changelog(repo, updates_from, count):
+    """Получение последних count строк changelog репозитария с учетом уже известных данных
+
+    Для каждого запроса хранится курсор (sha/id и время самой новой записи) и последнее окно из count строк.
+    Запрашиваются только записи новее курсора (параметр since для commits), страницы перебираются,
+    пока не встретится уже известная запись. Поэтому в установившемся режиме объем загружаемых данных
+    пропорционален количеству новых событий, а не размеру окна.
+
+    Если запрос не удался или не выполнялся (см. resilience.get_skip_reason), возвращается последнее полученное окно.
+
+    :param repo: название репозитария в виде Имя_Владельца/Проект
+    :param updates_from: 'commits' или 'releases'
+    :param count: количество строк changelog
+    :return: список строк changelog (новые сверху) или False, если получить changelog еще ни разу не удалось
+    """
+    key = f'{updates_from}:{count}:{repo}'
+    cursor = CURSORS.get(key)
+    per_page, since = get_page_params(updates_from, count, cursor)
+    reason = resilience.get_skip_reason(repo)
+    if reason:
+        resilience.count(f'skipped_{reason}')
+        cfg.LOGGER.warning(f'{updates_from} for {repo} are not requested ({reason}). '
+                           f'{"Using the last good state." if cursor else "No data yet."}')
+        return get_last_good(cursor)
+
+    new_rows, newest_id = [], None
+    page = 1
+    while True:
+        try:
+            changelog = get_last_updates(repo, updates_from, per_page, since=since, page=page)
+        except resilience.FetchError as e:
+            resilience.failure(repo, e)
+            return get_last_good(cursor)
+        for update_id, row in changelog:
+            if cursor and update_id == cursor['id']:
+                break
+            if newest_id is None:
+                newest_id = update_id
+            new_rows.append(row)
+        else:
+            if len(new_rows) < count and len(changelog) == per_page:
+                page += 1  # burst bigger than one page - keep going until the known record shows up
+                continue
+            if cursor and not since:
+                cursor = None  # the known release disappeared - what we have got is the whole list
+        break
+
+    resilience.success(repo)
+    if cursor and not new_rows:
+        return cursor['rows']  # nothing new - the same window object
+    rows = (new_rows + cursor['rows'] if cursor else new_rows)[:count]
+    if rows:
+        CURSORS[key] = {'id': newest_id, 'date': rows[0][1], 'rows': rows}
+    return rows
+
+
+def get_last_good(cursor):
+    """Последнее полученное окно changelog запроса (при ошибке запроса)
+
+    :param cursor: курсор запроса или None
+    :return: список строк changelog или False, если данных нет
+    """
+    if cursor is None:
+        return False
+    resilience.count('stale')
+    return cursor['rows']
+
+
+def poll(repo, updates_from, count):
+    """fetch_changelog с учетом времени опроса репозитария (метрика gitmon_poll_seconds)"""
+    started = time.perf_counter()
+    try:
+        return fetch_changelog(repo, updates_from, count)
+    finally:
+        metrics.observe('gitmon_poll_seconds', time.perf_counter() - started, repo=repo, updates_from=updates_from)
+
+
+def get_cursors(options=cfg.OPTIONS):
+    """Курсоры запросов, которые используются в текущей конфигурации (для сохранения вместе с данными)
+
+    :param options:
+    :return: словарь курсоров
+    """
+    keys = get_request_keys(options)
+    return {key: cursor for key, cursor in CURSORS.items() if key in keys}
+
+
+def get_request_keys(options=cfg.OPTIONS):
+    """Ключи курсоров всех запросов текущей конфигурации ('updates_from:count:repo')
+
+    :param options:
+    :return: множество ключей
+    """
+    return {f'{updates_from}:{count}:{repo_name}' for (repo_name, updates_from), count in plan_requests(options).items()}
+
+
+def get_warm_requests(options=cfg.OPTIONS):
+    """Первые страницы запросов с самыми новыми событиями и HTTP validators (для warmstate.save)
+
+    :param options:
+    :return: словарь {ключ курсора: запись снимка}
+    """
+    requests = {}
+    for key, cursor in get_cursors(options).items():
+        updates_from, count, repo = key.split(':', 2)
+        url = get_url(repo, updates_from, *get_page_params(updates_from, int(count), cursor))
+        entry = httpcache.CACHE.get(url, {})
+        requests[key] = {'url': url, 'id': cursor['id'], 'date': cursor['date'],
+                         'etag': entry.get('etag'), 'last_modified': entry.get('last_modified')}
+    return requests
+
 
+def get_repo_names(repos):
+    """Разбор названия раздела конфигурационного файла на отдельные репозитарии
 
-def set_data(options=cfg.OPTIONS):
+    :param repos: название раздела в виде 'Имя_Владельца/Проект, Имя_Владельца/Проект, ...'
+    :return: список репозитариев
+    """
+    return scheduler.get_repo_names(repos)
+
+
+def get_changed_repos(cursor_ids):
+    """Репозитарии, самая новая запись которых изменилась (для адаптивного интервала опроса)
+
+    :param cursor_ids: словарь {ключ курсора: id} до опроса
+    :return: множество репозитариев
+    """
+    return {key.split(':', 2)[2] for key, cursor in CURSORS.items()
+            if cursor_ids.get(key) is not None and cursor_ids[key] != cursor['id']}
+
+
+def make_row(repo_name, updates_from, update):
+    """Преобразование одной записи из ответа github API в строку changelog
+
+    :param repo_name: название репозитария в виде Имя_Владельца/Проект
+    :param updates_from: 'commits' или 'releases'
+    :param update: запись из ответа github API
+    :return: Event [repo, date, 'COMMIT', author, message] или [repo, date, 'RELEASE', author, name, body]
+    """
+    if updates_from == 'commits':
+        return Event([repo_name,
+                      update['commit']['committer']['date'],
+                      'COMMIT',
+                      update['commit']['author']['name'],
+                      (update['commit']['message'].split('\n'))[0]])
+    return Event([repo_name,
+                  update['published_at'],
+                  'RELEASE',
+                  update['author']['login'],
+                  update['name'],
+                  update['body']])
+
+
+def set_window(repo, updates_from, count, updates):
+    """Запись полного окна changelog, полученного без курсора (fetch_backend: graphql), в курсор запроса
+
+    :param repo: название репозитария в виде Имя_Владельца/Проект
+    :param updates_from: 'commits' или 'releases'
+    :param count: количество строк changelog
+    :param updates: записи в формате ответа github REST API
+    :return: список строк changelog. Если ничего не изменилось - тот же объект, что и в прошлый раз
+    """
+    key = f'{updates_from}:{count}:{repo}'
+    cursor = CURSORS.get(key)
+    newest_id = (updates[0].get('sha') or updates[0].get('id')) if updates else None
+    if cursor and cursor['id'] == newest_id and len(cursor['rows']) == len(updates):
+        return cursor['rows']
+    rows = [make_row(repo, updates_from, update) for update in updates]
+    if rows:
+        CURSORS[key] = {'id': newest_id, 'date': rows[0][1], 'rows': rows}
+    return rows
+
+
+def fetch_all(requests):
+    """Параллельное получение changelog сразу для всех запросов (одна "волна" запросов)
+
+    Количество одновременных запросов ограничено параметром max_concurrency.
+    При fetch_backend: graphql запросы объединяются в пакеты по graphql_batch_size репозитариев (см. ghgraphql.py).
+    Запросы пакета, на которые github не вернул данных, выполняются через REST API.
+    Волна ограничена по времени fetch_deadline: неудачные и невыполненные запросы заменяются последним
+    полученным окном changelog (см. resilience.py).
+
+    :param requests: список кортежей (repo, updates_from, count)
+    :return: словарь {(repo, updates_from, count): список строк changelog или False}
+    """
+    started = time.monotonic()
+    resilience.start_wave(started)
+    graphql = []
+    if cfg.FETCH_BACKEND == 'graphql':
+        if cfg.GITHUB_TOKEN:
+            graphql = [request for request in requests
+                       if request[2] <= ghgraphql.MAX_COUNT and not resilience.get_skip_reason(request[0], started)]
+        else:
+            cfg.LOGGER.warning('fetch_backend: graphql requires github_token in [DEFAULT]. Using REST API.')
+    graphql_set = set(graphql)
+    rest = [request for request in requests if request not in graphql_set]
+    batches = ghgraphql.get_batches(graphql)
+    with ThreadPoolExecutor(max_workers=max(1, cfg.MAX_CONCURRENCY)) as pool:
+        futures = {request: pool.submit(poll, *request) for request in rest}
+        batch_futures = {pool.submit(ghgraphql.fetch_batch, batch): batch for batch in batches}
+        fallback = {}
+        for future, batch in batch_futures.items():
+            try:
+                answers = future.result()
+            except resilience.FetchError as e:
+                cfg.LOGGER.warning(f'{e}. {len(batch)} changelogs are requested through the REST API.')
+                answers = dict.fromkeys(batch)
+            for request in [request for request, updates in answers.items() if updates is None]:
+                fallback[request] = pool.submit(poll, *request)
+                del answers[request]
+            batch_futures[future] = answers
+        results = {request: future.result() for request, future in futures.items()}
+        results.update((request, future.result()) for request, future in fallback.items())
+        for answers in batch_futures.values():
+            for request, updates in answers.items():
+                if updates is False:
+                    results[request] = get_last_good(CURSORS.get('{1}:{2}:{0}'.format(*request)))
+                else:
+                    results[request] = set_window(*request, updates)
+    warmstate.forget()  # answers of the warm state check are only valid for the first wave
+    hits, misses = httpcache.reset_stats()
+    pool = net.reset_stats()
+    failures = resilience.reset_stats()
+    cfg.LOGGER.info(f'Wave of {len(results)} changelogs ({len(rest)} REST, {len(batches)} GraphQL requests) '
+                    f'completed in {time.monotonic() - started:.2f} s (max_concurrency = {cfg.MAX_CONCURRENCY}). '
+                    f'HTTP cache: {hits} hits, {misses} misses. '
+                    f'Connections: {pool["opened"]} opened, {pool["reused"]} reused.')
+    if failures:
+        broken = resilience.get_open_breakers()
+        cfg.LOGGER.warning(f'Wave failures: {", ".join(f"{kind} {n}" for kind, n in sorted(failures.items()))}. '
+                           f'{sum(1 for rows in results.values() if rows is False)} changelogs without data. '
+                           f'Open circuit breakers: {", ".join(broken) if broken else "none"}.')
+    return results
+
+
+@metrics.timed
+def set_data(options=cfg.OPTIONS, due=None):
     """Запись полученных данных о репозитариях в структуру типа dict
 
+    Запросы commits и releases для всех разделов выполняются параллельно (см. fetch_all),
+    после чего changelog каждого репозитария раздела сливаются в один поток от новых к старым (см. events.merge).
+
+    Если задан due, то запрашиваются только эти репозитарии (и те, для которых данных еще нет),
+    остальные репозитарии разделов берутся из последнего полученного окна changelog.
+
     :param options: настройки, определяющие тип собираемых данных. Настройки беруться из конфигурационного файла.
+    :param due: репозитарии, время опроса которых наступило (см. scheduler.Scheduler), или None - все репозитарии
     :return: словарь с данными
     """
     cfg.LOGGER.info(f'Fill the DATA structure according to the configuration file {cfg.CONFIG_PATH}')
+    plan = plan_requests()
+    wanted = [(repo_name, updates_from) for repos in options.keys() for updates_from in ('commits', 'releases')
+              if int(options[repos][updates_from]) > 0 for repo_name in get_repo_names(repos)]
+    requests = [(repo_name, updates_from, plan[(repo_name, updates_from)])
+                for repo_name, updates_from in dict.fromkeys(wanted)]
+    if len(wanted) > len(requests):
+        cfg.LOGGER.info(f'{len(wanted)} changelogs of {len(options)} sections are fetched with {len(requests)} '
+                        f'requests ({len(wanted) - len(requests)} saved by deduplication).')
+        metrics.inc('gitmon_requests_deduplicated_total', len(wanted) - len(requests))
+    known = {}
+    if due is not None:  # repositories of these sections that are not due yet keep their last window
+        known = {request: CURSORS['{1}:{2}:{0}'.format(*request)]['rows'] for request in requests
+                 if request[0] not in due and '{1}:{2}:{0}'.format(*request) in CURSORS}
+    changelogs = fetch_all([request for request in requests if request not in known])
+    changelogs.update(known)
+
     data = {}
     for repos in options.keys():
-        if int(options[repos]['commits']) > 0:
-            for repo_name in [i.strip() for i in str(repos).split(',')]:
-                changelog = get_last_updates(repo_name, updates_from='commits', count=int(options[repos]['commits']))
-                if changelog:
-                    for update in changelog:
-                        if repos not in data:
-                            data[repos] = [[repo_name,
-                                            update['commit']['committer']['date'],
-                                            'COMMIT',
-                                            update['commit']['author']['name'],
-                                            (update['commit']['message'].split('\n'))[0]]]
-                        else:
-                            data[repos].append([repo_name,
-                                                update['commit']['committer']['date'],
-                                                'COMMIT',
-                                                update['commit']['author']['name'],
-                                                (update['commit']['message'].split('\n'))[0]])
-
-        if int(options[repos]['releases']) > 0:
-            for repo_name in [i.strip() for i in str(repos).split(',')]:
-                changelog = get_last_updates(repo_name, updates_from='releases', count=int(options[repos]['releases']))
-                if changelog:
-                    for update in changelog:
-                        if repos not in data:
-                            data[repos] = [[repo_name,
-                                            update['published_at'],
-                                            'RELEASE',
-                                            update['author']['login'],
-                                            update['name'],
-                                            update['body']]]
-                        else:
-                            data[repos].append([repo_name,
-                                                update['published_at'],
-                                                'RELEASE',
-                                                update['author']['login'],
-                                                update['name'],
-                                                update['body']])
-        if repos in data:  # sort data by descending timestamps
-            data[repos] = sorted(data[repos], key=lambda x: dateutil.parser.parse(x[1]), reverse=True)
+        sources = []
+        for updates_from in ('commits', 'releases'):
+            count = int(options[repos][updates_from])
+            if count > 0:
+                sources += [get_window(repo_name, updates_from, count,
+                                       changelogs[(repo_name, updates_from, plan[(repo_name, updates_from)])])
+                            for repo_name in get_repo_names(repos)]
+        sources = [changelog for changelog in sources if changelog]
+        if not sources:
+            continue
+        last_sources, last_rows = _SORTED.get(repos, ([], []))
+        if len(sources) == len(last_sources) and all(a is b for a, b in zip(sources, last_sources)):
+            data[repos] = list(last_rows)  # all changelogs came from cache - nothing to merge
+            continue
+        # changelogs of every repo are already sorted by github - merge them instead of sorting the concatenation
+        rows = list(events.merge(events.ensure_sorted(changelog) for changelog in sources))
+        _SORTED[repos] = (sources, rows)
+        data[repos] = list(rows)
     return data
 
 
-def filter_new_logs(repos, data, old_data, options=cfg.OPTIONS):
+def plan_requests(options=cfg.OPTIONS):
+    """План запросов: один запрос на каждую пару (репозитарий, commits/releases) всех разделов
+
+    Если репозитарий входит в несколько разделов, то запрашивается наибольшее из их количеств строк,
+    а каждый раздел получает первые count строк (см. get_window). Количество берется по всем разделам,
+    а не только по опрашиваемым в этом цикле, чтобы курсор запроса не менялся от цикла к циклу.
+
+    :param options: настройки разделов
+    :return: словарь {(repo, updates_from): count}
+    """
+    plan = {}
+    for repos in options.keys():
+        for updates_from in ('commits', 'releases'):
+            count = int(options[repos][updates_from])
+            if count > 0:
+                for repo_name in get_repo_names(repos):
+                    plan[(repo_name, updates_from)] = max(plan.get((repo_name, updates_from), 0), count)
+    return plan
+
+
+def get_window(repo, updates_from, count, changelog):
+    """Первые count строк changelog, полученного для раздела с большим count
+
+    Пока changelog не изменился, возвращается тот же объект (по нему set_data узнает, что сливать заново нечего).
+
+    :param repo: название репозитария в виде Имя_Владельца/Проект
+    :param updates_from: 'commits' или 'releases'
+    :param count: количество строк changelog раздела
+    :param changelog: результат запроса (или False в случае ошибки)
+    :return: список строк changelog
+    """
+    if not changelog or len(changelog) <= count:
+        return changelog
+    key = (repo, updates_from, count)
+    last = _WINDOWS.get(key)
+    if last is not None and last[0] is changelog:
+        return last[1]
+    window = changelog[:count]
+    _WINDOWS[key] = (changelog, window)
+    return window
+
+
+def process_cycle(due, data):
+    """Обработка данных цикла: отбор новых записей, действия и сохранение данных
+
+    :param due: разделы цикла
+    :param data: данные разделов (см. set_data)
+    :return:
+    """
+    ctx = context.CycleData(data)  # shared by filter_new_logs and all actions of this cycle
+    old_data = ctx.old_data
+    for repos in due:
+        if cfg.OPTIONS[repos]['only_new'] and old_data and repos in old_data and repos in data:
+            data = filter_new_logs(repos, data, ctx=ctx)
+            if data and old_data and old_data[repos][0] == data[repos][0]:
+                cfg.LOGGER.info(f'No new changelogs for {repos}.')
+                continue
+        actions.process_actions(repos, data, ctx=ctx)  # process the data in accordance with the configuration file
+    # one commit per github repository for all github.* actions of the cycle (after them in the github queue)
+    executor.submit('github', ghsink.flush, section='github commits')
+    saved = dict(old_data)
+    saved.update(data)  # sections that were not due this time keep their saved data
+    saved[cfg.CURSORS_KEY] = get_cursors()
+    warm = get_warm_requests()
+    retention.apply(saved)
+    retention.compact(saved, CURSORS, get_request_keys(), {request['url'] for request in warm.values()})
+    ctx.save(saved)  # save data to data.json
+    httpcache.save()
+    warmstate.save(warm)
+
+
+def apply_webhook(repo, updates_from, updates):
+    """Обработка изменений, полученных через webhook (см. webhook.py)
+
+    Записи добавляются в окна курсоров репозитария, как если бы они были получены опросом,
+    после чего для разделов с mode: webhook, в которые входит репозитарий, выполняется цикл без запросов к github.
+
+    :param repo: название репозитария в виде Имя_Владельца/Проект
+    :param updates_from: 'commits' или 'releases'
+    :param updates: записи в формате ответа github REST API (от новых к старым)
+    :return: список обработанных разделов
+    """
+    sections = [repos for repos, options in cfg.OPTIONS.items() if options.get('mode') == 'webhook'
+                and int(options[updates_from]) > 0 and repo in get_repo_names(repos)]
+    if not sections:
+        cfg.LOGGER.info(f'No sections with mode: webhook watch {updates_from} of {repo}.')
+        return []
+    updates = sorted(((update.get('sha') or update.get('id'), make_row(repo, updates_from, update))
+                      for update in updates), key=lambda update: update[1].ts, reverse=True)
+    rows = [row for update_id, row in updates]
+    plan = plan_requests()
+    with _cycle_lock:
+        planned = plan[(repo, updates_from)]
+        key = f'{updates_from}:{planned}:{repo}'
+        cursor = CURSORS.get(key)
+        known = cursor['rows'] if cursor else []
+        new_rows = [row for row in rows if row not in known]  # github may deliver the same event again
+        if new_rows:
+            window = list(events.merge([new_rows, known], limit=planned))
+            newest_id = updates[0][0] if window[0] is rows[0] else cursor['id']
+            CURSORS[key] = {'id': newest_id, 'date': window[0][1], 'rows': window}
+        data = {}
+        for repos in sections:
+            sources = []
+            for source in ('commits', 'releases'):
+                count = int(cfg.OPTIONS[repos][source])
+                for repo_name in get_repo_names(repos) if count > 0 else []:
+                    cursor = CURSORS.get(f'{source}:{plan[(repo_name, source)]}:{repo_name}')
+                    if cursor:
+                        sources.append(get_window(repo_name, source, count, cursor['rows']))
+            data[repos] = list(events.merge(events.ensure_sorted(changelog) for changelog in sources))
+        process_cycle({repos: cfg.OPTIONS[repos] for repos in sections}, data)
+    return sections
+
+
+def reload_config(queue):
+    """Применение изменений конфигурационного файла между циклами (без перезапуска)
+
+    Курсоры, кэш и время следующего опроса неизменившихся разделов сохраняются,
+    новые разделы опрашиваются сразу.
+
+    :param queue: scheduler.Scheduler
+    :return: True, если изменения применены
+    """
+    cfg.LOGGER.info(f'Configuration file {cfg.CONFIG_PATH} changed. Reloading...')
+    executor.drain()  # queued actions use the options of their cycle
+    result = setup.reload_options(cfg.CONFIG_PATH)
+    if result is None:
+        return False
+    added, removed, changed = result
+    queue.update(added, removed, changed)
+    for repos in removed + changed:
+        _SORTED.pop(repos, None)
+    cfg.LOGGER.info(f'Configuration reloaded. Added: {added}, removed: {removed}, changed: {changed}.')
+    return True
+
+
+def get_wake_time():
+    """Время, когда нужно проснуться раньше следующего опроса: отложенный триггер или проверка конфигурационного файла
+
+    Триггер, время которого уже наступило, будит не раньше чем через TRIGGER_RECHECK секунд: его flush уже
+    в очереди или выполняется.
+    """
+    now = time.time()
+    wake = [now + cfg.CONFIG_RELOAD] if cfg.CONFIG_RELOAD else []
+    if cfg.SERVE:
+        wake.append(now + 60)  # sections may be updated by webhooks only - nothing else to wait for
+    due = triggers.next_due()
+    if due is not None:
+        wake.append(max(due, now + TRIGGER_RECHECK))
+    return min(wake) if wake else None
+
+
+@metrics.timed
+def filter_new_logs(repos, data, old_data=None, options=cfg.OPTIONS, ctx=None):
     """Формирование структуры только с новыми данными.
 
     :param repos: наименование репозитария
     :param data: весь объем данных
     :param old_data: только старые данные (загружаются из файла data.json)
     :param options: проверка флага 'only_new' для репозитария (определяется конфигурационным файлом)
+    :param ctx: данные цикла (context.CycleData). Если old_data не задан, то старые данные берутся из него
     :return: new_data = data - old_data
     """
     cfg.LOGGER.info(f'Selecting only new logs for repo {repos}')
+    if old_data is None and ctx is not None:
+        old_data = ctx.old_data
     if options[repos]['only_new']:
-        new_logs = []
         if old_data and repos in old_data:
             if old_data[repos] and data[repos]:
                 if old_data[repos][0] != data[repos][0]:
-                    last_log = old_data[repos][0]
-                    for log in data[repos]:
-                        if dateutil.parser.parse(log[1]) > dateutil.parser.parse(last_log[1]):
-                            new_logs.append(log)
-                        else:
-                            break
-                    data[repos] = new_logs
+                    data[repos] = list(events.newer_than(data[repos], old_data[repos][0]))
                 else:
                     data[repos] = old_data[repos]
     return data
@@ -138,29 +647,71 @@ if __name__ == '__main__':
     setup.setup_env()  # reading and setting CONFIG_PATH and DATA_PATH in cfg.py
     if setup.read_options(cfg.CONFIG_PATH):  # reading configuration file from CONFIG_PATH
         cfg.LOGGER = setup.setup_log()
+        for error in setup.OPTION_ERRORS:
+            cfg.LOGGER.error(error)
+        if cfg.SHARD:
+            shards.setup_worker(*cfg.SHARD, spool=cfg.SPOOL)  # only the sections of this worker
+        elif cfg.WORKERS > 1:
+            exit(shards.run_workers(cfg.WORKERS))  # coordinator of the local workers
         cfg.LOGGER.info(f'|===>')
+        if cfg.UPDATE_INTERVAL == 0 and not cfg.SERVE and warmstate.check(get_request_keys()):
+            # nothing new since the last run - data, cache and triggers are not even loaded
+            cfg.LOGGER.info(f'No new changelogs. Processing complete. Exiting...')
+            exit(0)
+        metrics.serve()  # if metrics_port is set
         cfg.LOGGER.info(f'We begin to collect data from the {list(cfg.OPTIONS.keys())} github repositories.')
-        while True:  # if cfg.UPDATE_INTERVAL == 0 we do cycle one time and exit
-            cfg.LOGGER.info(f'...')
-            data = set_data()
-            if data:
-                cfg.LOGGER.info(f'Reading {cfg.DATA_PATH}.')
-                old_data = setup.load_data()
-                for repos in cfg.OPTIONS.keys():
-                    if cfg.OPTIONS[repos]['only_new'] and old_data:
-                        data = filter_new_logs(repos, data, old_data)
-                        if data and old_data and old_data[repos][0] == data[repos][0]:
-                            cfg.LOGGER.info(f'No new changelogs for {repos}.')
-                            continue
-                    actions.process_actions(repos, data)  # process the data in accordance with the configuration file
-                setup.save_data(data)  # save data to data.json
-                if cfg.UPDATE_INTERVAL == 0:
+        httpcache.load()
+        triggers.load()
+        CURSORS.update(setup.load_data().get(cfg.CURSORS_KEY, {}))
+        queue = scheduler.Scheduler(cfg.OPTIONS)
+        signal.signal(signal.SIGTERM, lambda signum, frame: exit(0))  # docker stop: finish queued actions first
+        executor.start()
+        if cfg.SERVE and not webhook.serve(apply_webhook):
+            exit(1)
+        continuous = cfg.UPDATE_INTERVAL or cfg.SERVE
+        try:
+            while True:  # if cfg.UPDATE_INTERVAL == 0 we do cycle one time and exit (unless we receive webhooks)
+                if continuous and cfg.CONFIG_RELOAD and setup.config_changed(cfg.CONFIG_PATH):
+                    with _cycle_lock:
+                        reload_config(queue)
+                due_repos = queue.pop_due()
+                due = {repos: cfg.OPTIONS[repos] for repos in queue.get_sections(due_repos)}
+                if not due and continuous:  # woken up to check the configuration file or dockerhub triggers
+                    triggers.submit_flush()
+                    queue.wait(until=get_wake_time(), wake=triggers.WAKE)
+                    continue
+                cfg.LOGGER.info(f'...')
+                with _cycle_lock:
+                    cursor_ids = {key: cursor['id'] for key, cursor in CURSORS.items()}
+                    data = set_data(due, due_repos) if due else {}
+                    if data:
+                        process_cycle(due, data)
+                    changed = get_changed_repos(cursor_ids)
+                if not data and due:
+                    cfg.LOGGER.warning(f'Error getting data for {list(due.keys())}.')
+                triggers.submit_flush()
+                metrics.log_summary()
+                if not continuous:
                     cfg.LOGGER.info(f'Processing complete. Exiting...')
                     break
-                cfg.LOGGER.info(f'Processing complete. Sleeping {cfg.UPDATE_INTERVAL} minutes.')
-                time.sleep(cfg.UPDATE_INTERVAL * 60)  # repeat cycle every UPDATE_INTERVAL minutes
-            else:
-                cfg.LOGGER.warn(f'Error getting data for {list(cfg.OPTIONS.keys())}.')
+                for repo in due_repos:
+                    interval = queue.reschedule(repo, changed=repo in changed)
+                    if interval is None:
+                        cfg.LOGGER.info(f'{repo} is updated by webhooks only.')
+                    else:
+                        cfg.LOGGER.info(f'Next poll of {repo} in {interval / 60:.1f} minutes.')
+                executor.log_stats()
+                if queue.next_due() is not None:
+                    cfg.LOGGER.info(f'Processing complete. Next poll in {max(0.0, queue.next_due() - time.time()) / 60:.1f} minutes.')
+                else:
+                    cfg.LOGGER.info(f'Processing complete.')
+                # sleep until the next section, dockerhub trigger or config check (or a trigger added by queued actions)
+                queue.wait(until=get_wake_time(), wake=triggers.WAKE)
+        finally:
+            executor.shutdown()
+            cpupool.shutdown()
+            triggers.flush()  # triggers requested by the last queued actions
+            triggers.save()  # the rest will be started after restart
     else:
         print(f'Error reading configuration file {cfg.CONFIG_PATH}. Exiting...')
         exit(1)
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Requires python 3.6+
+
+#######################################################################################################################
+# Persistent cache of HTTP validators (ETag / Last-Modified) for github API requests
+#
+# For every url the cache keeps the validators of the last successful response together with the already parsed
+# changelog. The validators are sent back with the next request, and "304 Not Modified" is answered from the cache.
+# The file carries the version of its format: a cache of another version is discarded and filled again from scratch.
+#######################################################################################################################
+
+
+import json
+import threading
+import time
+from pathlib import Path
+
+import cfg
+import bodies
+from events import Event
+
+
+VERSION = 2  # 1 - the file was the CACHE dict itself, payload rows without update ids
+CACHE = {}  # url -> {'etag': ..., 'last_modified': ..., 'payload': [...], 'used': timestamp}
+STATS = {'hits': 0, 'misses': 0}  # counters since the last call of reset_stats()
+_lock = threading.Lock()
+_changed = False
+
+
+def get_cache_path():
+    """Путь к файлу кэша. По-умолчанию - рядом с файлом данных (data.json -> data.cache.json)
+
+    :return:
+    """
+    if cfg.HTTP_CACHE_PATH:
+        return cfg.HTTP_CACHE_PATH
+    return str(Path(cfg.DATA_PATH).with_suffix('.cache.json'))
+
+
+def load(cache_file=''):
+    """Загрузка кэша из файла
+
+    :param cache_file: путь к файлу кэша
+    :return: количество загруженных записей
+    """
+    global _changed
+    if not cache_file:
+        cache_file = get_cache_path()
+    try:
+        with open(cache_file, 'r') as js:
+            stored = json.loads(js.read())
+    except (OSError, ValueError):
+        stored = {}
+    cache, valid = {}, not stored
+    if isinstance(stored, dict) and stored.get('version') == VERSION:
+        now = int(time.time())
+        try:
+            for url, entry in stored['entries'].items():
+                entry['payload'] = [[update_id, Event(row)] for update_id, row in entry['payload']]
+                entry.setdefault('used', now)
+                cache[url] = entry
+            valid = True
+        except (KeyError, IndexError, TypeError, ValueError, AttributeError):
+            cache = {}
+    if not valid:
+        cfg.LOGGER.warning(f'HTTP cache {cache_file} has another format or is damaged. Starting with an empty cache.')
+    with _lock:
+        CACHE.clear()
+        CACHE.update(cache)
+        _changed = False
+    cfg.LOGGER.info(f'Loaded {len(CACHE)} HTTP cache entries from {cache_file}')
+    return len(CACHE)
+
+
+def save(cache_file=''):
+    """Сохранение кэша в файл (только если он изменился)
+
+    :param cache_file: путь к файлу кэша
+    :return:
+    """
+    global _changed
+    if not cache_file:
+        cache_file = get_cache_path()
+    with _lock:
+        # urls with a 'since' cursor are never requested again once the cursor has moved on
+        expired = time.time() - max(24 * 60 * 60, max(cfg.MAX_UPDATE_INTERVAL, cfg.UPDATE_INTERVAL) * 2 * 60)
+        for url in [url for url, entry in CACHE.items() if entry['used'] < expired]:
+            del CACHE[url]
+            _changed = True
+        if not _changed:
+            return
+        cfg.LOGGER.info(f'Saving HTTP cache to {cache_file}...')
+        with open(cache_file, 'w') as js:
+            json.dump({'version': VERSION, 'entries': CACHE}, js, default=bodies.encode)
+        _changed = False
+
+
+def get_validators(url):
+    """Заголовки условного запроса для url
+
+    :param url:
+    :return: словарь с заголовками If-None-Match и/или If-Modified-Since
+    """
+    headers = {}
+    entry = CACHE.get(url)
+    if entry:
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+    return headers
+
+
+def get_payload(url):
+    """Данные из кэша для ответа "304 Not Modified"
+
+    :param url:
+    :return: ранее сохраненный (уже разобранный) changelog или False, если записи нет
+    """
+    with _lock:
+        entry = CACHE.get(url)
+        if entry is None:
+            STATS['misses'] += 1
+            return False
+        STATS['hits'] += 1
+        entry['used'] = int(time.time())
+        return entry['payload']
+
+
+def store(url, headers, payload):
+    """Сохранение в кэш результата успешного запроса
+
+    :param url:
+    :param headers: заголовки ответа
+    :param payload: разобранный changelog
+    :return:
+    """
+    global _changed
+    etag = headers.get('ETag')
+    last_modified = headers.get('Last-Modified')
+    with _lock:
+        STATS['misses'] += 1
+        if etag or last_modified:
+            CACHE[url] = {'etag': etag, 'last_modified': last_modified, 'payload': payload, 'used': int(time.time())}
+            _changed = True
+        elif CACHE.pop(url, None) is not None:
+            _changed = True
+
+
+def prune(urls):
+    """Удаление записей запросов с параметром since, которые больше не будут выполняться
+
+    Курсор каждого запроса commits после нового commit переходит на новый url, а прежний url остается в кэше.
+
+    :param urls: адреса, которые еще используются
+    :return: количество удаленных записей
+    """
+    global _changed
+    with _lock:
+        unused = [url for url in CACHE if 'since=' in url and url not in urls]
+        for url in unused:
+            del CACHE[url]
+        _changed = _changed or bool(unused)
+    return len(unused)
+
+
+def reset_stats():
+    """Получение и обнуление счетчиков попаданий в кэш
+
+    :return: (hits, misses)
+    """
+    with _lock:
+        stats = (STATS['hits'], STATS['misses'])
+        STATS['hits'] = STATS['misses'] = 0
+    return stats
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Requires python 3.6+
+
+#######################################################################################################################
+# Counters, gauges and timers of the hot paths
+#
+# Metrics are kept in memory with their labels, written to the log as one summary line per cycle (the difference
+# since the previous cycle) and, if metrics_port is set, served in Prometheus text format on http://host:port/metrics.
+#######################################################################################################################
+
+
+import functools
+import threading
+import time
+
+import cfg
+
+
+HELP = {
+    'gitmon_http_requests_total': ('counter', 'HTTP requests by host and response status'),
+    'gitmon_http_received_bytes_total': ('counter', 'Bytes received from the network (before decompression)'),
+    'gitmon_rate_limit_remaining': ('gauge', 'Remaining github API requests in the current rate limit window'),
+    'gitmon_poll_seconds': ('summary', 'Time to get the changelog of one repository'),
+    'gitmon_function_seconds': ('summary', 'Time spent in hot-path functions'),
+    'gitmon_cycles_total': ('counter', 'Completed polling cycles'),
+    'gitmon_requests_deduplicated_total': ('counter', 'Requests saved by fetching a shared repository once'),
+    'gitmon_webhooks_total': ('counter', 'Received github webhooks by event and response status'),
+    'gitmon_fetch_failures_total': ('counter', 'Failed, retried and skipped github requests by kind'),
+}
+COUNTERS = {}  # (name, labels) -> value. labels - tuple of (label, value) pairs
+GAUGES = {}  # (name, labels) -> value
+TIMERS = {}  # (name, labels) -> [sum of seconds, count]
+_lock = threading.Lock()
+_last = {}  # values of COUNTERS and TIMERS at the previous summary
+_server = None
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, value=1, **labels):
+    """Увеличение счетчика
+
+    :param name: имя метрики
+    :param value:
+    :param labels: метки
+    :return:
+    """
+    key = _key(name, labels)
+    with _lock:
+        COUNTERS[key] = COUNTERS.get(key, 0) + value
+
+
+def set_gauge(name, value, **labels):
+    """Установка значения метрики
+
+    :param name: имя метрики
+    :param value:
+    :param labels: метки
+    :return:
+    """
+    with _lock:
+        GAUGES[_key(name, labels)] = value
+
+
+def observe(name, seconds, **labels):
+    """Учет продолжительности операции
+
+    :param name: имя метрики
+    :param seconds:
+    :param labels: метки
+    :return:
+    """
+    key = _key(name, labels)
+    with _lock:
+        timer = TIMERS.setdefault(key, [0.0, 0])
+        timer[0] += seconds
+        timer[1] += 1
+
+
+def timed(func):
+    """Декоратор: учет времени выполнения функции в gitmon_function_seconds{function="..."}"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            observe('gitmon_function_seconds', time.perf_counter() - started, function=func.__name__)
+    return wrapper
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    values = ','.join('{}="{}"'.format(label, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                      for label, value in labels)
+    return '{' + values + '}'
+
+
+def render():
+    """Все метрики в текстовом формате Prometheus
+
+    :return: str
+    """
+    with _lock:
+        samples = {}
+        for (name, labels), value in COUNTERS.items():
+            samples.setdefault(name, []).append(f'{name}{_format_labels(labels)} {value}')
+        for (name, labels), value in GAUGES.items():
+            samples.setdefault(name, []).append(f'{name}{_format_labels(labels)} {value}')
+        for (name, labels), (total, count) in TIMERS.items():
+            samples.setdefault(name, []).append(f'{name}_sum{_format_labels(labels)} {total:.6f}')
+            samples[name].append(f'{name}_count{_format_labels(labels)} {count}')
+    lines = []
+    for name in sorted(samples):
+        kind, description = HELP.get(name, ('untyped', name))
+        lines += [f'# HELP {name} {description}', f'# TYPE {name} {kind}'] + samples[name]
+    return '\n'.join(lines) + '\n'
+
+
+def summary():
+    """Строка с изменением метрик со времени предыдущего вызова (для лога)
+
+    :return: str
+    """
+    with _lock:
+        statuses, received = {}, 0
+        for (name, labels), value in COUNTERS.items():
+            delta = value - _last.get((name, labels), 0)
+            if name == 'gitmon_http_requests_total' and delta:
+                status = dict(labels)['status']
+                statuses[status] = statuses.get(status, 0) + delta
+            elif name == 'gitmon_http_received_bytes_total':
+                received += delta
+            _last[(name, labels)] = value
+        functions, polls = {}, [0.0, 0]
+        for (name, labels), (total, count) in TIMERS.items():
+            last_total, last_count = _last.get((name, labels), (0.0, 0))
+            if count == last_count:
+                continue
+            if name == 'gitmon_function_seconds':
+                functions[dict(labels)['function']] = (total - last_total, count - last_count)
+            elif name == 'gitmon_poll_seconds':
+                polls[0] += total - last_total
+                polls[1] += count - last_count
+            _last[(name, labels)] = (total, count)
+        remaining = GAUGES.get(('gitmon_rate_limit_remaining', ()))
+    line = 'requests ' + (', '.join(f'{status}: {count}' for status, count in sorted(statuses.items())) or '0')
+    line += f'; received {received / 1024:.1f} KiB'
+    if remaining is not None:
+        line += f'; rate limit remaining {remaining}'
+    if polls[1]:
+        line += f'; poll latency {polls[0] / polls[1]:.3f} s avg of {polls[1]}'
+    if functions:
+        line += '; ' + ', '.join(f'{function} {total:.3f} s/{count}'
+                                 for function, (total, count) in sorted(functions.items()))
+    return line
+
+
+def log_summary():
+    """Вывод метрик цикла в лог
+
+    :return:
+    """
+    inc('gitmon_cycles_total')
+    cfg.LOGGER.info(f'Cycle metrics: {summary()}')
+
+
+def serve(port=None, host=None):
+    """Запуск HTTP-сервера метрик в отдельном потоке (если задан metrics_port)
+
+    :param port: по-умолчанию - metrics_port из конфигурационного файла
+    :param host: по-умолчанию - metrics_host из конфигурационного файла
+    :return: True, если сервер запущен
+    """
+    global _server
+    port = cfg.METRICS_PORT if port is None else port
+    host = cfg.METRICS_HOST if host is None else host
+    if not port or _server is not None:
+        return False
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # only if the endpoint is enabled
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = render().encode('utf8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            cfg.LOGGER.debug(f'Metrics request from {self.client_address[0]}: {format % args}')
+
+    try:
+        _server = ThreadingHTTPServer((host, port), Handler)
+    except OSError as e:
+        cfg.LOGGER.error(f'Error starting metrics server on {host}:{port}. Reason: {e}')
+        return False
+    _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, name='GitMon-metrics', daemon=True).start()
+    cfg.LOGGER.info(f'Serving metrics on http://{host}:{port}/metrics')
+    return True
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Requires python 3.6+
+
+#######################################################################################################################
+# Pool of persistent (keep-alive) HTTP connections used for all outbound requests
+#
+# Connections are kept per (scheme, host, port) and reused by the next request to the same host, so the TCP and TLS
+# handshakes are paid once instead of on every request. Errors are reported the same way as urllib.request.urlopen
+# does it (HTTPError for non-2xx responses, URLError for network errors), so callers keep their error handling.
+# A request that failed on a reused connection is repeated on a new one only if the server had closed that idle
+# connection (reset or disconnect without an answer) and the request is idempotent: a POST (e.g. a build trigger of
+# hub.docker.com) is never sent twice, and a timeout is never repeated.
+# Hosts that must be reached through a proxy (HTTP_PROXY, HTTPS_PROXY, NO_PROXY) are requested by urllib.request
+# without the pool.
+#######################################################################################################################
+
+
+import gzip
+import http.client
+import io
+import threading
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlsplit
+from urllib.request import getproxies, proxy_bypass
+
+import cfg
+import metrics
+
+
+USER_AGENT = 'GitMon'
+IDEMPOTENT = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+STALE_ERRORS = (ConnectionResetError, ConnectionAbortedError, BrokenPipeError, http.client.RemoteDisconnected)
+STATS = {'requests': 0, 'opened': 0, 'reused': 0}  # counters since the last call of reset_stats()
+_pool = {}  # (scheme, host, port) -> list of idle connections
+_lock = threading.Lock()
+
+
+class Response:
+    """Ответ сервера с уже прочитанным (и распакованным) телом"""
+
+    def __init__(self, url, status, reason, headers, body):
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.msg = reason
+        self.headers = headers
+        self.body = body
+
+    def read(self):
+        return self.body
+
+
+def _acquire(key, timeout):
+    """Получение соединения из пула или открытие нового
+
+    :param key: (scheme, host, port)
+    :param timeout:
+    :return: (connection, True если соединение взято из пула)
+    """
+    with _lock:
+        idle = _pool.get(key)
+        if idle:
+            STATS['reused'] += 1
+            conn = idle.pop()
+            conn.timeout = timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            return conn, True
+        STATS['opened'] += 1
+    scheme, host, port = key
+    if scheme == 'https':
+        return http.client.HTTPSConnection(host, port, timeout=timeout), False
+    return http.client.HTTPConnection(host, port, timeout=timeout), False
+
+
+def _release(key, conn):
+    """Возврат соединения в пул. Лишние соединения (больше http_pool_size на хост) закрываются
+
+    :param key: (scheme, host, port)
+    :param conn:
+    :return:
+    """
+    with _lock:
+        idle = _pool.setdefault(key, [])
+        if len(idle) < cfg.HTTP_POOL_SIZE:
+            idle.append(conn)
+            return
+    conn.close()
+
+
+def request(url, data=None, headers=None, method=None, timeout=None):
+    """Выполнение HTTP-запроса через пул соединений
+
+    :param url:
+    :param data: тело запроса (bytes)
+    :param headers: дополнительные заголовки запроса
+    :param method: по-умолчанию GET, или POST если задан data
+    :param timeout: таймаут в секундах. По-умолчанию - http_timeout из конфигурационного файла
+    :return: Response
+    """
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    port = parts.port or (443 if scheme == 'https' else 80)
+    key = (scheme, parts.hostname, port)
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+    if method is None:
+        method = 'GET' if data is None else 'POST'
+    if timeout is None:
+        timeout = cfg.HTTP_TIMEOUT
+    request_headers = {'User-Agent': USER_AGENT, 'Accept-Encoding': 'gzip'}
+    request_headers.update(headers or {})
+
+    if _use_proxy(scheme, parts.hostname):
+        return _request_proxy(url, data, request_headers, method, timeout, parts.hostname)
+
+    with _lock:
+        STATS['requests'] += 1
+    while True:
+        conn, reused = _acquire(key, timeout)
+        try:
+            conn.request(method, path, body=data, headers=request_headers)
+            res = conn.getresponse()
+            body = res.read()
+        except (http.client.HTTPException, OSError) as e:
+            conn.close()
+            if reused and method in IDEMPOTENT and isinstance(e, STALE_ERRORS):
+                continue  # the server has closed an idle keep-alive connection - retry with a new one
+            metrics.inc('gitmon_http_requests_total', host=parts.hostname, status='error')
+            raise URLError(e)
+        break
+    metrics.inc('gitmon_http_requests_total', host=parts.hostname, status=res.status)
+    metrics.inc('gitmon_http_received_bytes_total', len(body), host=parts.hostname)
+
+    if res.will_close:
+        conn.close()
+    else:
+        _release(key, conn)
+
+    if res.getheader('Content-Encoding', '').lower() == 'gzip':
+        try:
+            body = gzip.decompress(body)
+        except OSError as e:
+            raise URLError(e)
+    if res.status >= 300:
+        raise HTTPError(url, res.status, res.reason, res.headers, io.BytesIO(body))
+    return Response(url, res.status, res.reason, res.headers, body)
+
+
+def _use_proxy(scheme, host):
+    """Нужно ли запрашивать host через прокси (переменные окружения HTTP_PROXY, HTTPS_PROXY, NO_PROXY)"""
+    return scheme in getproxies() and not proxy_bypass(host)
+
+
+def _request_proxy(url, data, headers, method, timeout, host):
+    """Запрос через прокси средствами urllib.request (без пула соединений)
+
+    :return: Response
+    """
+    from urllib.request import Request, urlopen
+    headers = {name: value for name, value in headers.items() if name != 'Accept-Encoding'}
+    with _lock:
+        STATS['requests'] += 1
+    try:
+        with urlopen(Request(url, data=data, headers=headers, method=method), timeout=timeout) as res:
+            body = res.read()
+    except HTTPError as e:
+        metrics.inc('gitmon_http_requests_total', host=host, status=e.code)
+        raise
+    except (http.client.HTTPException, OSError) as e:
+        metrics.inc('gitmon_http_requests_total', host=host, status='error')
+        raise e if isinstance(e, URLError) else URLError(e)
+    metrics.inc('gitmon_http_requests_total', host=host, status=res.status)
+    metrics.inc('gitmon_http_received_bytes_total', len(body), host=host)
+    return Response(url, res.status, res.reason, res.headers, body)
+
+
+def reset_stats():
+    """Статистика использования пула с предыдущего вызова
+
+    :return: словарь {'requests': ..., 'opened': ..., 'reused': ...}
+    """
+    with _lock:
+        stats = dict(STATS)
+        for name in STATS:
+            STATS[name] = 0
+    return stats
+
+
+def close_all():
+    """Закрытие всех простаивающих соединений
+
+    :return:
+    """
+    with _lock:
+        connections = [conn for idle in _pool.values() for conn in idle]
+        _pool.clear()
+    for conn in connections:
+        conn.close()
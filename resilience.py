@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Requires python 3.6+
+
+#######################################################################################################################
+# Error handling of the fetch pipeline: classified errors, retries, circuit breakers and the wave deadline
+#
+# Every failed request is classified (network, server, rate_limit, not_found, client, bad_response). Network and
+# server errors are retried with exponential backoff and full jitter (fetch_retries, fetch_retry_delay), the rest
+# are not: a repeated request would get the same answer. A repository whose requests fail breaker_threshold times in a
+# row is not requested for breaker_cooldown seconds (doubled after every failed trial, see Breaker). When github
+# reports an exhausted rate limit, the rest of the wave is not requested at all. Every wave of requests has a deadline
+# (fetch_deadline): requests in flight time out by then, retries that do not fit and requests that have not started
+# by then are skipped. Repositories that were not fetched are served from their last good state (the cursor window),
+# so the cycle finishes in bounded time with partial results whatever github is doing.
+#######################################################################################################################
+
+
+import random
+import threading
+import time
+from urllib.error import URLError
+
+import cfg
+import metrics
+
+
+RETRYABLE = ('network', 'server')
+MAX_COOLDOWN = 24 * 60 * 60  # longest time a broken repository is not requested
+STATS = {}  # kind of failure -> number of failures since the last call of reset_stats()
+_breakers = {}  # repo -> Breaker
+_wave = {'deadline': None, 'stopped': ''}
+_lock = threading.Lock()
+
+
+class FetchError(Exception):
+    """Ошибка получения changelog с классом ошибки (kind)"""
+
+    def __init__(self, kind, message):
+        super().__init__(message)
+        self.kind = kind
+
+    @property
+    def retryable(self):
+        return self.kind in RETRYABLE
+
+
+class Breaker:
+    """Circuit breaker одного репозитария: closed -> open (после threshold ошибок подряд) -> half-open (пробный
+    запрос после cooldown) -> closed или снова open с удвоенным cooldown"""
+
+    def __init__(self):
+        self.failures = 0
+        self.opened = None  # time the breaker was opened
+        self.cooldown = 0
+
+    def allow(self, now):
+        """Можно ли выполнять запрос (в состоянии half-open - только пробный)"""
+        return self.opened is None or now - self.opened >= self.cooldown
+
+    def failure(self, now):
+        """Учет ошибки
+
+        :return: True, если breaker только что открылся
+        """
+        self.failures += 1
+        if self.opened is not None:  # the trial request of the half-open state has failed
+            self.opened = now
+            self.cooldown = min(MAX_COOLDOWN, self.cooldown * 2)
+            return True
+        if self.failures >= max(1, cfg.BREAKER_THRESHOLD):
+            self.opened = now
+            self.cooldown = max(1, cfg.BREAKER_COOLDOWN)
+            return True
+        return False
+
+
+def classify(error):
+    """Класс ошибки запроса
+
+    :param error: исключение (URLError, HTTPError, ValueError, KeyError, ...)
+    :return: FetchError
+    """
+    if isinstance(error, FetchError):
+        return error
+    code = getattr(error, 'code', None)
+    if isinstance(error, URLError) and code is None:
+        return FetchError('network', f'Network error: {error.reason}')
+    if code is not None:
+        headers = getattr(error, 'headers', None) or {}
+        if code == 429 or (code == 403 and (headers.get('X-RateLimit-Remaining') == '0' or 'Retry-After' in headers)):
+            return FetchError('rate_limit', f'Rate limit exceeded (HTTP {code})')
+        if code >= 500:
+            return FetchError('server', f'Server error: HTTP {code}')
+        if code in (404, 410):
+            return FetchError('not_found', f'Not found: HTTP {code}')
+        return FetchError('client', f'Request rejected: HTTP {code}')
+    return FetchError('bad_response', f'Unexpected response: {type(error).__name__} {error}')
+
+
+def start_wave(now=None):
+    """Начало волны запросов: отсчет fetch_deadline
+
+    :param now: time.monotonic()
+    :return:
+    """
+    if now is None:
+        now = time.monotonic()
+    with _lock:
+        _wave['deadline'] = now + cfg.FETCH_DEADLINE if cfg.FETCH_DEADLINE else None
+        _wave['stopped'] = ''
+
+
+def get_skip_reason(repo, now=None):
+    """Почему запрос к репозитарию сейчас не выполняется
+
+    :param repo: название репозитария
+    :param now: time.monotonic()
+    :return: 'breaker', 'deadline', 'rate_limit' или '' (запрос можно выполнять)
+    """
+    if now is None:
+        now = time.monotonic()
+    with _lock:
+        if _wave['stopped']:
+            return _wave['stopped']
+        if _wave['deadline'] is not None and now >= _wave['deadline']:
+            return 'deadline'
+        breaker = _breakers.get(repo)
+        if breaker is not None and not breaker.allow(now):
+            return 'breaker'
+    return ''
+
+
+def get_timeout(now=None):
+    """Таймаут запроса: http_timeout, но не дольше, чем осталось до fetch_deadline волны (не меньше 1 секунды)"""
+    if now is None:
+        now = time.monotonic()
+    with _lock:
+        deadline = _wave['deadline']
+    if deadline is None:
+        return cfg.HTTP_TIMEOUT
+    return max(1, min(cfg.HTTP_TIMEOUT, deadline - now))
+
+
+def retry(func, name=''):
+    """Выполнение функции с повторами при сетевых ошибках и ошибках сервера
+
+    Перед повтором выдерживается пауза fetch_retry_delay * 2^n со случайным разбросом (full jitter).
+    Повтор, который не укладывается в fetch_deadline волны, не выполняется.
+
+    :param func: функция без аргументов (один запрос)
+    :param name: что запрашивается (для лога)
+    :return: результат функции
+    :raises FetchError: если все попытки неудачны
+    """
+    attempt = 0
+    while True:
+        try:
+            return func()
+        except (URLError, ValueError, KeyError, TypeError, IndexError) as e:
+            error = classify(e)
+        if error.kind == 'rate_limit':
+            with _lock:
+                _wave['stopped'] = 'rate_limit'  # the rest of the wave would get the same answer
+        if not error.retryable or attempt >= cfg.FETCH_RETRIES:
+            raise error
+        delay = random.uniform(0, cfg.FETCH_RETRY_DELAY * 2 ** attempt)
+        with _lock:
+            deadline = _wave['deadline']
+        if deadline is not None and time.monotonic() + delay >= deadline:
+            raise error
+        attempt += 1
+        count('retry')
+        cfg.LOGGER.warning(f'{error} getting {name}. Retry {attempt} of {cfg.FETCH_RETRIES} in {delay:.1f} s.')
+        time.sleep(delay)
+
+
+def count(kind):
+    with _lock:
+        STATS[kind] = STATS.get(kind, 0) + 1
+    metrics.inc('gitmon_fetch_failures_total', kind=kind)
+
+
+def success(repo):
+    """Учет успешного запроса к репозитарию"""
+    with _lock:
+        breaker = _breakers.get(repo)
+        if breaker is not None:
+            if breaker.opened is not None:
+                cfg.LOGGER.info(f'Circuit breaker of {repo} is closed.')
+            del _breakers[repo]
+
+
+def failure(repo, error, now=None):
+    """Учет неудачного запроса к репозитарию
+
+    Исчерпанный rate limit - общая проблема всех репозитариев, на breaker он не влияет.
+
+    :param repo: название репозитария
+    :param error: FetchError
+    :param now: time.monotonic()
+    :return:
+    """
+    if now is None:
+        now = time.monotonic()
+    count(error.kind)
+    if error.kind == 'rate_limit':
+        return
+    with _lock:
+        breaker = _breakers.setdefault(repo, Breaker())
+        opened = breaker.failure(now)
+        cooldown = breaker.cooldown
+    if opened:
+        count('breaker_opened')
+        cfg.LOGGER.warning(f'Circuit breaker of {repo} is open: it is not requested for {cooldown} s.')
+
+
+def get_open_breakers():
+    """Репозитарии, которые сейчас не запрашиваются"""
+    now = time.monotonic()
+    with _lock:
+        return sorted(repo for repo, breaker in _breakers.items() if not breaker.allow(now))
+
+
+def reset_stats():
+    """Получение и обнуление счетчиков ошибок
+
+    :return: словарь {класс ошибки: количество}
+    """
+    with _lock:
+        stats = dict(STATS)
+        STATS.clear()
+    return stats
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Requires python 3.6+
+
+#######################################################################################################################
+# Retention of the stored history and compaction of the in-memory state
+#
+# Before the data of a cycle is saved, the rows of every section are cut by its retention policy: max_events newest
+# events and events not older than max_age days (the newest event of a section is always kept, only_new compares
+# with it). The sqlite backend applies the same policy to the history in its events table.
+# After that the state that lives between cycles is compacted: cursors of requests that are no longer configured are
+# dropped, so are HTTP cache entries of 'since' urls the cursors have moved away from, and release bodies of the data,
+# cursors and HTTP cache are moved to the content-addressed store (bodies.py).
+# Once a day bodies that nothing refers to are removed from the store.
+#######################################################################################################################
+
+
+import time
+
+import cfg
+import bodies
+import httpcache
+import storage
+
+
+COLLECT_INTERVAL = 24 * 60 * 60  # seconds between removals of unused bodies from the store
+_collected = {'time': 0}
+
+
+def get_policy(options):
+    """Политика хранения раздела
+
+    :param options: настройки раздела
+    :return: (max_events, max_age в секундах). 0 - без ограничения
+    """
+    return max(0, options.get('max_events', 0)), max(0, options.get('max_age', 0)) * 24 * 60 * 60
+
+
+def prune(rows, max_events, max_age, now=None):
+    """События, которые остаются после применения политики хранения
+
+    :param rows: события раздела (от новых к старым)
+    :param max_events: максимальное количество событий
+    :param max_age: максимальный возраст событий в секундах
+    :param now:
+    :return: тот же список, если ничего не удалено, иначе новый список
+    """
+    if now is None:
+        now = time.time()
+    kept = rows
+    if max_age:
+        cutoff = now - max_age
+        kept = kept[:1] + [row for row in kept[1:] if getattr(row, 'ts', cutoff) >= cutoff]
+    if max_events and len(kept) > max_events:
+        kept = kept[:max_events]
+    return kept if len(kept) != len(rows) else rows
+
+
+def apply(data, options=cfg.OPTIONS, now=None):
+    """Применение политик хранения к данным перед сохранением
+
+    :param data: структура типа dict (см. setup.save_data)
+    :param options: настройки разделов
+    :param now:
+    :return: количество удаленных событий
+    """
+    if now is None:
+        now = time.time()
+    removed = 0
+    policies = {}
+    for section, rows in data.items():
+        if section == cfg.CURSORS_KEY or section not in options or not isinstance(rows, list):
+            continue
+        policies[section] = get_policy(options[section])
+        kept = prune(rows, *policies[section], now=now)
+        removed += len(rows) - len(kept)
+        data[section] = kept
+    if cfg.STORAGE_BACKEND == 'sqlite':
+        removed += storage.prune({section: policy for section, policy in policies.items() if any(policy)}, now=now)
+    if removed:
+        cfg.LOGGER.info(f'Retention policies removed {removed} old events.')
+    return removed
+
+
+def compact(data, cursors, keys, urls, now=None):
+    """Сжатие состояния, которое хранится между циклами
+
+    :param data: сохраняемые данные (см. setup.save_data)
+    :param cursors: курсоры запросов (изменяются на месте)
+    :param keys: ключи курсоров запросов текущей конфигурации
+    :param urls: адреса первых страниц следующих запросов
+    :param now:
+    :return:
+    """
+    if now is None:
+        now = time.time()
+    for key in [key for key in cursors if key not in keys]:
+        del cursors[key]  # the section was removed from the configuration
+    httpcache.prune(urls)
+    tables = [rows for section, rows in data.items() if section != cfg.CURSORS_KEY]
+    tables += [cursor['rows'] for cursor in cursors.values()]
+    tables += [[row for update_id, row in entry['payload']] for entry in list(httpcache.CACHE.values())]
+    moved = sum(bodies.detach(rows) for rows in tables)
+    if moved:
+        cfg.LOGGER.info(f'{moved} release bodies moved to {bodies.get_bodies_path()}.')
+    if cfg.SHARD is None and now - _collected['time'] >= COLLECT_INTERVAL:
+        _collected['time'] = now  # the store of sharded workers is shared, they do not know each other's bodies
+        digests = {row[5].digest for rows in tables for row in rows
+                   if len(row) > 5 and isinstance(row[5], bodies.Body)}
+        if cfg.STORAGE_BACKEND == 'sqlite':
+            digests |= storage.get_body_digests()
+        removed = bodies.collect(digests)
+        if removed:
+            cfg.LOGGER.info(f'{removed} unused release bodies removed from {bodies.get_bodies_path()}.')
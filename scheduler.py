@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Requires python 3.6+
+
+#######################################################################################################################
+# Adaptive polling scheduler
+#
+# Every repository of the configuration file has its own next-due time in a priority queue, so a section that lists
+# several repositories polls each of them at its own pace (and a repository shared by several sections is polled once).
+# A section is processed when any of its repositories was polled; the others contribute their last fetched window.
+# The polling interval of a repository shrinks after a change was found and grows while the repository stays quiet,
+# but never beyond its update_interval unless max_update_interval allows it (opt-in backoff of quiet repositories).
+# Rescheduling or removing a repository invalidates its queue entry through a generation number instead of searching
+# the heap, so a repository is never in the queue twice.
+# All intervals are stretched when the github rate limit (X-RateLimit-Remaining / X-RateLimit-Reset) would not last
+# until the reset time, and polling is postponed until the reset when the limit is exhausted.
+#######################################################################################################################
+
+
+import heapq
+import itertools
+import threading
+import time
+
+import cfg
+import metrics
+
+
+RATE_LIMIT = {'limit': None, 'remaining': None, 'reset': None}  # last known github rate limit state
+RATE_LIMIT_RESERVE = 10  # requests that are never spent on polling
+BACKOFF = 1.5  # growth of the polling interval of a quiet section
+_lock = threading.Lock()
+
+
+def get_repo_names(repos):
+    """Репозитарии раздела конфигурационного файла вида 'Имя_Владельца/Проект, Имя_Владельца/Проект, ...'"""
+    return [i.strip() for i in str(repos).split(',')]
+
+
+def update_rate_limit(headers):
+    """Обновление состояния rate limit по заголовкам ответа github API
+
+    :param headers: заголовки ответа
+    :return:
+    """
+    if headers is None:
+        return
+    try:
+        remaining = int(headers.get('X-RateLimit-Remaining'))
+        reset = int(headers.get('X-RateLimit-Reset'))
+        limit = int(headers.get('X-RateLimit-Limit', 0)) or None
+    except (TypeError, ValueError):
+        return
+    metrics.set_gauge('gitmon_rate_limit_remaining', remaining)
+    with _lock:
+        # responses of one wave may arrive out of order - keep the smallest value of the current window
+        if RATE_LIMIT['reset'] != reset or RATE_LIMIT['remaining'] is None or remaining < RATE_LIMIT['remaining']:
+            RATE_LIMIT.update(limit=limit, remaining=remaining, reset=reset)
+
+
+def get_rate_limit(now=None):
+    """Оставшийся бюджет запросов и время до его восстановления
+
+    :param now:
+    :return: (remaining, seconds_to_reset) или (None, None), если github еще не сообщил rate limit
+    """
+    if now is None:
+        now = time.time()
+    with _lock:
+        remaining, reset = RATE_LIMIT['remaining'], RATE_LIMIT['reset']
+    if remaining is None or reset is None or reset <= now:
+        return None, None
+    return remaining - RATE_LIMIT_RESERVE, reset - now
+
+
+class Scheduler:
+    """Очередь репозитариев конфигурационного файла, упорядоченная по времени следующего опроса"""
+
+    def __init__(self, options):
+        self.options = options
+        self.sections = {}  # repo -> sections of the configuration file the repo belongs to
+        self.intervals = {}  # repo -> current polling interval in seconds
+        self.queue = []  # heap of (due time, generation, repo)
+        self.generation = {}  # repo -> generation of its only valid queue entry (older entries are skipped)
+        self._seq = itertools.count()
+        self.index()
+        now = time.time()
+        for repo in self.sections:
+            self.schedule(repo, now)
+
+    def index(self):
+        """Разделы, в которые входит каждый репозитарий"""
+        self.sections = {}
+        for repos in self.options.keys():
+            for repo in get_repo_names(repos):
+                self.sections.setdefault(repo, []).append(repos)
+
+    def polled_sections(self, repo):
+        """Разделы репозитария, которые опрашиваются (а не только получают webhooks)"""
+        sections = self.sections.get(repo, [])
+        return [repos for repos in sections if not self.is_webhook(repos)] or sections
+
+    def base_interval(self, repo):
+        """Интервал опроса репозитария из конфигурационного файла в секундах (наименьший из его разделов)"""
+        return min((self.options[repos].get('update_interval') or cfg.UPDATE_INTERVAL or 1) * 60
+                   for repos in self.polled_sections(repo))
+
+    def min_interval(self, repo):
+        return min(cfg.MIN_UPDATE_INTERVAL * 60, self.base_interval(repo))
+
+    def max_interval(self, repo):
+        return max(cfg.MAX_UPDATE_INTERVAL * 60, self.base_interval(repo))
+
+    def is_webhook(self, repos):
+        """Раздел получает изменения через webhooks (gitmon.py --serve) и опрашивается только для подстраховки"""
+        return cfg.SERVE and self.options[repos].get('mode') == 'webhook'
+
+    def is_webhook_only(self, repo):
+        """Все разделы репозитария получают изменения через webhooks"""
+        return all(self.is_webhook(repos) for repos in self.sections.get(repo, []))
+
+    def cost(self, repo):
+        """Количество запросов к github API, необходимое для одного опроса репозитария"""
+        return sum(any(self.options[repos][updates_from] > 0 for repos in self.sections.get(repo, []))
+                   for updates_from in ('commits', 'releases'))
+
+    def get_sections(self, repos_list):
+        """Разделы, в которые входят репозитарии
+
+        :param repos_list: репозитарии
+        :return: список разделов в порядке конфигурационного файла
+        """
+        wanted = {repos for repo in repos_list for repos in self.sections.get(repo, [])}
+        return [repos for repos in self.options.keys() if repos in wanted]
+
+    def update(self, added, removed, changed, now=None):
+        """Изменение очереди после повторного чтения конфигурационного файла (см. setup.reload_options)
+
+        Репозитарии новых разделов опрашиваются сразу, репозитарии, которых больше нет ни в одном разделе,
+        убираются из очереди при извлечении (см. pop_due). Время следующего опроса остальных репозитариев не меняется.
+
+        :param added: новые разделы
+        :param removed: удаленные разделы
+        :param changed: измененные разделы
+        :param now:
+        :return:
+        """
+        if now is None:
+            now = time.time()
+        self.index()
+        for repos in list(removed) + list(changed):
+            for repo in get_repo_names(repos):
+                self.intervals.pop(repo, None)  # the adaptive interval starts again from update_interval
+        for repo in set(self.generation) - set(self.sections):
+            del self.generation[repo]  # invalidates its queue entry
+        for repos in added:
+            for repo in get_repo_names(repos):
+                self.schedule(repo, now)  # replaces the entry the repo may already have
+
+    def schedule(self, repo, due):
+        """Постановка репозитария в очередь. Предыдущая запись репозитария в очереди становится недействительной"""
+        generation = next(self._seq)
+        self.generation[repo] = generation
+        heapq.heappush(self.queue, (due, generation, repo))
+
+    def is_valid(self, entry):
+        return self.generation.get(entry[2]) == entry[1]
+
+    def next_due(self):
+        while self.queue and not self.is_valid(self.queue[0]):
+            heapq.heappop(self.queue)
+        return self.queue[0][0] if self.queue else None
+
+    def pop_due(self, now=None):
+        """Извлечение репозитариев, время опроса которых наступило, в пределах оставшегося rate limit
+
+        Репозитарии, на которые не хватает бюджета запросов, откладываются до восстановления rate limit.
+
+        :param now:
+        :return: список репозитариев
+        """
+        if now is None:
+            now = time.time()
+        budget, reset_in = get_rate_limit(now)
+        due, postponed = [], []
+        while self.queue and self.queue[0][0] <= now:
+            entry = heapq.heappop(self.queue)
+            if not self.is_valid(entry):
+                continue  # rescheduled since, or removed from the configuration
+            repo = entry[2]
+            del self.generation[repo]
+            if budget is not None:
+                if self.cost(repo) > budget:
+                    postponed.append(repo)
+                    continue
+                budget -= self.cost(repo)
+            due.append(repo)
+        for repo in postponed:
+            self.schedule(repo, now + reset_in + 1)
+        if postponed:
+            cfg.LOGGER.warning(f'Github rate limit is almost exhausted. Polling of {postponed} is postponed '
+                               f'for {reset_in / 60:.1f} minutes.')
+        return due
+
+    def pace(self, now):
+        """Коэффициент растяжения интервалов, при котором запросов хватит до восстановления rate limit"""
+        budget, reset_in = get_rate_limit(now)
+        if budget is None:
+            return 1.0
+        demand = sum(self.cost(repo) * reset_in / self.intervals.get(repo, self.base_interval(repo))
+                     for repo in self.sections if not self.is_webhook_only(repo))
+        return max(1.0, demand / max(budget, 1))
+
+    def reschedule(self, repo, changed, now=None):
+        """Планирование следующего опроса репозитария
+
+        Репозитарии, все разделы которых имеют mode: webhook, после первого опроса опрашиваются только
+        раз в safety_poll минут (или никогда).
+
+        :param repo: репозитарий
+        :param changed: True, если при последнем опросе в репозитарии появились изменения
+        :param now:
+        :return: интервал до следующего опроса в секундах или None, если репозитарий больше не опрашивается
+        """
+        if now is None:
+            now = time.time()
+        if repo not in self.sections:
+            return None  # removed from the configuration while it was polled
+        if self.is_webhook_only(repo):
+            polls = [self.options[repos].get('safety_poll', 0) for repos in self.sections[repo]]
+            interval = min((poll for poll in polls if poll), default=0) * 60
+            if not interval:
+                return None
+            self.schedule(repo, now + interval)
+            return interval
+        interval = self.intervals.get(repo, self.base_interval(repo))
+        if changed:
+            interval = max(self.min_interval(repo), min(interval, self.base_interval(repo)) / 2)
+        else:
+            interval = min(self.max_interval(repo), interval * BACKOFF)
+        self.intervals[repo] = interval
+        due = now + interval * self.pace(now)
+        budget, reset_in = get_rate_limit(now)
+        if budget is not None and budget <= 0:
+            due = max(due, now + reset_in + 1)
+        self.schedule(repo, due)
+        return due - now
+
+    def wait(self, until=None, wake=None):
+        """Ожидание ближайшего опроса
+
+        :param until: время (timestamp), раньше которого нужно проснуться, например, для отложенных действий
+        :param wake: threading.Event, который прерывает ожидание (например, новый отложенный триггер)
+        :return:
+        """
+        due = self.next_due()
+        if until is not None and (due is None or until < due):
+            delay = max(0.0, until - time.time())
+            cfg.LOGGER.debug(f'Sleeping {delay:.1f} seconds.')
+            self.sleep(delay, wake)
+        elif due is not None:
+            delay = max(0.0, due - time.time())
+            cfg.LOGGER.info(f'Sleeping {delay / 60:.1f} minutes until the next poll.')
+            self.sleep(delay, wake)
+
+    @staticmethod
+    def sleep(delay, wake):
+        if wake is None:
+            time.sleep(delay)
+        elif wake.wait(delay):
+            wake.clear()  # the caller recomputes its deadlines after every wake-up
@@ -12,9 +12,19 @@ import json
 import configparser
 import argparse
 import logging
+import os
 from pathlib import Path
 
 import cfg
+import bodies
+import events
+import metrics
+import shards
+import storage
+
+
+_config_state = {}  # mtime, [DEFAULT] and sections of the configuration file as they were read last time
+OPTION_ERRORS = []  # wrong options found before the logger exists (logged by gitmon.py after setup_log)
 
 
 def setup_env():
@@ -22,6 +32,9 @@ def setup_env():
 
     --config <путь к конфигурационному файлу>
     --data <путь к файлу данных>
+    --workers <количество процессов> (см. shards.py)
+    --shard <номер процесса>/<количество процессов>
+    --serve (прием github webhooks, см. webhook.py)
 
     :return:
     """
@@ -30,8 +43,25 @@ def setup_env():
                         help='Path to app configuration file. Default: current application directory. File mast exist!')
     parser.add_argument('--data', action='store', dest='DATA_PATH', type=str,
                         help='File to store app data. Default: current application directory. Write permissions necessary.')
+    parser.add_argument('--workers', action='store', dest='WORKERS', type=int, default=0,
+                        help='Start N worker processes, each polling its own share of the configuration sections.')
+    parser.add_argument('--shard', action='store', dest='SHARD', type=str,
+                        help='Run as worker I of N (I/N, I from 0): poll only the sections of this worker.')
+    parser.add_argument('--spool', action='store_true', dest='SPOOL',
+                        help='Worker started by --workers: pass local file edits to the coordinator.')
+    parser.add_argument('--serve', action='store_true', dest='SERVE',
+                        help='Receive github webhooks for the sections with mode: webhook instead of polling them.')
     args = parser.parse_args()
 
+    if args.SHARD:
+        cfg.SHARD = shards.parse_shard(args.SHARD)
+        if cfg.SHARD is None:
+            print(f'Error: wrong --shard {args.SHARD}. Expected I/N, for example 0/4. Exiting...')
+            exit(1)
+    cfg.WORKERS = args.WORKERS
+    cfg.SPOOL = args.SPOOL
+    cfg.SERVE = args.SERVE
+
     if args.CONFIG_PATH:
         cfg.CONFIG_PATH = args.CONFIG_PATH
     file_path = Path(cfg.CONFIG_PATH)
@@ -55,39 +85,195 @@ def read_options(config_path):
     if config.read(config_path, encoding='utf-8'):
         repo_list = config.sections()
         for repo in repo_list:
-            cfg.OPTIONS[repo] = {'commits': config[repo].getint('commits', 0),
-                                 'releases': config[repo].getint('releases', 0),
-                                 'only_new': config[repo].getboolean('only_new', True),
-                                 'github_token': config[repo].get('github_token', ''),
-                                 'line_prefix': config[repo].get('line_prefix', ''),
-                                 'log_detail': config[repo].get('log_detail', 'medium'),
-                                 'file_max_size': config[repo].getint('file_max_size', 1000000),
-                                 'log_text': config[repo].get('log_text', ''),
-                                 'log_start': config[repo].get('log_start', ''),
-                                 'log_end': config[repo].get('log_end', ''),
-                                 'actions': [i.strip() for i in config[repo].get('actions', '').split(',')]}
-
-            line_prefix = cfg.OPTIONS[repo]['line_prefix']
-            if line_prefix:
-                cfg.OPTIONS[repo]['line_prefix'] = line_prefix + ' '
+            cfg.OPTIONS[repo] = read_section(config, repo)
 
         cfg.GITHUB_BASE_URL = config['DEFAULT'].get('github_base_url', 'https://api.github.com/repos')
-        cfg.UPDATE_INTERVAL = config['DEFAULT'].getint('update_interval', 0)
+        cfg.GITHUB_TOKEN = config['DEFAULT'].get('github_token', '')
+        cfg.GITHUB_TOKENS = [i.strip() for i in config['DEFAULT'].get('github_tokens', '').split(',') if i.strip()]
+        if not cfg.WORKERS:
+            cfg.WORKERS = config['DEFAULT'].getint('workers', 0)
+        cfg.GITHUB_GRAPHQL_URL = config['DEFAULT'].get('github_graphql_url', 'https://api.github.com/graphql')
+        cfg.HTTP_CACHE_PATH = config['DEFAULT'].get('http_cache_file', '')
+        cfg.STORAGE_BACKEND = config['DEFAULT'].get('storage_backend', 'json').lower()
+        cfg.STORAGE_PATH = config['DEFAULT'].get('storage_file', '')
+        cfg.BODIES_PATH = config['DEFAULT'].get('bodies_dir', '')
+        cfg.HTTP_POOL_SIZE = config['DEFAULT'].getint('http_pool_size', 8)
+        try:
+            cfg.ACTION_CONCURRENCY = parse_concurrency(config['DEFAULT'].get('action_concurrency', ''))
+        except ValueError as e:
+            OPTION_ERRORS.append(f'{e}. Every sink uses 1 thread.')
+            cfg.ACTION_CONCURRENCY = {}
+        cfg.ACTION_QUEUE_SIZE = config['DEFAULT'].getint('action_queue_size', 1000)
+        cfg.PROCESS_POOL = config['DEFAULT'].getint('process_pool', 0)
+        cfg.METRICS_PORT = config['DEFAULT'].getint('metrics_port', 0)
+        cfg.METRICS_HOST = config['DEFAULT'].get('metrics_host', '127.0.0.1')
+        cfg.WEBHOOK_PORT = config['DEFAULT'].getint('webhook_port', 8000)
+        cfg.WEBHOOK_HOST = config['DEFAULT'].get('webhook_host', '127.0.0.1')
+        cfg.WEBHOOK_SECRET = config['DEFAULT'].get('webhook_secret', '')
+        cfg.WEBHOOK_INSECURE = config['DEFAULT'].getboolean('webhook_insecure', False)
+        cfg.CONFIG_RELOAD = config['DEFAULT'].getint('config_reload', 10)
+        cfg.FAST_START = config['DEFAULT'].getboolean('fast_start', True)
         cfg.APP_LOGS_TYPE = config['DEFAULT'].get('app_logs_type', 'console')
         cfg.APP_LOGS_FILE = config['DEFAULT'].get('app_logs_file', 'gitmon.log')
+        cfg.APP_LOGS_LEVEL = config['DEFAULT'].get('app_logs_level', 'info')
+        read_runtime_options(config)
 
+        _config_state.update(mtime=get_config_mtime(config_path), default=dict(config['DEFAULT']),
+                             sections={repo: dict(config[repo]) for repo in repo_list})
         return True
     else:
         return False
 
 
+def read_section(config, repo):
+    """Настройки одного раздела конфигурационного файла
+
+    :param config: configparser.ConfigParser
+    :param repo: раздел
+    :return: словарь настроек
+    """
+    options = {'commits': config[repo].getint('commits', 0),
+               'releases': config[repo].getint('releases', 0),
+               'only_new': config[repo].getboolean('only_new', True),
+               'github_token': config[repo].get('github_token', ''),
+               'line_prefix': config[repo].get('line_prefix', ''),
+               'log_detail': config[repo].get('log_detail', 'medium'),
+               'file_max_size': config[repo].getint('file_max_size', 1000000),
+               'update_interval': config[repo].getint('update_interval', 0),
+               'max_events': config[repo].getint('max_events', 0),
+               'max_age': config[repo].getint('max_age', 0),
+               'mode': config[repo].get('mode', 'poll').lower(),
+               'safety_poll': config[repo].getint('safety_poll', 0),
+               'log_text': config[repo].get('log_text', ''),
+               'log_start': config[repo].get('log_start', ''),
+               'log_end': config[repo].get('log_end', ''),
+               'actions': [i.strip() for i in config[repo].get('actions', '').split(',')]}
+
+    line_prefix = options['line_prefix']
+    if line_prefix:
+        options['line_prefix'] = line_prefix + ' '
+    return options
+
+
+def read_runtime_options(config):
+    """Глобальные настройки из [DEFAULT], которые можно менять без перезапуска (см. reload_options)
+
+    :param config: configparser.ConfigParser
+    :return:
+    """
+    cfg.FETCH_BACKEND = config['DEFAULT'].get('fetch_backend', 'rest').lower()
+    cfg.GRAPHQL_BATCH_SIZE = config['DEFAULT'].getint('graphql_batch_size', 40)
+    cfg.UPDATE_INTERVAL = config['DEFAULT'].getint('update_interval', 0)
+    cfg.MIN_UPDATE_INTERVAL = config['DEFAULT'].getint('min_update_interval', 1)
+    cfg.MAX_UPDATE_INTERVAL = config['DEFAULT'].getint('max_update_interval', 0)
+    cfg.MAX_CONCURRENCY = config['DEFAULT'].getint('max_concurrency', 8)
+    cfg.HTTP_TIMEOUT = config['DEFAULT'].getint('http_timeout', 30)
+    cfg.FETCH_RETRIES = config['DEFAULT'].getint('fetch_retries', 2)
+    cfg.FETCH_RETRY_DELAY = config['DEFAULT'].getfloat('fetch_retry_delay', 1)
+    cfg.FETCH_DEADLINE = config['DEFAULT'].getint('fetch_deadline', 120)
+    cfg.BREAKER_THRESHOLD = config['DEFAULT'].getint('breaker_threshold', 3)
+    cfg.BREAKER_COOLDOWN = config['DEFAULT'].getint('breaker_cooldown', 300)
+    cfg.ACTION_RETRIES = config['DEFAULT'].getint('action_retries', 3)
+    cfg.ACTION_RETRY_DELAY = config['DEFAULT'].getint('action_retry_delay', 5)
+    cfg.SHELL_TIMEOUT = config['DEFAULT'].getint('shell_timeout', 600)
+    cfg.DOCKERHUB_DEBOUNCE = config['DEFAULT'].getint('dockerhub_debounce', 0)
+
+
+def get_config_mtime(config_path):
+    try:
+        stat = os.stat(config_path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def config_changed(config_path):
+    """Изменился ли конфигурационный файл после последнего чтения (проверяется время изменения и размер)
+
+    :param config_path: путь к конфигурационному файлу
+    :return: True or False
+    """
+    mtime = get_config_mtime(config_path)
+    return mtime is not None and mtime != _config_state.get('mtime')
+
+
+def reload_options(config_path):
+    """Повторное чтение конфигурационного файла без перезапуска
+
+    Заново разбираются только изменившиеся разделы, настройки остальных разделов остаются теми же объектами.
+    cfg.OPTIONS изменяется на месте (на него ссылаются значения по-умолчанию аргументов options), поэтому
+    функцию нужно вызывать между циклами, когда все действия выполнены.
+    Из [DEFAULT] применяются только настройки из read_runtime_options, остальные - после перезапуска.
+
+    :param config_path: путь к конфигурационному файлу
+    :return: (новые разделы, удаленные разделы, измененные разделы) или None, если файл не прочитан
+    """
+    config = configparser.ConfigParser()
+    try:
+        if not config.read(config_path, encoding='utf-8'):
+            return None
+    except configparser.Error as e:
+        cfg.LOGGER.error(f'Error reading configuration file {config_path}: {e}. Keeping the current configuration.')
+        _config_state['mtime'] = get_config_mtime(config_path)  # do not retry until the file is changed again
+        return None
+    sections = {repo: dict(config[repo]) for repo in config.sections()}
+    if cfg.SHARD:
+        sections = {repo: items for repo, items in sections.items()
+                    if shards.get_worker(repo, cfg.SHARD[1]) == cfg.SHARD[0]}
+    old_sections = _config_state.get('sections', {})
+    options = {}
+    for repo, items in sections.items():
+        if repo in cfg.OPTIONS and old_sections.get(repo) == items:
+            options[repo] = cfg.OPTIONS[repo]
+        else:
+            options[repo] = read_section(config, repo)
+    added = [repo for repo in options if repo not in cfg.OPTIONS]
+    removed = [repo for repo in cfg.OPTIONS if repo not in options]
+    changed = [repo for repo in options if repo in cfg.OPTIONS and options[repo] is not cfg.OPTIONS[repo]]
+
+    runtime = ('fetch_backend', 'graphql_batch_size', 'update_interval', 'min_update_interval', 'max_update_interval',
+               'max_concurrency', 'http_timeout', 'action_retries', 'action_retry_delay', 'shell_timeout',
+               'dockerhub_debounce', 'fetch_retries', 'fetch_retry_delay', 'fetch_deadline', 'breaker_threshold',
+               'breaker_cooldown')
+    old_default = _config_state.get('default', {})
+    restart = sorted(key for key in set(old_default) | set(config['DEFAULT'])
+                     if key not in runtime and old_default.get(key) != config['DEFAULT'].get(key))
+    if restart:
+        cfg.LOGGER.warning(f'Changes of {restart} in [DEFAULT] will take effect after restart.')
+    read_runtime_options(config)
+
+    cfg.OPTIONS.clear()
+    cfg.OPTIONS.update(options)
+    _config_state.update(mtime=get_config_mtime(config_path), default=dict(config['DEFAULT']), sections=sections)
+    return added, removed, changed
+
+
+def parse_concurrency(value):
+    """Разбор параметра action_concurrency вида 'shell=2, dockerhub=4'
+
+    :param value: строка из конфигурационного файла
+    :return: словарь {sink: количество потоков}
+    :raises ValueError: если количество потоков не число
+    """
+    concurrency = {}
+    for item in value.split(','):
+        if '=' in item:
+            sink, count = [i.strip() for i in item.split('=', 1)]
+            try:
+                concurrency[sink.lower()] = int(count)
+            except ValueError:
+                raise ValueError(f'Error in action_concurrency: {item.strip()}') from None
+    return concurrency
+
+
 def setup_log():
     """Создание логгера
 
     :return:
     """
-    logger = logging.getLogger('GitMon')
-    logger.setLevel(logging.INFO)
+    level = getattr(logging, cfg.APP_LOGS_LEVEL.upper(), logging.INFO)
+    logger = logging.getLogger(f'GitMon-{cfg.SHARD[0]}' if cfg.SHARD else 'GitMon')
+    logger.setLevel(level)
     formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
     if cfg.APP_LOGS_TYPE.lower() == 'none':
         log_handler = logging.NullHandler()
@@ -95,37 +281,49 @@ def setup_log():
         log_handler = logging.FileHandler(cfg.APP_LOGS_FILE)
     else:
         log_handler = logging.StreamHandler()
-    log_handler.setLevel(logging.INFO)
+    log_handler.setLevel(level)
     log_handler.setFormatter(formatter)
     logger.addHandler(log_handler)
     return logger
 
 
+@metrics.timed
 def save_data(data, js_file=''):
     """Сохранение данных в файл
 
+    При storage_backend: sqlite данные сохраняются в базу данных (см. storage.py)
+
     :param data: структура типа dict
     :param js_file: путь к файлу данных
     :return:
     """
+    if cfg.STORAGE_BACKEND == 'sqlite' and not js_file:
+        storage.save(data)
+        return
     if not js_file:
         js_file = cfg.DATA_PATH
     cfg.LOGGER.info(f'Saving data to {js_file}...')
     with open(js_file, 'w') as js:
-        json.dump(data, js, sort_keys=False, indent=4)
+        json.dump(data, js, sort_keys=False, indent=4, default=bodies.encode)
 
 
+@metrics.timed
 def load_data(js_file=''):
     """Загрузка данных из файла и возвращение их в виде структуры dict
 
+    При storage_backend: sqlite данные загружаются из базы данных (см. storage.py)
+
     :param js_file: путь к файлу данных
     :return:
     """
+    if cfg.STORAGE_BACKEND == 'sqlite' and not js_file:
+        cfg.LOGGER.info(f'Loading data from {storage.get_storage_path()}...')
+        return events.from_data(storage.load())
     if not js_file:
         js_file = cfg.DATA_PATH
     cfg.LOGGER.info(f'Loading data from {js_file}...')
     try:
         with open(js_file, 'r') as js:
-            return json.loads(js.read())
+            return events.from_data(json.loads(js.read()))
     except:
         return {}
@@ -0,0 +1,378 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Requires python 3.6+
+
+#######################################################################################################################
+# Sharding of configuration sections across several GitMon workers
+#
+# Sections are assigned to workers by consistent hashing of the section name, so changing the number of workers moves
+# only about 1/N of the sections. Every worker (gitmon.py --shard I/N) processes its own sections with its own github
+# token (github_tokens) and keeps its own data shard (data.json -> data.shardI.json, the same for the HTTP cache,
+# sqlite database and dockerhub triggers). Workers may run on different nodes with the same configuration file.
+#
+# gitmon.py --workers N starts N local workers and acts as their coordinator: before the start it moves the data of
+# sections that changed their worker (rebalancing, pending dockerhub triggers included), and while the workers run it
+# merges their local.file edits of shared changelog files. Workers started by the coordinator do not write such files
+# themselves: they append the edits to their spool file (data.shardI.spool), and the coordinator applies them one by
+# one (see changelog.py).
+# A worker that crashes is restarted after a delay that doubles with every crash in a row (up to MAX_RESTART_DELAY).
+#######################################################################################################################
+
+
+import bisect
+import hashlib
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import cfg
+import bodies
+import setup
+import storage
+import changelog
+import triggers
+
+
+VNODES = 64  # points of every worker on the hash ring
+MERGE_INTERVAL = 1  # seconds between merges of the spool files
+RESTART_DELAY = 1  # seconds before the first restart of a crashed worker (doubled after every crash in a row)
+MAX_RESTART_DELAY = 300  # longest delay before a restart; a worker that ran this long is restarted after RESTART_DELAY
+_rings = {}  # number of workers -> (sorted points, workers)
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.md5(value.encode('utf8')).digest()[:8], 'big')
+
+
+def get_ring(workers):
+    """Кольцо консистентного хэширования для workers процессов
+
+    :param workers: количество процессов
+    :return: (отсортированные точки кольца, номера процессов для этих точек)
+    """
+    if workers not in _rings:
+        points = sorted((_hash(f'worker-{worker}#{vnode}'), worker)
+                        for worker in range(workers) for vnode in range(VNODES))
+        _rings[workers] = ([point for point, worker in points], [worker for point, worker in points])
+    return _rings[workers]
+
+
+def get_worker(section, workers):
+    """Номер процесса, который обрабатывает раздел конфигурационного файла
+
+    :param section: раздел конфигурационного файла
+    :param workers: количество процессов
+    :return: номер процесса от 0 до workers - 1
+    """
+    if workers <= 1:
+        return 0
+    points, owners = get_ring(workers)
+    return owners[bisect.bisect(points, _hash(section)) % len(points)]
+
+
+def get_shard_path(path, index):
+    """Путь к файлу данных процесса (data.json -> data.shard1.json)
+
+    :param path: путь к общему файлу
+    :param index: номер процесса
+    :return:
+    """
+    path = Path(path)
+    return str(path.with_name(f'{path.stem}.shard{index}{path.suffix}'))
+
+
+def get_spool_path(index):
+    """Файл, в который процесс записывает изменения общих changelog-файлов"""
+    return str(Path(get_shard_path(cfg.DATA_PATH, index)).with_suffix('.spool'))
+
+
+def get_layout_path():
+    """Файл с количеством процессов, между которыми распределены данные (data.json -> data.shards.json)"""
+    return str(Path(cfg.DATA_PATH).with_suffix('.shards.json'))
+
+
+def parse_shard(value):
+    """Разбор аргумента --shard вида I/N
+
+    :param value:
+    :return: (I, N) или None, если значение неверное
+    """
+    try:
+        index, workers = [int(i) for i in value.split('/')]
+    except (AttributeError, ValueError):
+        return None
+    if workers < 1 or not 0 <= index < workers:
+        return None
+    return index, workers
+
+
+def setup_worker(index, workers, spool=False):
+    """Настройка процесса: только свои разделы, свой token, свои файлы данных
+
+    Вызывается после setup.read_options. cfg.OPTIONS изменяется на месте, т.к. на него ссылаются
+    значения по-умолчанию аргументов options.
+
+    :param index: номер процесса
+    :param workers: количество процессов
+    :param spool: процесс запущен координатором - изменения changelog-файлов передаются ему
+    :return:
+    """
+    if spool:
+        cfg.SPOOL_PATH = get_spool_path(index)
+    for section in [section for section in cfg.OPTIONS if get_worker(section, workers) != index]:
+        del cfg.OPTIONS[section]
+    if cfg.GITHUB_TOKENS:
+        cfg.GITHUB_TOKEN = cfg.GITHUB_TOKENS[index % len(cfg.GITHUB_TOKENS)]
+    cfg.SHARD = (index, workers)
+    cfg.BODIES_PATH = bodies.get_bodies_path()  # one store for all workers: sections move between them
+    cfg.DATA_PATH = get_shard_path(cfg.DATA_PATH, index)
+    if cfg.STORAGE_PATH:
+        cfg.STORAGE_PATH = get_shard_path(cfg.STORAGE_PATH, index)
+    if cfg.HTTP_CACHE_PATH:
+        cfg.HTTP_CACHE_PATH = get_shard_path(cfg.HTTP_CACHE_PATH, index)
+    if cfg.METRICS_PORT:
+        cfg.METRICS_PORT += index
+
+
+def _load(path):
+    """Данные одного файла (или базы данных) без перехода на него основного хранилища"""
+    if cfg.STORAGE_BACKEND == 'sqlite':
+        if not os.path.exists(path):
+            return {}
+        storage.close()
+        storage.connect(path)
+        try:
+            return storage.load()
+        finally:
+            storage.close()
+    return setup.load_data(path)
+
+
+def _save(path, data):
+    if cfg.STORAGE_BACKEND == 'sqlite':
+        storage.close()
+        storage.connect(path)
+        try:
+            storage.save(data)
+        finally:
+            storage.close()
+    else:
+        setup.save_data(data, path)
+
+
+def rebalance(workers):
+    """Перераспределение данных между процессами при изменении их количества
+
+    Данные каждого раздела берутся у процесса, который обрабатывал раздел при прежнем количестве процессов
+    (или из общего файла данных, если раньше GitMon работал без разделения), и записываются процессу,
+    который будет обрабатывать раздел теперь. Курсоры запросов получают все процессы.
+
+    :param workers: новое количество процессов
+    :return: количество перенесенных разделов
+    """
+    layout_path = get_layout_path()
+    try:
+        with open(layout_path, 'r') as js:
+            old_workers = json.loads(js.read())['workers']
+    except (OSError, ValueError, KeyError):
+        old_workers = 0  # data were not sharded
+    if old_workers == workers:
+        return 0
+    if cfg.STORAGE_BACKEND == 'sqlite':
+        base_path = cfg.STORAGE_PATH or str(Path(cfg.DATA_PATH).with_suffix('.db'))
+    else:
+        base_path = cfg.DATA_PATH
+    old_paths = [get_shard_path(base_path, i) for i in range(old_workers)] if old_workers else [base_path]
+    old_data = [_load(path) for path in old_paths]
+
+    cursors = {}
+    for data in old_data:
+        cursors.update(data.get(cfg.CURSORS_KEY, {}))
+    new_data = [{cfg.CURSORS_KEY: cursors} for i in range(workers)]
+    moved = 0
+    for section in cfg.OPTIONS:
+        old = get_worker(section, old_workers) if old_workers else 0
+        new = get_worker(section, workers)
+        if section in old_data[old]:
+            new_data[new][section] = old_data[old][section]
+        moved += bool(old_workers) and old != new
+    for index, data in enumerate(new_data):
+        _save(get_shard_path(base_path, index), data)
+    for path in old_paths[workers:] if old_workers else []:
+        if os.path.exists(path):
+            os.remove(path)  # the shard of a worker that no longer exists
+    rebalance_triggers(old_workers, workers)
+    with open(layout_path, 'w') as js:
+        json.dump({'workers': workers}, js)
+    cfg.LOGGER.info(f'Data of {len(cfg.OPTIONS)} sections distributed between {workers} workers '
+                    f'(were {old_workers or "not sharded"}). {moved} sections moved to another worker.')
+    return moved
+
+
+def rebalance_triggers(old_workers, workers):
+    """Перераспределение отложенных триггеров hub.docker.com между процессами (см. triggers.py)
+
+    Триггеры всех прежних процессов объединяются (одинаковые url и tag - в один триггер) и записываются процессу,
+    который теперь обрабатывает первый из запросивших сборку разделов. Иначе триггеры удаленных процессов
+    никогда не были бы запущены.
+
+    :param old_workers: прежнее количество процессов (0 - данные не были разделены)
+    :param workers: новое количество процессов
+    :return: количество триггеров
+    """
+    old_paths = [triggers.get_triggers_path(get_shard_path(cfg.DATA_PATH, i)) for i in range(old_workers)] \
+        if old_workers else [triggers.get_triggers_path()]
+    merged = {}
+    for path in old_paths:
+        try:
+            with open(path, 'r') as js:
+                pending = json.loads(js.read())
+        except (OSError, ValueError):
+            continue
+        for trigger in pending:
+            key = (trigger['url'], trigger['tag'])
+            if key not in merged:
+                merged[key] = dict(trigger, sections=list(trigger['sections']))
+                continue
+            merged[key]['first'] = min(merged[key]['first'], trigger['first'])
+            merged[key]['count'] += trigger['count']
+            merged[key]['sections'] += [section for section in trigger['sections']
+                                        if section not in merged[key]['sections']]
+    new_triggers = [[] for i in range(workers)]
+    for trigger in merged.values():
+        new_triggers[get_worker(trigger['sections'][0], workers) if trigger['sections'] else 0].append(trigger)
+    for path in old_paths:
+        if os.path.exists(path):
+            os.remove(path)
+    for index, pending in enumerate(new_triggers):
+        if pending:
+            with open(triggers.get_triggers_path(get_shard_path(cfg.DATA_PATH, index)), 'w') as js:
+                json.dump(pending, js)
+    if merged:
+        cfg.LOGGER.info(f'{len(merged)} pending hub.docker.com triggers distributed between {workers} workers.')
+    return len(merged)
+
+
+def get_restart_delay(delay, ran):
+    """Пауза перед перезапуском завершившегося с ошибкой процесса
+
+    :param delay: пауза перед предыдущим перезапуском (0 - процесс еще не перезапускался)
+    :param ran: сколько секунд процесс проработал
+    :return: пауза в секундах
+    """
+    if not delay or ran >= MAX_RESTART_DELAY:
+        return RESTART_DELAY
+    return min(MAX_RESTART_DELAY, delay * 2)
+
+
+def spool_edit(file, mode, text, max_len, section=''):
+    """Изменение общего changelog-файла процессом, запущенным координатором
+
+    :param file: путь к changelog-файлу
+    :param mode: write, insert, append или delete
+    :param text: текст
+    :param max_len: максимальный размер файла
+    :param section: раздел конфигурационного файла
+    :return:
+    """
+    line = json.dumps({'ts': time.time(), 'file': file, 'mode': mode, 'text': text, 'max_len': max_len,
+                       'section': section})
+    with open(cfg.SPOOL_PATH, 'a') as spool:
+        spool.write(line + '\n')
+
+
+def merge_spools(workers, final=False):
+    """Применение изменений changelog-файлов, накопленных процессами
+
+    Файл изменений процесса сначала переименовывается (процесс начинает новый), а применяется на следующем
+    вызове - к этому времени запись, начатая до переименования, гарантированно завершена.
+
+    :param workers: количество процессов
+    :param final: применить все изменения (процессы уже завершились)
+    :return: количество примененных изменений
+    """
+    edits = []
+    for index in range(workers):
+        spool = get_spool_path(index)
+        merging = spool + '.merging'
+        for path in ([merging, spool] if final else [merging]):
+            try:
+                with open(path, 'r') as lines:
+                    edits += [json.loads(line) for line in lines if line.endswith('\n')]
+                os.remove(path)
+            except OSError:
+                pass
+        if not final and os.path.exists(spool):
+            os.replace(spool, merging)
+    edits.sort(key=lambda edit: edit['ts'])
+    for edit in edits:
+        cfg.LOGGER.info(f'Merging {edit["mode"]} of {edit["section"]} changelogs into file {edit["file"]}')
+        try:
+            if edit['mode'] == 'delete':
+                changelog.delete(edit['file'], edit['text'])
+            else:
+                getattr(changelog, edit['mode'])(edit['file'], edit['text'], edit['max_len'])
+        except OSError as e:
+            cfg.LOGGER.error(f'Error writing file {edit["file"]}. Reason: {e}')
+    return len(edits)
+
+
+def run_workers(workers):
+    """Координатор: запуск workers процессов на этом компьютере и объединение их записей в общие файлы
+
+    Завершившийся с ошибкой процесс перезапускается (если update_interval не 0) после паузы, которая
+    удваивается с каждым падением подряд (см. get_restart_delay).
+
+    :param workers: количество процессов
+    :return: код завершения
+    """
+    rebalance(workers)
+    command = [sys.executable, os.path.abspath(sys.argv[0]), '--config', cfg.CONFIG_PATH, '--data', cfg.DATA_PATH]
+
+    started = {}  # worker -> time of its last start
+    delays = {}  # worker -> delay before its last restart
+    restarts = {}  # worker -> time of its pending restart
+
+    def start(index):
+        cfg.LOGGER.info(f'Starting worker {index + 1} of {workers}')
+        started[index] = time.monotonic()
+        return subprocess.Popen(command + ['--shard', f'{index}/{workers}', '--spool'])
+
+    procs = [start(index) for index in range(workers)]
+    stopping = []
+
+    def stop(signum, frame):
+        stopping.append(signum)
+        for proc in procs:
+            if proc.poll() is None:
+                proc.send_signal(signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    codes = {}
+    while len(codes) < workers:
+        time.sleep(MERGE_INTERVAL)
+        merge_spools(workers)
+        now = time.monotonic()
+        for index, proc in enumerate(procs):
+            if index in codes or proc.poll() is None:
+                continue
+            if proc.returncode and cfg.UPDATE_INTERVAL and not stopping:
+                if index not in restarts:
+                    delays[index] = get_restart_delay(delays.get(index, 0), now - started[index])
+                    restarts[index] = now + delays[index]
+                    cfg.LOGGER.error(f'Worker {index + 1} of {workers} exited with code {proc.returncode}. '
+                                     f'Restarting in {delays[index]} s...')
+                elif now >= restarts[index]:
+                    del restarts[index]
+                    procs[index] = start(index)
+            else:
+                codes[index] = proc.returncode
+    merge_spools(workers, final=True)
+    cfg.LOGGER.info(f'All {workers} workers completed.')
+    return max(codes.values())
@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Requires python 3.6+
+
+#######################################################################################################################
+# SQLite storage backend for the app data (storage_backend: sqlite)
+#
+# Events are written once into an indexed table keyed by section, repo, type and timestamp. The data of every section
+# that was saved last time (the "snapshot" used by only_new and old_commits/old_releases) is kept as a list of
+# references to the events and is rewritten only when it has changed. So a cycle without changes writes nothing,
+# and the I/O of a cycle with changes depends on the number of new events, not on the size of the stored history.
+# The time of an event is stored as epoch seconds (ts), whatever format its row has, so retention compares numbers.
+# The meta table records the schema version and that data.json has been migrated (it is migrated only once).
+#######################################################################################################################
+
+
+import json
+import threading
+import time
+from pathlib import Path
+
+import cfg
+import bodies
+import events
+
+
+SCHEMA_VERSION = 2  # 1 - ts of events was the ISO 8601 text of the row
+EVENTS = '''
+CREATE TABLE IF NOT EXISTS {name} (
+    id INTEGER PRIMARY KEY,
+    section TEXT NOT NULL,
+    repo TEXT NOT NULL,
+    type TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    row TEXT NOT NULL,
+    UNIQUE (section, repo, type, ts, row)
+);
+'''
+SCHEMA = EVENTS.format(name='events') + '''
+CREATE INDEX IF NOT EXISTS events_by_time ON events (section, ts);
+CREATE TABLE IF NOT EXISTS snapshots (
+    section TEXT NOT NULL,
+    pos INTEGER NOT NULL,
+    event INTEGER NOT NULL REFERENCES events (id),
+    PRIMARY KEY (section, pos)
+);
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+'''
+
+_db = None
+_lock = threading.Lock()
+_saved = {}  # section -> rows as they were saved last time (to skip unchanged sections)
+_saved_state = {}  # state key -> value as it was saved last time
+
+
+def get_storage_path():
+    """Путь к файлу базы данных. По-умолчанию - рядом с файлом данных (data.json -> data.db)
+
+    :return:
+    """
+    if cfg.STORAGE_PATH:
+        return cfg.STORAGE_PATH
+    return str(Path(cfg.DATA_PATH).with_suffix('.db'))
+
+
+def connect(db_file=''):
+    """Открытие (и при необходимости создание) базы данных
+
+    Если данные из файла data.json еще не переносились, то они переносятся (один раз, см. таблицу meta).
+
+    :param db_file: путь к файлу базы данных
+    :return: sqlite3.Connection
+    """
+    global _db
+    if _db is not None:
+        return _db
+    import sqlite3  # only with storage_backend: sqlite
+    if not db_file:
+        db_file = get_storage_path()
+    _db = sqlite3.connect(db_file, check_same_thread=False)
+    _db.executescript(SCHEMA)
+    with _db:
+        upgrade(_db)
+    if get_meta(_db, 'migrated_json') is None:
+        if not _db.execute('SELECT 1 FROM events LIMIT 1').fetchone():  # databases of older versions are not new
+            migrate_json(cfg.DATA_PATH)
+        with _db:
+            set_meta(_db, 'migrated_json', time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()))
+    return _db
+
+
+def get_meta(db, key):
+    row = db.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+    return row[0] if row else None
+
+
+def set_meta(db, key, value):
+    db.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, str(value)))
+
+
+def upgrade(db):
+    """Обновление схемы базы данных, созданной предыдущей версией
+
+    :param db: sqlite3.Connection
+    :return:
+    """
+    version = int(get_meta(db, 'schema_version') or 0)
+    if version < 2:
+        types = {column[1]: column[2].upper() for column in db.execute('PRAGMA table_info(events)')}
+        if types.get('ts') != 'INTEGER':  # version 1: ts as text, converted to epoch seconds
+            cfg.LOGGER.info(f'Converting event times in {get_storage_path()} to epoch seconds...')
+            db.execute(EVENTS.format(name='events_v2'))
+            db.executemany('INSERT INTO events_v2 (id, section, repo, type, ts, row) VALUES (?, ?, ?, ?, ?, ?)',
+                           [(event_id, section, repo, event_type, events.parse_timestamp(ts), row)
+                            for event_id, section, repo, event_type, ts, row
+                            in db.execute('SELECT id, section, repo, type, ts, row FROM events').fetchall()])
+            db.execute('DROP TABLE events')
+            db.execute('ALTER TABLE events_v2 RENAME TO events')
+            db.execute('CREATE INDEX IF NOT EXISTS events_by_time ON events (section, ts)')
+    set_meta(db, 'schema_version', SCHEMA_VERSION)
+
+
+def close():
+    """Закрытие базы данных
+
+    :return:
+    """
+    global _db
+    with _lock:
+        if _db is not None:
+            _db.close()
+            _db = None
+        _saved.clear()
+        _saved_state.clear()
+
+
+def migrate_json(js_file):
+    """Перенос данных из файла data.json в базу данных
+
+    :param js_file: путь к файлу данных в формате json
+    :return: True, если данные перенесены
+    """
+    try:
+        with open(js_file, 'r') as js:
+            data = json.loads(js.read())
+    except (OSError, ValueError):
+        return False
+    cfg.LOGGER.info(f'Migrating data from {js_file} to {get_storage_path()}...')
+    save(data)
+    return True
+
+
+def _event_id(db, section, row):
+    """Запись события (если его еще нет) и получение его id"""
+    encoded = json.dumps(row, default=bodies.encode)
+    ts = row.ts if hasattr(row, 'ts') else events.parse_timestamp(row[1])
+    key = (section, row[0], row[2], ts, encoded)
+    db.execute('INSERT OR IGNORE INTO events (section, repo, type, ts, row) VALUES (?, ?, ?, ?, ?)', key)
+    return db.execute('SELECT id FROM events WHERE section = ? AND repo = ? AND type = ? AND ts = ? AND row = ?',
+                      key).fetchone()[0]
+
+
+def save(data):
+    """Сохранение данных. Записываются только новые события и изменившиеся разделы
+
+    :param data: структура типа dict (см. setup.save_data)
+    :return: количество записанных разделов
+    """
+    db = connect()
+    written = 0
+    with _lock, db:
+        for section, rows in data.items():
+            if section == cfg.CURSORS_KEY:
+                for key, value in rows.items():
+                    if _saved_state.get(key) != value:
+                        db.execute('INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)',
+                                   (key, json.dumps(value, default=bodies.encode)))
+                        _saved_state[key] = value
+                continue
+            if _saved.get(section) == rows:
+                continue
+            db.execute('DELETE FROM snapshots WHERE section = ?', (section,))
+            db.executemany('INSERT INTO snapshots (section, pos, event) VALUES (?, ?, ?)',
+                           [(section, pos, _event_id(db, section, row)) for pos, row in enumerate(rows)])
+            _saved[section] = list(rows)
+            written += 1
+    cfg.LOGGER.info(f'{written} of {len(data) - (cfg.CURSORS_KEY in data)} sections changed in {get_storage_path()}.')
+    return written
+
+
+def load():
+    """Загрузка данных, сохраненных последний раз
+
+    :return: структура типа dict (см. setup.load_data)
+    """
+    db = connect()
+    data = {}
+    with _lock:
+        for section, row in db.execute('SELECT s.section, e.row FROM snapshots s JOIN events e ON e.id = s.event '
+                                       'ORDER BY s.section, s.pos'):
+            data.setdefault(section, []).append(bodies.attach(json.loads(row)))
+        cursors = {key: json.loads(value) for key, value in db.execute('SELECT key, value FROM state')}
+        for cursor in cursors.values():
+            if isinstance(cursor, dict) and isinstance(cursor.get('rows'), list):
+                cursor['rows'] = [bodies.attach(row) for row in cursor['rows']]
+        _saved.clear()
+        _saved.update((section, list(rows)) for section, rows in data.items())
+        _saved_state.clear()
+        _saved_state.update(cursors)
+    if cursors:
+        data[cfg.CURSORS_KEY] = cursors
+    return data
+
+
+def prune(policies, now=None):
+    """Удаление из истории событий, которые не проходят политику хранения раздела (см. retention.py)
+
+    События, входящие в сохраненные данные разделов, не удаляются.
+
+    :param policies: словарь {раздел: (max_events, max_age в секундах)}
+    :param now:
+    :return: количество удаленных событий
+    """
+    if not policies:
+        return 0
+    if now is None:
+        now = time.time()
+    db = connect()
+    removed = 0
+    with _lock, db:
+        for section, (max_events, max_age) in policies.items():
+            unused = 'section = ? AND id NOT IN (SELECT event FROM snapshots WHERE section = ?)'
+            if max_age:
+                cutoff = int(now - max_age)
+                removed += db.execute(f'DELETE FROM events WHERE {unused} AND ts < ?',
+                                      (section, section, cutoff)).rowcount
+            if max_events:
+                removed += db.execute(f'DELETE FROM events WHERE {unused} AND id IN (SELECT id FROM events '
+                                      f'WHERE section = ? ORDER BY ts DESC, id DESC LIMIT -1 OFFSET ?)',
+                                      (section, section, section, max_events)).rowcount
+    return removed
+
+
+def get_body_digests():
+    """sha256 текстов release, на которые ссылаются события истории (см. bodies.py)
+
+    :return: множество
+    """
+    db = connect()
+    digests = set()
+    with _lock:
+        for (row,) in db.execute("SELECT row FROM events WHERE type = 'RELEASE' AND row LIKE ?",
+                                 (f'%"{bodies.PREFIX}%',)):
+            body = json.loads(row)[5]
+            digests.add(body[len(bodies.PREFIX):])
+    return digests
+
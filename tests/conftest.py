@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Requires python 3.6+
+
+#######################################################################################################################
+# Common fixtures of the tests
+#
+# The modules of the app are imported from the repository root, the fake github API server from benchmarks/.
+# Every test gets its own data directory (cfg.DATA_PATH) and a fresh fake server on a free port.
+#######################################################################################################################
+
+
+import logging
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import cfg  # noqa: E402
+import fake_github  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def settings(tmp_path, monkeypatch):
+    """Логгер и файл данных во временном каталоге. Глобальные настройки восстанавливаются после теста"""
+    for name in dir(cfg):
+        if name.isupper():
+            monkeypatch.setattr(cfg, name, getattr(cfg, name))
+    cfg.LOGGER = logging.getLogger('GitMon-tests')
+    cfg.DATA_PATH = str(tmp_path / 'data.json')
+    return cfg
+
+
+@pytest.fixture
+def github():
+    """Фейковый github API (benchmarks/fake_github.py)
+
+    :return: (базовый url, FakeGitHub)
+    """
+    server, state = fake_github.start(latency=0)
+    yield f'http://127.0.0.1:{server.server_port}', state
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Requires python 3.6+
+
+import bodies
+from events import Event
+
+TEXT = 'Release notes\n' + '\n'.join(f'- change {i}' for i in range(40))
+
+
+def test_body_hashes_like_its_text():
+    body = bodies.Body(bodies.write(TEXT))
+    assert body == TEXT and hash(body) == hash(TEXT)
+    assert TEXT in {body} and body in {TEXT}
+    assert {TEXT: 1}[body] == 1
+
+
+def test_body_is_not_equal_to_its_reference():
+    body = bodies.Body(bodies.write(TEXT))
+    assert body != bodies.PREFIX + body.digest
+
+
+def test_detached_rows_equal_fetched_rows():
+    fetched = Event(['a/one', '2024-01-01T00:00:00Z', 'RELEASE', 'me', 'v1', TEXT])
+    stored = Event(list(fetched))
+    assert bodies.detach([stored]) == 1
+    assert isinstance(stored[5], bodies.Body)
+    assert stored == fetched and fetched in [stored]
+    loaded = Event(['a/one', '2024-01-01T00:00:00Z', 'RELEASE', 'me', 'v1', bodies.encode(stored[5])])
+    assert loaded == stored
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Requires python 3.6+
+
+import os
+
+import pytest
+
+import changelog
+
+
+@pytest.fixture
+def path(tmp_path):
+    changelog._indexes.clear()
+    yield str(tmp_path / 'CHANGELOG.md')
+    changelog._indexes.clear()
+
+
+def read(path):
+    with open(path, encoding='utf-8') as file:
+        return file.read()
+
+
+def assert_index_matches(path):
+    """Индекс в памяти и в файле .idx совпадает с индексом, построенным чтением файла"""
+    scanned = changelog._scan(path)
+    index = changelog.get_index(path)
+    assert (list(index.offsets), list(index.hashes)) == (list(scanned.offsets), list(scanned.hashes))
+    changelog._indexes.clear()
+    stored = changelog.get_index(path)
+    assert (list(stored.offsets), list(stored.hashes)) == (list(scanned.offsets), list(scanned.hashes))
+
+
+def test_insert_keeps_newest_lines_on_top(path):
+    changelog.write(path, 'три\nчетыре\n', 10)
+    changelog.insert(path, 'один\nдва\n', 10)
+    assert read(path) == 'один\nдва\nтри\nчетыре\n'
+    assert_index_matches(path)
+
+
+def test_insert_truncates_to_max_len(path):
+    changelog.write(path, 'c\nd\ne\n', 10)
+    changelog.insert(path, 'a\nb\n', 4)
+    assert read(path) == 'a\nb\nc\nd\n'
+    assert_index_matches(path)
+
+
+def test_append_drops_oldest_lines(path):
+    changelog.append(path, 'a\nb\n', 3)
+    changelog.append(path, 'c\nd\n', 3)
+    assert read(path) == 'b\nc\nd\n'
+    assert_index_matches(path)
+
+
+def test_delete_removes_matching_lines(path):
+    changelog.write(path, 'a\nb\nc\nb\nd\n', 10)
+    assert changelog.delete(path, 'b\nx\n') == 2
+    assert read(path) == 'a\nc\nd\n'
+    assert changelog.delete(path, 'x\n') == 0
+    assert_index_matches(path)
+
+
+def test_file_changed_outside_is_reindexed(path):
+    changelog.write(path, 'a\nb\n', 10)
+    with open(path, 'w') as file:
+        file.write('z\ny')  # no newline at the end
+    os.utime(path, ns=(0, 0))
+    changelog.insert(path, 'x\n', 10)
+    assert read(path) == 'x\nz\ny\n'
+    assert_index_matches(path)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Requires python 3.6+
+
+import pytest
+
+import cfg
+import ghgraphql
+import gitmon
+import httpcache
+import resilience
+
+REQUESTS = [('a/one', 'commits', 3), ('b/two', 'commits', 3), ('a/one', 'releases', 2)]
+
+
+@pytest.fixture(autouse=True)
+def graphql(github):
+    url, state = github
+    cfg.FETCH_BACKEND = 'graphql'
+    cfg.GITHUB_TOKEN = 'token'
+    cfg.GITHUB_BASE_URL = f'{url}/repos'
+    cfg.GITHUB_GRAPHQL_URL = f'{url}/graphql'
+    cfg.FETCH_RETRIES = 0
+    resilience._breakers.clear()
+    resilience.reset_stats()
+    resilience.start_wave()
+    gitmon.CURSORS.clear()
+    httpcache.CACHE.clear()
+    yield state
+    resilience._breakers.clear()
+    gitmon.CURSORS.clear()
+    httpcache.CACHE.clear()
+
+
+def test_batch_in_rest_shape(graphql):
+    results = ghgraphql.fetch_batch(REQUESTS)
+    commits = results[('a/one', 'commits', 3)]
+    assert len(commits) == 3
+    assert gitmon.make_row('a/one', 'commits', commits[0])[2] == 'COMMIT'
+    release = gitmon.make_row('a/one', 'releases', results[('a/one', 'releases', 2)][0])
+    assert release[2] == 'RELEASE' and release[4] == 'a/one v5.0'
+    assert graphql.get_stats()['requests'] == 1
+
+
+def test_missing_repository_is_not_found(graphql):
+    graphql.missing.add('b/two')
+    results = ghgraphql.fetch_batch(REQUESTS)
+    assert results[('b/two', 'commits', 3)] is False
+    assert results[('a/one', 'commits', 3)]
+    assert resilience.reset_stats() == {'not_found': 1}
+    assert 'a/one' not in resilience._breakers
+
+
+@pytest.mark.parametrize('error, kind', [('RATE_LIMITED', 'rate_limit'), ('MAX_NODE_LIMIT_EXCEEDED', 'bad_response')])
+def test_response_without_data_fails_the_batch(graphql, error, kind):
+    graphql.graphql_error = error
+    with pytest.raises(resilience.FetchError) as e:
+        ghgraphql.fetch_batch(REQUESTS)
+    assert e.value.kind == kind
+    assert not resilience._breakers  # no repository is blamed for a throttled batch
+
+
+def test_throttled_batch_falls_back_to_rest(graphql):
+    graphql.graphql_error = 'RATE_LIMITED'
+    cfg.BREAKER_THRESHOLD = 1
+    for cycle in range(3):
+        results = gitmon.fetch_all(REQUESTS)
+        assert all(results[request] for request in REQUESTS)
+    assert not resilience.get_open_breakers()
+    assert len(results[('a/one', 'commits', 3)]) == 3
+
+
+def test_partial_answer_falls_back_to_rest(graphql, monkeypatch):
+    answer = graphql.graphql
+
+    def without_b(query):
+        response = answer(query)
+        for alias, repository in response['data'].items():
+            if 'b/two' in str(repository):
+                response['data'][alias] = None
+        response['errors'] = [{'type': 'SERVICE_UNAVAILABLE', 'message': 'timeout'}]
+        return response
+
+    monkeypatch.setattr(graphql, 'graphql', without_b)
+    graphql.reset_stats()
+    results = gitmon.fetch_all(REQUESTS)
+    assert all(results[request] for request in REQUESTS)
+    assert graphql.get_stats()['requests'] == 2  # the batch and the REST request of b/two
+    assert not resilience._breakers
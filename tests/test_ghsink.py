@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Requires python 3.6+
+
+import base64
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('github')
+from github import GithubException  # noqa: E402
+
+import ghsink  # noqa: E402
+
+EDITS = [('CHANGELOG.md', 'append', 'new line\n', 100, 'a/one')]
+
+
+class Repo:
+    """Репозитарий github с одним файлом, рекурсивное дерево которого обрезано (truncated)"""
+
+    full_name = 'me/site'
+    default_branch = 'main'
+
+    def __init__(self, files, truncated=True):
+        self.files = files
+        self.truncated = truncated
+        self.commits = []
+
+    def get_git_commit(self, sha):
+        return SimpleNamespace(sha=sha, tree=SimpleNamespace(sha='tree'))
+
+    def get_git_tree(self, sha, recursive=False):
+        return SimpleNamespace(tree=[], raw_data={'truncated': self.truncated})
+
+    def get_contents(self, path, ref=None):
+        if path not in self.files:
+            raise GithubException(404, {'message': 'Not Found'}, None)
+        return SimpleNamespace(type='file', sha=ghsink.blob_sha(self.files[path]))
+
+    def get_git_blob(self, sha):
+        content = next(text for text in self.files.values() if ghsink.blob_sha(text) == sha)
+        return SimpleNamespace(content=base64.b64encode(content.encode()).decode())
+
+    def create_git_tree(self, elements, base_tree=None):
+        return elements
+
+    def create_git_commit(self, message, tree, parents):
+        self.commits.append(tree)
+        return SimpleNamespace(sha='commit')
+
+
+@pytest.fixture(autouse=True)
+def clean():
+    ghsink._blobs.clear()
+    yield
+    ghsink._blobs.clear()
+
+
+def test_file_missing_from_truncated_tree_is_read():
+    repo = Repo({'CHANGELOG.md': 'old line\n'})
+    ref = SimpleNamespace(object=SimpleNamespace(sha='head'))
+    ghsink.build_commit(repo, ref, EDITS)
+    assert ghsink._blobs[('me/site', 'CHANGELOG.md')][1] == 'old line\nnew line\n'
+
+
+def test_new_file_of_truncated_tree():
+    repo = Repo({})
+    ref = SimpleNamespace(object=SimpleNamespace(sha='head'))
+    ghsink.build_commit(repo, ref, EDITS)
+    assert ghsink._blobs[('me/site', 'CHANGELOG.md')][1] == 'new line\n'
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Requires python 3.6+
+
+import threading
+import time
+
+import pytest
+
+import cfg
+import scheduler
+
+NOW = 1000000.0
+
+
+@pytest.fixture(autouse=True)
+def clean(monkeypatch):
+    monkeypatch.setattr(scheduler, 'RATE_LIMIT', {'limit': None, 'remaining': None, 'reset': None})
+
+
+def section(update_interval=0, **options):
+    return dict({'commits': 1, 'releases': 1, 'update_interval': update_interval}, **options)
+
+
+def make(options):
+    queue = scheduler.Scheduler(options)
+    for repo in queue.sections:
+        queue.schedule(repo, NOW)  # everything is due at NOW
+    return queue
+
+
+def test_shared_repository_is_polled_once():
+    queue = make({'a/one, a/two': section(5), 'a/two': section(10)})
+    assert sorted(queue.pop_due(NOW)) == ['a/one', 'a/two']
+    assert queue.get_sections(['a/two']) == ['a/one, a/two', 'a/two']
+    assert queue.get_sections(['a/one']) == ['a/one, a/two']
+    assert queue.base_interval('a/two') == 300  # the smallest interval of its sections
+
+
+def test_rescheduling_invalidates_the_old_entry():
+    queue = make({'a/one': section(5)})
+    queue.schedule('a/one', NOW + 100)
+    assert queue.pop_due(NOW) == []
+    assert queue.next_due() == NOW + 100
+    assert queue.pop_due(NOW + 100) == ['a/one']
+    assert queue.next_due() is None
+
+
+def test_quiet_repository_backs_off_up_to_update_interval():
+    cfg.MIN_UPDATE_INTERVAL = 1
+    queue = make({'a/one': section(5)})
+    queue.pop_due(NOW)
+    assert queue.reschedule('a/one', changed=True, now=NOW) == 150
+    intervals = [queue.reschedule('a/one', changed=False, now=NOW) for i in range(5)]
+    assert intervals[0] == 225 and intervals[-1] == 300
+    cfg.MAX_UPDATE_INTERVAL = 20
+    assert queue.reschedule('a/one', changed=False, now=NOW) == 450
+
+
+def test_removed_section_leaves_the_queue():
+    options = {'a/one': section(5), 'a/two': section(5)}
+    queue = make(options)
+    del options['a/two']
+    options['a/three'] = section(5)
+    queue.update(added=['a/three'], removed=['a/two'], changed=[], now=NOW)
+    assert sorted(queue.pop_due(NOW)) == ['a/one', 'a/three']
+    assert queue.reschedule('a/two', changed=False, now=NOW) is None
+
+
+def test_exhausted_rate_limit_postpones_polling():
+    queue = make({'a/one': section(5), 'a/two': section(5)})
+    scheduler.update_rate_limit({'X-RateLimit-Remaining': str(scheduler.RATE_LIMIT_RESERVE + 2),
+                                 'X-RateLimit-Reset': str(int(NOW) + 600)})
+    assert len(queue.pop_due(NOW)) == 1  # one poll costs two requests
+    assert queue.next_due() == NOW + 601
+
+
+def test_wait_is_interrupted_by_wake():
+    queue = make({'a/one': section(5)})
+    queue.schedule('a/one', time.time() + 60)
+    wake = threading.Event()
+    threading.Timer(0.1, wake.set).start()
+    started = time.monotonic()
+    queue.wait(wake=wake)
+    assert time.monotonic() - started < 5
+    assert not wake.is_set()
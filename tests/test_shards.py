@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Requires python 3.6+
+
+import json
+import os
+
+import cfg
+import shards
+import triggers
+
+
+def write_layout(workers):
+    with open(shards.get_layout_path(), 'w') as js:
+        json.dump({'workers': workers}, js)
+
+
+def shard_triggers_path(index):
+    return triggers.get_triggers_path(shards.get_shard_path(cfg.DATA_PATH, index))
+
+
+def test_restart_delay_grows_and_resets():
+    delay = 0
+    delays = []
+    for i in range(12):
+        delay = shards.get_restart_delay(delay, ran=1)
+        delays.append(delay)
+    assert delays[:4] == [1, 2, 4, 8]
+    assert delays[-1] == shards.MAX_RESTART_DELAY
+    assert shards.get_restart_delay(delays[-1], ran=shards.MAX_RESTART_DELAY) == shards.RESTART_DELAY
+
+
+def test_triggers_of_removed_workers_are_moved():
+    cfg.OPTIONS = {f'a/repo{i}': {} for i in range(30)}
+    removed = next(section for section in cfg.OPTIONS if shards.get_worker(section, 3) == 2)
+    kept = next(section for section in cfg.OPTIONS if shards.get_worker(section, 3) == 0)
+    write_layout(3)
+    pending = {0: [{'url': 'http://hub/app', 'tag': 'latest', 'first': 10.0, 'count': 1, 'sections': [kept]}],
+               2: [{'url': 'http://hub/app', 'tag': 'latest', 'first': 5.0, 'count': 2, 'sections': [removed]},
+                   {'url': 'http://hub/db', 'tag': 'v1', 'first': 7.0, 'count': 1, 'sections': [removed]}]}
+    for index, items in pending.items():
+        with open(shard_triggers_path(index), 'w') as js:
+            json.dump(items, js)
+
+    shards.rebalance(2)
+
+    assert not os.path.exists(shard_triggers_path(2))
+    moved = []
+    for index in range(2):
+        if os.path.exists(shard_triggers_path(index)):
+            with open(shard_triggers_path(index)) as js:
+                moved += [(index, trigger) for trigger in json.load(js)]
+    assert len(moved) == 2
+    by_url = {trigger['url']: (index, trigger) for index, trigger in moved}
+    index, app = by_url['http://hub/app']
+    assert (app['first'], app['count'], app['sections']) == (5.0, 3, [kept, removed])
+    assert index == shards.get_worker(kept, 2)
+    assert by_url['http://hub/db'][0] == shards.get_worker(removed, 2)
+
+
+def test_unsharded_triggers_are_distributed():
+    cfg.OPTIONS = {'a/one': {}, 'a/two': {}}
+    with open(triggers.get_triggers_path(), 'w') as js:
+        json.dump([{'url': 'http://hub/app', 'tag': 'latest', 'first': 1.0, 'count': 1, 'sections': ['a/two']}], js)
+
+    assert shards.rebalance_triggers(0, 2) == 1
+
+    assert not os.path.exists(triggers.get_triggers_path())
+    with open(shard_triggers_path(shards.get_worker('a/two', 2))) as js:
+        assert json.load(js)[0]['sections'] == ['a/two']
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Requires python 3.6+
+
+import json
+import sqlite3
+
+import pytest
+
+import cfg
+import events
+import storage
+
+OLD = ['a/one', '2020-01-01T00:00:00Z', 'COMMIT', 'me', 'old commit']
+NEW = ['a/one', '2024-01-01T00:00:00Z', 'COMMIT', 'me', 'new commit']
+NOW = events.parse_timestamp('2024-01-02T00:00:00Z')
+
+
+@pytest.fixture(autouse=True)
+def database():
+    cfg.STORAGE_BACKEND = 'sqlite'
+    storage.close()
+    yield
+    storage.close()
+
+
+def count_events():
+    return storage.connect().execute('SELECT COUNT(*) FROM events').fetchone()[0]
+
+
+def test_unchanged_data_are_not_written_again():
+    data = {'a/one': [NEW, OLD], cfg.CURSORS_KEY: {'commits:a/one': {'since': 'x'}}}
+    assert storage.save(data) == 1
+    storage.close()
+    loaded = storage.load()
+    assert loaded == data
+    assert storage.save(loaded) == 0
+    loaded['a/one'] = [NEW]
+    assert storage.save(loaded) == 1
+    assert count_events() == 2  # the history keeps the event that left the snapshot
+
+
+def test_json_data_are_migrated_once():
+    with open(cfg.DATA_PATH, 'w') as js:
+        json.dump({'a/one': [NEW]}, js)
+    assert storage.load() == {'a/one': [NEW]}
+    storage.save({'a/one': []})
+    storage.close()
+    assert storage.load() == {}  # data.json is not migrated again
+
+
+def test_text_timestamps_are_converted():
+    db = sqlite3.connect(storage.get_storage_path())
+    db.execute('CREATE TABLE events (id INTEGER PRIMARY KEY, section TEXT NOT NULL, repo TEXT NOT NULL, '
+               'type TEXT NOT NULL, ts TEXT NOT NULL, row TEXT NOT NULL, UNIQUE (section, repo, type, ts, row))')
+    db.execute('INSERT INTO events (section, repo, type, ts, row) VALUES (?, ?, ?, ?, ?)',
+               ('a/one', 'a/one', 'COMMIT', OLD[1], json.dumps(OLD)))
+    db.commit()
+    db.close()
+    db = storage.connect()
+    assert db.execute('SELECT ts FROM events').fetchone()[0] == events.parse_timestamp(OLD[1])
+    assert storage.get_meta(db, 'schema_version') == str(storage.SCHEMA_VERSION)
+
+
+def test_prune_keeps_saved_events():
+    storage.save({'a/one': [NEW, OLD]})
+    storage.save({'a/one': [NEW]})
+    storage.save({'a/one': [OLD]})
+    assert storage.prune({'a/one': (0, 86400 * 30)}, now=NOW) == 0  # OLD is in the snapshot
+    storage.save({'a/one': [NEW]})
+    assert storage.prune({'a/one': (0, 86400 * 30)}, now=NOW) == 1
+    assert storage.load() == {'a/one': [NEW]}
+
+
+def test_prune_keeps_newest_events():
+    rows = [['a/one', f'2024-01-01T00:00:0{i}Z', 'COMMIT', 'me', f'commit {i}'] for i in range(5)]
+    storage.save({'a/one': rows})
+    storage.save({'a/one': []})
+    assert storage.prune({'a/one': (2, 0)}) == 3
+    kept = storage.connect().execute('SELECT row FROM events ORDER BY ts').fetchall()
+    assert [json.loads(row) for (row,) in kept] == rows[3:]
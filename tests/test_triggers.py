@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Requires python 3.6+
+
+import threading
+import time
+
+import pytest
+
+import cfg
+import executor
+import gitmon
+import triggers
+
+
+@pytest.fixture(autouse=True)
+def clean():
+    triggers.PENDING.clear()
+    triggers.WAKE.clear()
+    triggers._flush_queued = False
+    yield
+    executor.shutdown()
+    triggers.PENDING.clear()
+
+
+def test_concurrent_flushes_start_one_build(github):
+    url, state = github
+    state.post_latency = 0.3
+    triggers.add(f'{url}/trigger/app', 'latest', 'a/one')
+    threads = [threading.Thread(target=triggers.flush) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(state.posts) == 1
+    assert not triggers.PENDING
+
+
+def test_trigger_is_in_flight_while_posting(github):
+    url, state = github
+    state.post_latency = 0.3
+    triggers.add(f'{url}/trigger/app', 'latest')
+    thread = threading.Thread(target=triggers.flush)
+    thread.start()
+    time.sleep(0.1)
+    assert triggers.next_due() is None  # nothing to wake up for while the POST runs
+    thread.join()
+    assert len(state.posts) == 1
+
+
+def test_failed_trigger_is_put_back(github):
+    url, state = github
+    state.post_status = 500
+    triggers.add(f'{url}/trigger/app', 'latest')
+    assert triggers.flush() is False
+    assert not triggers.PENDING[(f'{url}/trigger/app', 'latest')]['posting']
+    assert triggers.next_due() is not None
+    state.post_status = 200
+    assert triggers.flush() is True
+    assert len(state.posts) == 2
+    assert not triggers.PENDING
+
+
+def test_requests_during_post_need_one_more_build(github):
+    url, state = github
+    state.post_latency = 0.3
+    thread = threading.Thread(target=triggers.flush)
+    triggers.add(f'{url}/trigger/app', 'latest')
+    thread.start()
+    time.sleep(0.1)
+    triggers.add(f'{url}/trigger/app', 'latest')
+    thread.join()
+    assert triggers.PENDING[(f'{url}/trigger/app', 'latest')]['count'] == 1
+    triggers.flush()
+    assert len(state.posts) == 2
+
+
+def test_only_one_flush_is_queued(github):
+    url, state = github
+    state.post_latency = 0.3
+    cfg.ACTION_CONCURRENCY = {'dockerhub': 2}
+    executor.start()
+    triggers.add(f'{url}/trigger/app', 'latest')
+    submitted = sum(triggers.submit_flush() for i in range(100))
+    executor.drain()
+    assert submitted == 1
+    assert len(state.posts) == 1
+    assert executor.get_stats()['dockerhub']['done'] == 1
+
+
+def test_debounce_merges_requests(github):
+    url, state = github
+    cfg.DOCKERHUB_DEBOUNCE = 60
+    for section in ('a/one', 'b/two', 'a/one'):
+        triggers.add(f'{url}/trigger/app', 'latest', section)
+    assert triggers.submit_flush() is False  # the window is still open
+    triggers.flush(force=True)
+    assert len(state.posts) == 1
+    assert triggers.STATS['builds'] >= 1
+
+
+def test_saved_triggers_survive_restart(github):
+    url, state = github
+    cfg.DOCKERHUB_DEBOUNCE = 60
+    triggers.add(f'{url}/trigger/app', 'latest', 'a/one')
+    triggers.save()
+    triggers.PENDING.clear()
+    assert triggers.load() == 1
+    trigger = triggers.PENDING[(f'{url}/trigger/app', 'latest')]
+    assert trigger['sections'] == ['a/one'] and not trigger['posting']
+
+
+def test_wake_time_of_a_due_trigger_is_not_zero(github):
+    url, state = github
+    cfg.CONFIG_RELOAD = 0
+    triggers.add(f'{url}/trigger/app', 'latest')
+    assert triggers.next_due() <= time.time()
+    assert gitmon.get_wake_time() >= time.time() + gitmon.TRIGGER_RECHECK - 0.1
+
+
+def test_added_trigger_wakes_the_main_loop(github):
+    url, state = github
+    cfg.CONFIG_RELOAD = 0
+    cfg.DOCKERHUB_DEBOUNCE = 0.2
+    queue = gitmon.scheduler.Scheduler({})
+    threading.Timer(0.1, triggers.add, (f'{url}/trigger/app', 'latest')).start()
+    started = time.time()
+    queue.wait(until=started + 30, wake=triggers.WAKE)
+    assert time.time() - started < 5
+    assert started < gitmon.get_wake_time() < started + 5  # the debounce deadline of the new trigger
@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Requires python 3.6+
+
+import cfg
+import webhook
+
+
+def test_signed_delivery_is_accepted():
+    body = b'{"zen": "ok"}'
+    assert webhook.verify('secret', body, webhook.sign('secret', body))
+    assert not webhook.verify('secret', body, webhook.sign('other', body))
+    assert not webhook.verify('secret', body, None)
+
+
+def test_unsigned_delivery_needs_opt_in():
+    assert not webhook.verify('', b'{}', None)
+    assert webhook.verify('', b'{}', None, insecure=True)
+
+
+def test_receiver_does_not_start_without_secret():
+    cfg.WEBHOOK_SECRET = ''
+    assert cfg.WEBHOOK_HOST == '127.0.0.1'
+    assert webhook.serve(lambda *updates: None, port=0) is False
+    assert webhook._server is None
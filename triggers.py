@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Requires python 3.6+
+
+#######################################################################################################################
+# Coalescing of hub.docker.com build triggers
+#
+# dockerhub.buildimage actions do not POST to the trigger url at once. The request is added to the pending triggers,
+# keyed by trigger url and docker tag, and all requests for the same key that arrive within the debounce window
+# (dockerhub_debounce seconds after the first one) are merged into one POST. Pending triggers are saved next to the
+# data file, so a restart neither loses nor repeats them.
+# A trigger is marked as in flight while its POST runs, so two flushes never start the same build twice, and it is put
+# back if the POST fails. Only one flush waits in the dockerhub queue at a time (submit_flush). WAKE is set whenever the
+# nearest deadline may have moved, so the main loop recomputes its sleep instead of waiting for the next poll.
+#######################################################################################################################
+
+
+import json
+import threading
+import time
+from pathlib import Path
+from urllib.error import HTTPError, URLError
+
+import cfg
+import executor
+import net
+
+
+PENDING = {}  # (url, tag) -> {'first': timestamp, 'count': requests, 'sections': [...], 'posting': in flight}
+STATS = {'requests': 0, 'builds': 0, 'saved': 0}  # counters since the start (saved - builds we did not start)
+WAKE = threading.Event()  # set when a trigger is added or comes back, see next_due
+_lock = threading.Lock()
+_changed = False
+_flush_queued = False
+
+
+def get_triggers_path(data_path=''):
+    """Путь к файлу отложенных триггеров (data.json -> data.triggers.json)
+
+    :param data_path: файл данных. По-умолчанию - data_file из конфигурационного файла
+    :return:
+    """
+    return str(Path(data_path or cfg.DATA_PATH).with_suffix('.triggers.json'))
+
+
+def load(triggers_file=''):
+    """Загрузка отложенных триггеров из файла
+
+    :param triggers_file: путь к файлу
+    :return: количество загруженных триггеров
+    """
+    global _changed
+    if not triggers_file:
+        triggers_file = get_triggers_path()
+    try:
+        with open(triggers_file, 'r') as js:
+            triggers = json.loads(js.read())
+    except (OSError, ValueError):
+        triggers = []
+    with _lock:
+        PENDING.clear()
+        for trigger in triggers:
+            PENDING[(trigger['url'], trigger['tag'])] = {'first': trigger['first'], 'count': trigger['count'],
+                                                         'sections': trigger['sections'], 'posting': False}
+            STATS['requests'] += trigger['count']
+        _changed = False
+    if PENDING:
+        cfg.LOGGER.info(f'Loaded {len(PENDING)} pending hub.docker.com triggers from {triggers_file}')
+    return len(PENDING)
+
+
+def save(triggers_file=''):
+    """Сохранение отложенных триггеров в файл (только если они изменились)
+
+    :param triggers_file: путь к файлу
+    :return:
+    """
+    global _changed
+    if not triggers_file:
+        triggers_file = get_triggers_path()
+    with _lock:
+        if not _changed:
+            return
+        triggers = [{'url': url, 'tag': tag, 'first': trigger['first'], 'count': trigger['count'],
+                     'sections': trigger['sections']} for (url, tag), trigger in PENDING.items()]
+        with open(triggers_file, 'w') as js:
+            json.dump(triggers, js)
+        _changed = False
+
+
+def add(url, tag, section=''):
+    """Запрос на запуск компиляции образа. Запросы с одинаковыми url и tag объединяются
+
+    :param url: Trigger URL
+    :param tag: docker tag
+    :param section: раздел конфигурационного файла, которому нужна новая сборка
+    :return:
+    """
+    global _changed
+    with _lock:
+        trigger = PENDING.setdefault((url, tag), {'first': time.time(), 'count': 0, 'sections': [], 'posting': False})
+        trigger['count'] += 1
+        if section and section not in trigger['sections']:
+            trigger['sections'].append(section)
+        STATS['requests'] += 1
+        _changed = True
+    WAKE.set()
+    cfg.LOGGER.info(f'Build of {tag} on hub.docker.com requested by {section or url} '
+                    f'({trigger["count"]} request(s) pending)')
+
+
+def next_due():
+    """Время запуска ближайшего отложенного триггера (триггеры, которые запускаются сейчас, не учитываются)
+
+    :return: timestamp или None, если отложенных триггеров нет
+    """
+    with _lock:
+        waiting = [trigger['first'] for trigger in PENDING.values() if not trigger['posting']]
+    if not waiting:
+        return None
+    return min(waiting) + cfg.DOCKERHUB_DEBOUNCE
+
+
+def submit_flush():
+    """Постановка flush в очередь dockerhub, если какой-то триггер пора запускать
+
+    В очереди не бывает больше одного flush: пока он не начал выполняться, новый не ставится.
+
+    :return: True, если flush поставлен в очередь
+    """
+    global _flush_queued
+    due = next_due()
+    if due is None or due > time.time():
+        return False
+    with _lock:
+        if _flush_queued:
+            return False
+        _flush_queued = True
+    executor.submit('dockerhub', _queued_flush, section='dockerhub triggers')
+    return True
+
+
+def _queued_flush():
+    global _flush_queued
+    with _lock:
+        _flush_queued = False  # triggers that become due from now on need another flush
+    return flush()
+
+
+def post(url, tag, timeout=10):
+    """Запуск компиляции образа на hub.docker.com
+
+    :param url: Trigger URL
+    :param tag: docker tag
+    :param timeout:
+    :return: статус ответа
+    """
+    params = json.dumps({"docker_tag": f"{tag}"}).encode('utf8')
+    res = net.request(url, data=params, headers={'content-type': 'application/json'}, timeout=timeout)
+    cfg.LOGGER.info(f'The result of the build {tag} trigger: {res.msg}')
+    return res.status
+
+
+def flush(force=False):
+    """Запуск всех триггеров, у которых закончилось окно объединения запросов
+
+    :param force: запустить все отложенные триггеры
+    :return: False, если какой-то триггер не удалось запустить из-за временной ошибки, иначе True
+    """
+    now = time.time()
+    with _lock:
+        due = [(key, dict(trigger)) for key, trigger in PENDING.items()
+               if not trigger['posting'] and (force or now - trigger['first'] >= cfg.DOCKERHUB_DEBOUNCE)]
+        for key, trigger in due:
+            PENDING[key]['posting'] = True  # another flush must not start the same build
+    ok = True
+    for (url, tag), trigger in due:
+        try:
+            post(url, tag)
+        except HTTPError as e:
+            cfg.LOGGER.error(f'The server couldn\'t fulfill the request. Error code: {e.code}')
+            if e.code < 500:  # wrong trigger url: the next attempt will fail too
+                _done(url, tag, trigger, built=False)
+            else:
+                _retry(url, tag)
+                ok = False
+        except URLError as e:
+            cfg.LOGGER.error(f'We failed to reach a url: {url}. Reason: {e.reason}')
+            _retry(url, tag)
+            ok = False
+        except ValueError as e:  # malformed trigger url
+            cfg.LOGGER.error(f'Wrong trigger url: {url}. Reason: {e}')
+            _done(url, tag, trigger, built=False)
+        else:
+            _done(url, tag, trigger, built=True)
+    if due:
+        save()
+    return ok
+
+
+def _retry(url, tag):
+    """Возврат триггера, который не удалось запустить, в отложенные"""
+    with _lock:
+        PENDING[(url, tag)]['posting'] = False
+    WAKE.set()
+
+
+def _done(url, tag, trigger, built):
+    """Удаление триггера из отложенных с учетом запросов, пришедших во время его запуска"""
+    global _changed
+    with _lock:
+        current = PENDING.pop((url, tag), trigger)
+        if current['count'] > trigger['count']:  # new requests arrived after the POST: they need one more build
+            PENDING[(url, tag)] = {'first': time.time(), 'count': current['count'] - trigger['count'],
+                                   'sections': current['sections'], 'posting': False}
+        _changed = True
+        if built:
+            STATS['builds'] += 1
+            STATS['saved'] += trigger['count'] - 1
+    WAKE.set()
+    if built:
+        cfg.LOGGER.info(f'Build of {tag} started on hub.docker.com for {trigger["count"]} request(s) from '
+                        f'{trigger["sections"]}. Builds saved: {trigger["count"] - 1} '
+                        f'(total {STATS["saved"]} of {STATS["requests"]} requests).')
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Requires python 3.6+
+
+#######################################################################################################################
+# Warm state snapshot for one-shot runs (update_interval: 0)
+#
+# After every saved cycle a small JSON snapshot is written next to the data file (data.json -> data.warm): for every
+# request the url of its first page, the newest known event (cursor sha/id and date) and the HTTP validators of that
+# url, together with fingerprints of the configuration and data files. The next one-shot run (cron, CI) checks the
+# snapshot before loading data, cache and triggers: it sends conditional requests for all first pages at once, and if
+# github answers "304 Not Modified" (or returns the same newest event) everywhere, there is nothing to do and GitMon
+# exits. Any doubt (changed files, pending triggers, an error, a new event) falls back to the normal cycle.
+# The answers of the check are the answers to the first requests of that cycle (the same urls), so they are kept in
+# RESPONSES and gitmon.request_changelog takes them from there instead of asking github again: a warm run with changes
+# costs as many requests as a cold one.
+#######################################################################################################################
+
+
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.error import URLError
+
+import cfg
+import net
+import storage
+import triggers
+
+
+VERSION = 2
+RESPONSES = {}  # url -> (status, headers, body) of the check, for the first wave of the cycle that follows it
+_lock = threading.Lock()
+
+
+def get_warm_path():
+    """Путь к файлу снимка (data.json -> data.warm)"""
+    return str(Path(cfg.DATA_PATH).with_suffix('.warm'))
+
+
+def get_fingerprint(path):
+    """Время изменения и размер файла (None, если файла нет)"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def get_data_fingerprint():
+    """Отпечаток хранилища данных (data.json или база sqlite)"""
+    return get_fingerprint(storage.get_storage_path() if cfg.STORAGE_BACKEND == 'sqlite' else cfg.DATA_PATH)
+
+
+def save(requests, warm_file=''):
+    """Запись снимка. Вызывается после сохранения данных цикла
+
+    :param requests: словарь {ключ курсора: {'url': ..., 'id': ..., 'date': ..., 'etag': ..., 'last_modified': ...}}
+    :param warm_file: путь к файлу снимка
+    :return:
+    """
+    if not warm_file:
+        warm_file = get_warm_path()
+    snapshot = {'version': VERSION, 'config': get_fingerprint(cfg.CONFIG_PATH), 'data': get_data_fingerprint(),
+                'requests': requests}
+    try:
+        with open(warm_file, 'w') as warm:
+            json.dump(snapshot, warm)
+    except OSError as e:
+        cfg.LOGGER.error(f'Error writing warm state file {warm_file}. Reason: {e}')
+
+
+def load(warm_file=''):
+    """Чтение снимка
+
+    :param warm_file: путь к файлу снимка
+    :return: снимок или None, если его нет или он поврежден
+    """
+    if not warm_file:
+        warm_file = get_warm_path()
+    try:
+        with open(warm_file, 'r') as warm:
+            snapshot = json.load(warm)
+    except (OSError, ValueError):  # missing, truncated or written by another version - just a cold start
+        return None
+    if not isinstance(snapshot, dict) or snapshot.get('version') != VERSION or not isinstance(snapshot.get('requests'),
+                                                                                                dict):
+        return None
+    return snapshot
+
+
+def has_pending_triggers():
+    """Есть ли отложенные триггеры hub.docker.com (без загрузки их в triggers.PENDING)"""
+    try:
+        with open(triggers.get_triggers_path(), 'r') as js:
+            return bool(json.loads(js.read()))
+    except (OSError, ValueError):
+        return False
+
+
+def is_applicable(keys, snapshot):
+    """Можно ли завершить цикл по снимку, не загружая данные
+
+    :param keys: ключи курсоров запросов текущей конфигурации
+    :param snapshot: результат load()
+    :return: True или False
+    """
+    if not cfg.FAST_START or cfg.UPDATE_INTERVAL or cfg.FETCH_BACKEND != 'rest' or snapshot is None:
+        return False
+    if not all(options['only_new'] for options in cfg.OPTIONS.values()):
+        return False  # such sections run their actions on every cycle
+    if has_pending_triggers():
+        return False  # they must be sent by the normal cycle
+    return (snapshot['config'] == get_fingerprint(cfg.CONFIG_PATH) and snapshot['data'] == get_data_fingerprint()
+            and set(snapshot['requests']) == set(keys))
+
+
+def is_unchanged(request):
+    """Условный запрос первой страницы: нет ли новых событий
+
+    Если github ответил полностью, а самое новое событие прежнее, то в запись снимка сохраняются новые
+    validators, и следующая проверка получит "304 Not Modified".
+
+    :param request: запись снимка
+    :return: True, если самое новое событие осталось прежним
+    """
+    headers = {}
+    if request.get('etag'):
+        headers['If-None-Match'] = request['etag']
+    if request.get('last_modified'):
+        headers['If-Modified-Since'] = request['last_modified']
+    if cfg.GITHUB_TOKEN:
+        headers['Authorization'] = f'token {cfg.GITHUB_TOKEN}'
+    try:
+        res = net.request(request['url'], headers=headers)
+        body = res.read()
+    except URLError as e:
+        if getattr(e, 'code', None) == 304:
+            with _lock:
+                RESPONSES[request['url']] = (304, e.headers, b'')
+            return True
+        return False
+    with _lock:
+        RESPONSES[request['url']] = (res.status, res.headers, body)
+    try:
+        updates = json.loads(body.decode())
+    except ValueError:
+        return False
+    if type(updates) is list:
+        updates = updates[:1]
+    else:
+        updates = [updates, ]
+    if not updates or (updates[0].get('sha') or updates[0].get('id')) != request['id']:
+        return False
+    request['etag'], request['last_modified'] = res.headers.get('ETag'), res.headers.get('Last-Modified')
+    return True
+
+
+def check(keys):
+    """Быстрая проверка одноразового запуска: все запросы из снимка выполняются параллельно
+
+    :param keys: ключи курсоров запросов текущей конфигурации
+    :return: True, если изменений нет и цикл можно не выполнять
+    """
+    snapshot = load()
+    if not is_applicable(keys, snapshot):
+        return False
+    requests = list(snapshot['requests'].values())
+    validators = [(request.get('etag'), request.get('last_modified')) for request in requests]
+    with ThreadPoolExecutor(max_workers=max(1, min(cfg.MAX_CONCURRENCY, len(requests)))) as pool:
+        unchanged = all(list(pool.map(is_unchanged, requests)))
+    cfg.LOGGER.info(f'Warm state check of {len(requests)} requests: {"no changes" if unchanged else "changes found"}.')
+    if unchanged and validators != [(request.get('etag'), request.get('last_modified')) for request in requests]:
+        save(snapshot['requests'])
+    return unchanged
+
+
+def take_response(url):
+    """Ответ, полученный при проверке снимка (один раз)
+
+    :param url: адрес запроса
+    :return: (код ответа, заголовки, тело) или None
+    """
+    with _lock:
+        return RESPONSES.pop(url, None)
+
+
+def forget():
+    """Забыть ответы проверки, которые не понадобились первой волне запросов"""
+    with _lock:
+        RESPONSES.clear()
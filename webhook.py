@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Requires python 3.6+
+
+#######################################################################################################################
+# Receiver of github webhooks (gitmon.py --serve)
+#
+# For repositories with an installed webhook (content type application/json, events "push" and "release") github
+# sends new commits and releases itself, so sections with mode: webhook need not be polled. The listener checks the
+# X-Hub-Signature-256 HMAC of every delivery with webhook_secret, converts the payload to records in the format of
+# the github REST API (the same as get_last_updates receives) and passes them to gitmon.apply_webhook from a separate
+# thread, so github gets its answer at once.
+# Deliveries start file writes, commits and docker builds, so the receiver does not start without webhook_secret
+# unless unsigned webhooks are explicitly allowed (webhook_insecure), and it listens on 127.0.0.1 by default.
+#
+# Recorded payloads can be posted locally:
+#   python webhook.py --url http://127.0.0.1:8000/ --secret <webhook_secret> --event push examples/webhooks/push.json
+#######################################################################################################################
+
+
+import hashlib
+import hmac
+import json
+import queue
+import threading
+import time
+
+import cfg
+import events
+import metrics
+
+
+MAX_PAYLOAD = 25 * 1024 * 1024  # github does not send bigger payloads
+_queue = queue.Queue()
+_server = None
+
+
+def sign(secret, body):
+    """Подпись тела запроса в формате заголовка X-Hub-Signature-256
+
+    :param secret: webhook_secret
+    :param body: bytes
+    :return: 'sha256=...'
+    """
+    return 'sha256=' + hmac.new(secret.encode('utf8'), body, hashlib.sha256).hexdigest()
+
+
+def verify(secret, body, signature, insecure=False):
+    """Проверка подписи запроса. Без webhook_secret запросы принимаются, только если задан webhook_insecure
+
+    :param secret: webhook_secret
+    :param body: bytes
+    :param signature: значение заголовка X-Hub-Signature-256
+    :param insecure: webhook_insecure
+    :return: True или False
+    """
+    if not secret:
+        return insecure
+    return bool(signature) and hmac.compare_digest(sign(secret, body), signature)
+
+
+def to_iso(value):
+    """Время из payload ('2020-01-31T15:00:00+03:00') в формате github API ('2020-01-31T12:00:00Z')"""
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(events.parse_timestamp(value)))
+
+
+def get_updates(event, payload):
+    """Записи в формате ответа github REST API из payload события push или release
+
+    Учитываются только commits ветки по-умолчанию (их же возвращает github API) и опубликованные releases.
+
+    :param event: значение заголовка X-GitHub-Event
+    :param payload: разобранное тело запроса
+    :return: (репозитарий, 'commits' или 'releases', записи от новых к старым) или None, если событие не нужно
+    """
+    repo = (payload.get('repository') or {}).get('full_name')
+    if not repo:
+        return None
+    if event == 'push':
+        default_branch = payload['repository'].get('default_branch') or payload['repository'].get('master_branch')
+        if payload.get('ref') != f'refs/heads/{default_branch}' or not payload.get('commits'):
+            return None
+        updates = [{'sha': commit['id'],
+                    'commit': {'committer': {'date': to_iso(commit['timestamp'])},
+                               'author': {'name': commit['author']['name']},
+                               'message': commit['message']}}
+                   for commit in reversed(payload['commits'])]  # github sends the oldest commit first
+        return repo, 'commits', updates
+    if event == 'release' and payload.get('action') == 'published':
+        return repo, 'releases', [payload['release']]
+    return None
+
+
+def _process(callback):
+    """Поток обработки принятых событий"""
+    while True:
+        delivery, event, payload = _queue.get()
+        try:
+            updates = get_updates(event, payload)
+            if updates is None:
+                cfg.LOGGER.info(f'Webhook {delivery}: {event} event is ignored.')
+            else:
+                cfg.LOGGER.info(f'Webhook {delivery}: {len(updates[2])} {updates[1]} of {updates[0]}.')
+                callback(*updates)
+        except Exception as e:
+            cfg.LOGGER.error(f'Error processing webhook {delivery} ({event}). Reason: {e!r}')
+        finally:
+            _queue.task_done()
+
+
+def serve(callback, port=None, host=None):
+    """Запуск приемника webhooks в отдельном потоке
+
+    :param callback: функция (репозитарий, 'commits' или 'releases', записи), см. gitmon.apply_webhook
+    :param port: по-умолчанию - webhook_port из конфигурационного файла
+    :param host: по-умолчанию - webhook_host из конфигурационного файла
+    :return: True, если приемник запущен
+    """
+    global _server
+    port = cfg.WEBHOOK_PORT if port is None else port
+    host = cfg.WEBHOOK_HOST if host is None else host
+    if _server is not None:
+        return False
+    if not cfg.WEBHOOK_SECRET and not cfg.WEBHOOK_INSECURE:
+        cfg.LOGGER.error('webhook_secret is not set. Set it (and the same secret in the webhook settings on github) '
+                         'or allow unsigned webhooks with webhook_insecure: yes.')
+        return False
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def reply(self, status, text):
+            body = text.encode('utf8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'text/plain; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            event = self.headers.get('X-GitHub-Event', '')
+            delivery = self.headers.get('X-GitHub-Delivery', '-')
+            length = int(self.headers.get('Content-Length') or 0)
+            if length > MAX_PAYLOAD:
+                status, text = 413, 'Payload too large'
+            else:
+                body = self.rfile.read(length)
+                if not verify(cfg.WEBHOOK_SECRET, body, self.headers.get('X-Hub-Signature-256'), cfg.WEBHOOK_INSECURE):
+                    cfg.LOGGER.warning(f'Webhook {delivery} from {self.client_address[0]}: wrong signature.')
+                    status, text = 401, 'Wrong signature'
+                elif event == 'ping':
+                    status, text = 200, 'pong'
+                else:
+                    try:
+                        _queue.put((delivery, event, json.loads(body.decode('utf8'))))
+                        status, text = 202, 'Accepted'
+                    except ValueError:
+                        status, text = 400, 'Payload is not JSON'
+            metrics.inc('gitmon_webhooks_total', event=event or 'none', status=status)
+            self.reply(status, text)
+
+        def log_message(self, format, *args):
+            cfg.LOGGER.debug(f'Webhook request from {self.client_address[0]}: {format % args}')
+
+    try:
+        _server = ThreadingHTTPServer((host, port), Handler)
+    except OSError as e:
+        cfg.LOGGER.error(f'Error starting webhook receiver on {host}:{port}. Reason: {e}')
+        return False
+    _server.daemon_threads = True
+    threading.Thread(target=_process, args=(callback,), name='GitMon-webhook', daemon=True).start()
+    threading.Thread(target=_server.serve_forever, name='GitMon-webhook-server', daemon=True).start()
+    if not cfg.WEBHOOK_SECRET:
+        cfg.LOGGER.warning(f'webhook_secret is not set. Unsigned webhooks from anyone who can reach {host}:{port} '
+                           f'are accepted (webhook_insecure).')
+    cfg.LOGGER.info(f'Receiving github webhooks on http://{host}:{port}/')
+    return True
+
+
+def post(url, event, body, secret=''):
+    """Отправка payload (например, записанного ранее) в приемник, как это делает github
+
+    :param url: адрес приемника
+    :param event: push, release или ping
+    :param body: bytes
+    :param secret: webhook_secret
+    :return: (код ответа, текст ответа)
+    """
+    from urllib.error import HTTPError
+    from urllib.request import Request, urlopen
+    headers = {'Content-Type': 'application/json', 'X-GitHub-Event': event,
+               'X-GitHub-Delivery': f'local-{time.time():.6f}'}
+    if secret:
+        headers['X-Hub-Signature-256'] = sign(secret, body)
+    try:
+        res = urlopen(Request(url, data=body, headers=headers, method='POST'))
+    except HTTPError as e:
+        return e.code, e.read().decode('utf8')
+    return res.status, res.read().decode('utf8')
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Post a recorded github webhook payload to gitmon.py --serve')
+    parser.add_argument('payload', help='JSON file with the payload')
+    parser.add_argument('--url', default='http://127.0.0.1:8000/', help='address of the webhook receiver')
+    parser.add_argument('--event', default='push', help='X-GitHub-Event: push, release or ping')
+    parser.add_argument('--secret', default='', help='webhook_secret of the receiver')
+    args = parser.parse_args()
+    with open(args.payload, 'rb') as payload:
+        print(*post(args.url, args.event, payload.read(), args.secret))